@@ -0,0 +1,350 @@
+"""Headless benchmarks for the MPlay Batch save pipeline.
+
+Runs the real mplay_batch code against :class:`fake_hou.FakeHou` over a
+matrix of frame counts and flipbook directory sizes, and prints the
+timings as JSON so they can be compared between runs.
+
+Example::
+
+    python benchmarks/bench_mplay_batch.py --frames 100 1000 \\
+        --dir-sizes 0 10000 --output bench.json
+
+Execute benchmarks need ffmpeg on the PATH and are skipped without it.
+Exits with 1 if a menu click takes longer than ``--startup-limit`` to
+get to its first imgsave.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(
+    os.path.dirname(HERE), "houdini18.5", "python2.7libs"))
+
+from fake_hou import FakeHou  # noqa: E402
+
+HOU = FakeHou().install()
+
+import mplay_batch  # noqa: E402
+
+timer = getattr(time, "perf_counter", time.time)
+
+# Run in a fresh interpreter to time a menu click, as MPlay would on the
+# first click of a session. Prints the seconds taken to import
+# mplay_batch and to reach the first imgsave, then exits without saving.
+STARTUP_SCRIPT = """
+import os, sys, time
+timer = getattr(time, "perf_counter", time.time)
+sys.path[:0] = sys.argv[1:]
+from fake_hou import FakeHou
+hou = FakeHou(frange=(1, 1)).install()
+hscript = hou.hscript
+
+def first_imgsave(cmd):
+    if cmd.startswith("imgsave"):
+        sys.stdout.write("{0!r} {1!r}".format(imported, timer() - start))
+        sys.stdout.flush()
+        os._exit(0)
+    return hscript(cmd)
+
+hou.hscript = first_imgsave
+start = timer()
+import mplay_batch
+imported = timer() - start
+mplay_batch.main({"toolname": "save_current"})
+"""
+
+
+class Bench(object):
+    """Collects timings for one benchmark run."""
+
+    def __init__(self, repeat):
+        self.repeat = repeat
+        self.results = []
+
+    def measure(self, name, params, func, setup=None):
+        """Time ``func`` ``repeat`` times, calling ``setup`` untimed first.
+
+        ``setup``'s return value is passed to ``func``.
+        """
+        seconds = []
+        for _ in range(self.repeat):
+            arg = setup() if setup else None
+            start = timer()
+            func(arg)
+            seconds.append(timer() - start)
+        return self.add(name, params, seconds)
+
+    def add(self, name, params, seconds):
+        """Record timings taken some other way."""
+        seconds = sorted(seconds)
+        self.results.append({
+            "name": name,
+            "params": params,
+            "seconds": seconds,
+            "min": seconds[0],
+            "median": seconds[len(seconds) // 2],
+        })
+        sys.stderr.write("{0} {1}: {2:.6f}s\n".format(
+            name, json.dumps(params, sort_keys=True), seconds[0]))
+        return self.results[-1]
+
+    def skip(self, name, params, reason):
+        self.results.append({"name": name, "params": params, "skipped": reason})
+
+
+def make_template(root, resolution):
+    """Render a real frame with ffmpeg for imgsave to copy, if possible."""
+    if not mplay_batch.find_executable("ffmpeg"):
+        return None
+    path = os.path.join(root, "template.jpg")
+    subprocess.check_call([
+        "ffmpeg", "-nostdin", "-loglevel", "error", "-f", "lavfi",
+        "-i", "testsrc=size={0}".format(resolution), "-frames:v", "1",
+        "-y", path
+    ])
+    return path
+
+
+def populate(flipbook_dir, count):
+    """Fill a flipbook directory with ``count`` other hip files' saves."""
+    for i in range(count):
+        os.mkdir(os.path.join(flipbook_dir, "other_{0:06d}_000".format(i)))
+
+
+def new_env(root):
+    os.environ["MPLAY_BATCH_FLIPBOOK_DIR"] = tempfile.mkdtemp(dir=root)
+    return mplay_batch.Environment()
+
+
+def bench_environment(bench, root):
+    bench.measure(
+        "Environment", {}, lambda _: mplay_batch.Environment(),
+        setup=lambda: new_env(root))
+
+
+def bench_sub_version(bench, root, dir_size):
+    env = new_env(root)
+    populate(env.flipbook_dir, dir_size)
+    seq_dir = mplay_batch.SequenceDir("bench.hip", env)
+    index = mplay_batch.SubVersionIndex(env.flipbook_dir)
+
+    def drop_index():
+        try:
+            os.remove(index.index_path)
+        except OSError:
+            pass
+
+    params = {"dir_size": dir_size}
+    bench.measure(
+        "SequenceDir._next_sub_version.cold", params,
+        lambda _: seq_dir._next_sub_version(), setup=drop_index)
+    bench.measure(
+        "SequenceDir._next_sub_version.warm", params,
+        lambda _: seq_dir._next_sub_version())
+
+
+def write_sequence(env):
+    seq = mplay_batch.Sequence(mplay_batch.SequenceDir("bench.hip", env))
+    HOU.hscript(mplay_batch.SequenceWriterJob(seq).hscript_cmd)
+    return seq
+
+
+def bench_frames(bench, root, frames):
+    env = new_env(root)
+    params = {"frames": frames}
+    seq = write_sequence(env)
+    bench.measure(
+        "Sequence.frange_from_files", params,
+        lambda _: seq.frange_from_files())
+
+    def written():
+        seq = write_sequence(env)
+        seq.frange_from_files()
+        return seq
+
+    bench.measure(
+        "SequenceWriter.remove_image_sequence", params,
+        mplay_batch.SequenceWriter.remove_image_sequence, setup=written)
+
+
+def bench_execute(bench, root, frames, has_ffmpeg):
+    modes = {
+        "video": {"video": True},
+        "gif": {"gif": True},
+        "both": {"video": True, "gif": True},
+    }
+    for mode in sorted(modes):
+        params = {"frames": frames, "mode": mode}
+        name = "SequenceWriter.execute"
+        if not has_ffmpeg:
+            bench.skip(name, params, "ffmpeg not found")
+            continue
+
+        def writer(mode=mode):
+            return mplay_batch.SequenceWriter(
+                new_env(root), **modes[mode]).save_current()
+
+        bench.measure(name, params, lambda w: w.execute(), setup=writer)
+
+
+def bench_startup(bench, root, limit, has_ffmpeg):
+    """Time menu clicks from import to the first imgsave.
+
+    Warm clicks can use the bytecode cache. Cold ones import a fresh
+    copy of the modules without one, as on the first click after an
+    install or update.
+
+    :return: Whether every median was within ``limit`` seconds
+    :rtype: bool
+    """
+    lib_dir = os.path.dirname(mplay_batch.__file__)
+    ok = True
+    for mode, video in (("images", "0"), ("video", "1")):
+        for bytecode in ("warm", "cold"):
+            params = {"mode": mode, "bytecode": bytecode, "limit": limit}
+            if video == "1" and not has_ffmpeg:
+                bench.skip(
+                    "startup.first_imgsave", params, "ffmpeg not found")
+                continue
+            env = dict(os.environ)
+            env["MPLAY_BATCH_FLIPBOOK_DIR"] = tempfile.mkdtemp(dir=root)
+            env["MPLAY_BATCH_OUTPUT_VIDEO"] = video
+            imported, first = [], []
+            for _ in range(bench.repeat):
+                cmd = [sys.executable, "-c", STARTUP_SCRIPT, HERE, lib_dir]
+                if bytecode == "cold":
+                    cmd[1:1] = ["-B"]
+                    cmd[-1] = tempfile.mkdtemp(dir=root)
+                    for name in os.listdir(lib_dir):
+                        if name.endswith(".py"):
+                            shutil.copy(os.path.join(lib_dir, name), cmd[-1])
+                out = subprocess.check_output(cmd, env=env)
+                seconds = [float(value) for value in out.split()]
+                imported.append(seconds[0])
+                first.append(seconds[1])
+            bench.add("startup.import", params, imported)
+            result = bench.add("startup.first_imgsave", params, first)
+            result["over_limit"] = result["median"] > limit
+            ok = ok and not result["over_limit"]
+    return ok
+
+
+def bench_intermediate_formats(bench, root, frames, resolution, formats,
+                               has_ffmpeg):
+    """Compare image types as the intermediate format for imgsave.
+
+    MPlay's own write speed can't be measured headlessly, so ffmpeg
+    writing the same frames stands in for it. Reading them back is
+    what the encoder pays.
+    """
+    for ext in formats:
+        params = {"frames": frames, "resolution": resolution, "format": ext}
+        if not has_ffmpeg:
+            bench.skip("intermediate.write", params, "ffmpeg not found")
+            bench.skip("intermediate.read", params, "ffmpeg not found")
+            continue
+        dir_ = tempfile.mkdtemp(dir=root)
+        pattern = os.path.join(dir_, "frame.%d." + ext)
+
+        def write(_):
+            subprocess.check_call([
+                "ffmpeg", "-nostdin", "-loglevel", "error", "-f", "lavfi",
+                "-i", "testsrc=size={0}".format(resolution),
+                "-frames:v", str(frames), "-start_number", "1",
+                "-y", pattern
+            ])
+
+        def read(_):
+            subprocess.check_call([
+                "ffmpeg", "-nostdin", "-loglevel", "error",
+                "-start_number", "1", "-i", pattern, "-f", "null", "-"
+            ])
+
+        bench.measure("intermediate.write", params, write)
+        bench.measure("intermediate.read", params, read)
+        bench.results[-1]["bytes_per_frame"] = os.path.getsize(
+            pattern.replace("%d", "1"))
+        shutil.rmtree(dir_, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--frames", type=int, nargs="+", default=[100, 1000])
+    parser.add_argument(
+        "--dir-sizes", type=int, nargs="+", default=[0, 1000, 10000])
+    parser.add_argument(
+        "--frame-bytes", type=int, default=512 * 1024,
+        help="Size of each fake frame when ffmpeg isn't available")
+    parser.add_argument("--resolution", default="1920x1080")
+    parser.add_argument(
+        "--intermediate-formats", nargs="+",
+        default=["jpg", "tga", "bmp", "tif", "png"],
+        help="Image types to compare for MPLAY_BATCH_INTERMEDIATE_FORMAT")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--startup-limit", type=float, default=0.1,
+        help="Seconds a menu click may take to reach its first imgsave")
+    parser.add_argument("--no-execute", action="store_true")
+    parser.add_argument("--output", help="File to write JSON results to")
+    args = parser.parse_args(argv)
+
+    root = tempfile.mkdtemp(prefix="mplay_batch_bench_")
+    os.environ["MPLAY_BATCH_CACHE_DIR"] = os.path.join(root, "cache")
+    try:
+        HOU.template = make_template(root, args.resolution)
+        HOU.frame_bytes = args.frame_bytes
+        caps = mplay_batch.ffmpeg_capabilities()
+        bench = Bench(args.repeat)
+
+        startup_ok = bench_startup(
+            bench, root, args.startup_limit, bool(caps.path))
+        bench_environment(bench, root)
+        for dir_size in args.dir_sizes:
+            bench_sub_version(bench, root, dir_size)
+        for frames in args.frames:
+            HOU.frange = (1, frames)
+            bench_frames(bench, root, frames)
+            if not args.no_execute:
+                bench_execute(bench, root, frames, bool(caps.path))
+                bench_intermediate_formats(
+                    bench, root, frames, args.resolution,
+                    args.intermediate_formats, bool(caps.path))
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "time": time.time(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": mplay_batch.available_cpus(),
+            "ffmpeg": caps.version or None,
+            "resolution": args.resolution if HOU.template else None,
+            "frame_bytes": None if HOU.template else args.frame_bytes,
+            "repeat": args.repeat,
+        },
+        "results": bench.results,
+    }
+    if args.output:
+        with open(args.output, "w") as file_:
+            json.dump(report, file_, indent=4, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=4, sort_keys=True)
+        sys.stdout.write("\n")
+    if not startup_ok:
+        sys.stderr.write("Startup took longer than {0}s\n".format(
+            args.startup_limit))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,80 @@
+"""Stand-in for Houdini's ``hou`` module, so mplay_batch runs headless.
+
+Only answers what mplay_batch asks of MPlay: ``frange``, ``seqls`` and
+``imgsave`` through :func:`hscript`, plus ``fps``, ``expandString``,
+``getenv`` and ``hipFile.basename``. ``imgsave`` copies a template
+frame once per frame in the session's range.
+"""
+import os
+import shutil
+import sys
+import types
+
+
+class _HipFile(object):
+
+    def __init__(self, name):
+        self.name = name
+
+    def basename(self):
+        return self.name
+
+
+class FakeHou(types.ModuleType):
+    """Fake ``hou`` module simulating an MPlay session.
+
+    :param frange: First and last frame of the session
+    :type frange: tuple
+    :param seqls: Names of the sequences loaded in the session
+    :type seqls: list of str
+    :param template: Frame file for ``imgsave`` to copy. If None,
+        frames are filled with ``frame_bytes`` of zeros
+    :type template: str
+    :param frame_bytes: Size of each frame when there is no template
+    :type frame_bytes: int
+    """
+
+    def __init__(self, frange=(1, 100), seqls=("seq",), fps=24.0,
+                 hip_name="bench.hip", template=None, frame_bytes=1024):
+        super(FakeHou, self).__init__("hou")
+        self.frange = frange
+        self.seqls = list(seqls)
+        self.template = template
+        self.frame_bytes = frame_bytes
+        self.hipFile = _HipFile(hip_name)
+        self._fps = fps
+        self.calls = []
+
+    def install(self):
+        """Register this module as ``hou`` for later imports."""
+        sys.modules["hou"] = self
+        return self
+
+    def fps(self):
+        return self._fps
+
+    def expandString(self, value):
+        return os.path.expandvars(value)
+
+    def getenv(self, name):
+        return os.environ.get(name)
+
+    def hscript(self, cmd):
+        self.calls.append(cmd)
+        if cmd == "frange":
+            return ("Frame range: {0} to {1}\n".format(*self.frange), "")
+        if cmd == "seqls":
+            return ("".join(name + "\n" for name in self.seqls), "")
+        if cmd.startswith("imgsave"):
+            self._imgsave(cmd.split(" -a ", 1)[1])
+            return ("", "")
+        raise ValueError("Unsupported hscript command: {0}".format(cmd))
+
+    def _imgsave(self, pattern):
+        for frame in range(self.frange[0], self.frange[1] + 1):
+            path = pattern.replace(r"\$\F", str(frame))
+            if self.template:
+                shutil.copyfile(self.template, path)
+            else:
+                with open(path, "wb") as file_:
+                    file_.write(b"\0" * self.frame_bytes)
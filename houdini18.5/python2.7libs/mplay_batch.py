@@ -1,16 +1,90 @@
-"""MPlay Batch Save Utilities"""
+"""MPlay Batch Save Utilities
+
+Every menu click imports this module, so modules that only some tools
+need are imported where they're used. That includes the rest of MPlay
+Batch, which is split out by tool: :mod:`mplay_batch_catalog`,
+:mod:`mplay_batch_daemon`, :mod:`mplay_batch_plan`,
+:mod:`mplay_batch_retention` and the command line in
+:mod:`mplay_batch_cli`.
+"""
+import array
+import contextlib
 import errno
-import glob
+import json
 import os
 import re
 import shlex
+import shutil
+import stat
 import subprocess
 import sys
 import tempfile
-
-from distutils.spawn import find_executable
-
-import hou
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+try:
+    from shutil import which as find_executable
+except ImportError:
+    # Python 2. distutils is slow to import, so only load it when needed
+    def find_executable(name):
+        from distutils.spawn import find_executable as find
+        return find(name)
+
+try:
+    import hou
+except ImportError:
+    # Running outside Houdini, e.g. as the encode daemon
+    hou = None
+
+# Most precise clock for timing stages
+_timer = getattr(time, "perf_counter", time.time)
+
+# Rough number of threads one x264 encode of a flipbook can keep busy
+THREADS_PER_ENCODER = 4
+
+# Free space to leave on the staging volume, and the frame size a plan
+# assumes when no saves have been recorded yet
+STAGING_RESERVE_BYTES = 256 * 1024 * 1024
+STAGING_DEFAULT_FRAME_BYTES = 2 * 1024 * 1024
+
+# Built-in video encoding profiles, selected by MPLAY_BATCH_ENCODE_PROFILE.
+# Settings left out fall back to ffmpeg's defaults.
+ENCODE_PROFILES = {
+    "default": {"codec": "libx264", "pix_fmt": "yuv420p"},
+    "preview": {
+        "codec": "libx264",
+        "preset": "ultrafast",
+        "tune": "fastdecode",
+        "crf": 28,
+        "pix_fmt": "yuv420p"
+    },
+    "delivery": {
+        "codec": "libx264",
+        "preset": "slow",
+        "crf": 16,
+        "pix_fmt": "yuv420p"
+    },
+}
+
+# Longest sequence to make a GIF from in a single decode. Beyond this,
+# holding every frame in memory for paletteuse costs too much.
+GIF_SINGLE_PASS_MAX_FRAMES = 300
+
+# x264's default keyframe interval. Chunks of a long sequence are a
+# multiple of it, so they start on the frames a single encode would
+# place its regular keyframes on.
+CHUNK_GOP_FRAMES = 250
 
 
 class EnvironmentVariableTypeError(Exception):
@@ -58,12 +132,43 @@ class FFmpegFailedError(Exception):
             self.message = "{0}\nCommand: {1}\nReturn Code: {2}\n".format(
                 self.message, error.cmd, error.returncode
             )
+            if error.output:
+                self.message = "{0}\nffmpeg said:\n{1}\n".format(
+                    self.message, error.output.strip())
+        super(FFmpegFailedError, self).__init__(self.message)
+
+    def __str__(self):
+        return self.message
+
+
+class FFmpegBatchFailedError(FFmpegFailedError):
+    """Error for when ffmpeg fails on more than one sequence in a batch."""
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.message = "Failed to write {0} sequences\n\n{1}".format(
+            len(failures),
+            "\n".join(str(failure) for failure in failures)
+        )
+        # Skip FFmpegFailedError's init, which formats a single failure
         super(FFmpegFailedError, self).__init__(self.message)
 
     def __str__(self):
         return self.message
 
 
+class ImageConversionError(Exception):
+    """Error for when intermediate frames can't be converted."""
+
+    def __init__(self, seq_pattern, errors):
+        self.message = "Failed to convert {0} frames of {1}\n\n{2}".format(
+            len(errors), seq_pattern, errors[0])
+        super(ImageConversionError, self).__init__(self.message)
+
+    def __str__(self):
+        return self.message
+
+
 class UnsupportedVideoFormatError(Exception):
     """Error for an invalid video type."""
 
@@ -83,8 +188,165 @@ class UnsupportedVideoFormatError(Exception):
         return self.message
 
 
+class UnsupportedEncodeProfileError(Exception):
+    """Error for an unknown encode profile, or one ffmpeg can't run."""
+
+    def __init__(self, profile, reason):
+        self.message = (
+            "The \"{0}\" encode profile can't be used: {1}\n"
+            "Check the value set for MPLAY_BATCH_ENCODE_PROFILE "
+            "in mplay_batch.json".format(profile, reason)
+        )
+        super(UnsupportedEncodeProfileError, self).__init__(self.message)
+
+    def __str__(self):
+        return self.message
+
+
+class EncodeProfile(object):
+    """Named set of video encoder settings.
+
+    :param name: Profile name
+    :type name: str
+    :param codec: ffmpeg encoder, e.g. ``libx264``
+    :type codec: str
+    :param preset: Encoder speed preset, if the encoder has them
+    :type preset: str
+    :param tune: Encoder tuning, if the encoder has it
+    :type tune: str
+    :param crf: Constant rate factor. Lower is better quality
+    :type crf: int
+    :param threads: Threads per encode. 0 shares the CPUs between
+        encodes automatically
+    :type threads: int
+    :param pix_fmt: Output pixel format
+    :type pix_fmt: str
+    """
+
+    def __init__(self, name, codec="libx264", preset=None, tune=None,
+                 crf=None, threads=0, pix_fmt="yuv420p"):
+        self.name = name
+        self.codec = codec
+        self.preset = preset
+        self.tune = tune
+        self.crf = crf
+        self.threads = threads
+        self.pix_fmt = pix_fmt
+
+    @classmethod
+    def named(cls, name):
+        """Look up a profile by name.
+
+        Profiles in the JSON file named by MPLAY_BATCH_ENCODE_PROFILES
+        are checked first, then the built-in :data:`ENCODE_PROFILES`.
+
+        :raises UnsupportedEncodeProfileError: No profile by that name
+        :return: The profile
+        :rtype: :class:`EncodeProfile`
+        """
+        profiles = dict(ENCODE_PROFILES)
+        path = os.environ.get("MPLAY_BATCH_ENCODE_PROFILES")
+        if path:
+            try:
+                with open(path) as file_:
+                    profiles.update(json.load(file_))
+            except (IOError, OSError, ValueError) as err:
+                raise UnsupportedEncodeProfileError(
+                    name, "couldn't read {0}: {1}".format(path, err))
+        try:
+            return cls(name, **profiles[name])
+        except KeyError:
+            raise UnsupportedEncodeProfileError(
+                name, "no such profile. Available profiles: {0}".format(
+                    ", ".join(sorted(profiles))))
+        except TypeError as err:
+            raise UnsupportedEncodeProfileError(name, str(err))
+
+    def ffmpeg_args(self, threads=0):
+        """Output options for ffmpeg to encode with this profile.
+
+        :param threads: Threads to use when the profile doesn't say
+        :type threads: int
+        :return: Command-line arguments
+        :rtype: list of str
+        """
+        args = ["-threads", str(self.threads or threads), "-c:v", self.codec]
+        for flag, value in (
+                ("-preset", self.preset),
+                ("-tune", self.tune),
+                ("-crf", self.crf),
+                ("-pix_fmt", self.pix_fmt)
+        ):
+            if value is not None:
+                args += [flag, str(value)]
+        return args
+
+
+class Proxy(object):
+    """Smaller copy of a sequence's video, written alongside it.
+
+    Sized either by a scale factor of the full resolution, or by a
+    maximum width that smaller sequences are left at.
+
+    :param scale: Fraction of the full resolution, e.g. 0.5
+    :type scale: float
+    :param max_width: Largest width in pixels
+    :type max_width: int
+    """
+
+    def __init__(self, scale=None, max_width=None):
+        if (scale is None) == (max_width is None):
+            raise ValueError("Give a proxy either a scale or a max width")
+        self.scale = scale
+        self.max_width = max_width
+
+    @classmethod
+    def parse(cls, value):
+        """Make a proxy from a setting like ``0.5`` or ``1280``.
+
+        Values up to 1 are scales, larger ones are maximum widths.
+
+        :raises ValueError: Not a positive number
+        :return: The proxy
+        :rtype: :class:`Proxy`
+        """
+        number = float(value)
+        if number <= 0:
+            raise ValueError("Proxy sizes must be positive")
+        if number <= 1:
+            return cls(scale=number)
+        return cls(max_width=int(number))
+
+    @property
+    def setting(self):
+        """Value for MPLAY_BATCH_PROXIES that makes this proxy."""
+        return "{0:g}".format(
+            self.scale if self.scale is not None else self.max_width)
+
+    @property
+    def suffix(self):
+        """File name suffix, e.g. ``_50pct`` or ``_1280w``."""
+        if self.scale is not None:
+            return "_{0:g}pct".format(self.scale * 100)
+        return "_{0}w".format(self.max_width)
+
+    def scale_filter(self):
+        """ffmpeg filter to resize to this proxy, keeping sizes even."""
+        if self.scale is not None:
+            width = "trunc(iw*{0}/2)*2".format(self.scale)
+        else:
+            width = "trunc(min({0}\\,iw)/2)*2".format(self.max_width)
+        return "scale={0}:-2".format(width)
+
+
 class Environment(object):
-    """Object to initialize and store information about the session."""
+    """Object to initialize and store information about the session.
+
+    Settings that cost more than parsing to check are only resolved the
+    first time they're used: the encode profile, which may be read from
+    a JSON file, and the flipbook and staging directories, which are
+    looked up on disk. So each menu tool only pays for what it needs.
+    """
 
     def __init__(
             self,
@@ -92,21 +354,73 @@ class Environment(object):
             video_format="mp4",
             flipbook_dir="$JOB/flip",
             pad_sub_version=3,
-            pad_seq_index=0
+            pad_seq_index=0,
+            pipeline=True,
+            max_encoders=0,
+            staging_dir="auto",
+            encode_daemon=False,
+            stats=True,
+            encode_profile="default",
+            proxies="",
+            intermediate_format="",
+            incremental=False,
+            held_frames=False,
+            chunk_frames=0,
+            catalog=True,
+            keep_sub_versions=0,
+            max_age_days=0,
+            max_size_gb=0,
+            gif_max_size_mb=0,
+            gif_max_seconds=0,
+            max_batch_minutes=0
     ):
         self._ext = ""
         self._video_format = ""
-        self._flipbook_dir = ""
+        self._flipbook_dir = None
+        self._flipbook_dir_setting = ""
         self._pad_sub_version = 3
         self._pad_seq_index = 0
+        self._pipeline = True
+        self._max_encoders = 0
+        self._staging_dir = None
+        self._staging_dir_setting = ""
+        self._encode_daemon = False
+        self._stats = True
+        self._encode_profile = None
+        self._encode_profile_name = ""
+        self._proxies = []
+        self._intermediate_format = ""
+        self._incremental = False
+        self._held_frames = False
+        self._chunk_frames = 0
+        self._catalog = True
+        self._keep_sub_versions = 0
+        self._max_age_days = 0.0
+        self._max_size_gb = 0.0
+        self._gif_max_size_mb = 0.0
+        self._gif_max_seconds = 0.0
+        self._max_batch_minutes = 0.0
         try:
             self.ext = os.environ["MPLAY_BATCH_EXTENSION"]
         except KeyError:
             self.ext = ext
+        try:
+            self.intermediate_format = os.environ[
+                "MPLAY_BATCH_INTERMEDIATE_FORMAT"]
+        except KeyError:
+            self.intermediate_format = intermediate_format
         try:
             self.video_format = os.environ["MPLAY_BATCH_VIDEO_FORMAT"]
         except KeyError:
             self.video_format = video_format
+        try:
+            self.encode_profile = os.environ["MPLAY_BATCH_ENCODE_PROFILE"]
+        except KeyError:
+            self.encode_profile = encode_profile
+        try:
+            self.proxies = os.environ["MPLAY_BATCH_PROXIES"]
+        except KeyError:
+            self.proxies = proxies
         try:
             self.flipbook_dir = os.environ["MPLAY_BATCH_FLIPBOOK_DIR"]
         except KeyError:
@@ -119,8 +433,75 @@ class Environment(object):
             self.pad_seq_index = os.environ["MPLAY_BATCH_PAD_SEQ_INDEX"]
         except KeyError:
             self.pad_seq_index = pad_seq_index
+        try:
+            self.pipeline = os.environ["MPLAY_BATCH_PIPELINE"]
+        except KeyError:
+            self.pipeline = pipeline
+        try:
+            self.max_encoders = os.environ["MPLAY_BATCH_MAX_ENCODERS"]
+        except KeyError:
+            self.max_encoders = max_encoders
+        try:
+            self.staging_dir = os.environ["MPLAY_BATCH_STAGING_DIR"]
+        except KeyError:
+            self.staging_dir = staging_dir
+        try:
+            self.encode_daemon = os.environ["MPLAY_BATCH_ENCODE_DAEMON"]
+        except KeyError:
+            self.encode_daemon = encode_daemon
+        try:
+            self.stats = os.environ["MPLAY_BATCH_STATS"]
+        except KeyError:
+            self.stats = stats
+        try:
+            self.incremental = os.environ["MPLAY_BATCH_INCREMENTAL"]
+        except KeyError:
+            self.incremental = incremental
+        try:
+            self.held_frames = os.environ["MPLAY_BATCH_HELD_FRAMES"]
+        except KeyError:
+            self.held_frames = held_frames
+        try:
+            self.chunk_frames = os.environ["MPLAY_BATCH_CHUNK_FRAMES"]
+        except KeyError:
+            self.chunk_frames = chunk_frames
+        try:
+            self.catalog = os.environ["MPLAY_BATCH_CATALOG"]
+        except KeyError:
+            self.catalog = catalog
+        try:
+            self.keep_sub_versions = os.environ[
+                "MPLAY_BATCH_KEEP_SUB_VERSIONS"]
+        except KeyError:
+            self.keep_sub_versions = keep_sub_versions
+        try:
+            self.max_age_days = os.environ["MPLAY_BATCH_MAX_AGE_DAYS"]
+        except KeyError:
+            self.max_age_days = max_age_days
+        try:
+            self.max_size_gb = os.environ["MPLAY_BATCH_MAX_SIZE_GB"]
+        except KeyError:
+            self.max_size_gb = max_size_gb
+        try:
+            self.gif_max_size_mb = os.environ["MPLAY_BATCH_GIF_MAX_SIZE_MB"]
+        except KeyError:
+            self.gif_max_size_mb = gif_max_size_mb
+        try:
+            self.gif_max_seconds = os.environ["MPLAY_BATCH_GIF_MAX_SECONDS"]
+        except KeyError:
+            self.gif_max_seconds = gif_max_seconds
+        try:
+            self.max_batch_minutes = os.environ[
+                "MPLAY_BATCH_MAX_BATCH_MINUTES"]
+        except KeyError:
+            self.max_batch_minutes = max_batch_minutes
 
-        self.fps = hou.fps()
+        self.session = MPlaySession()
+
+    @property
+    def fps(self):
+        """Playback rate of the MPlay session."""
+        return self.session.fps
 
     @staticmethod
     def mplay_frange():
@@ -163,6 +544,24 @@ class Environment(object):
     def ext(self, extension):
         self._ext = re.sub(r"(\.?)(\w*\d*\.*)", r"\2", extension)
 
+    @property
+    def intermediate_format(self):
+        """Cheap image type for imgsave to write when encoding.
+
+        ffmpeg reads these frames directly. When the image sequence is
+        kept, they are converted to :attr:`ext` in parallel, off
+        MPlay's thread. Empty writes :attr:`ext` directly.
+
+        :param extension: Intermediate file extension
+        :type extension: str
+        """
+        return self._intermediate_format
+
+    @intermediate_format.setter
+    def intermediate_format(self, extension):
+        self._intermediate_format = re.sub(
+            r"(\.?)(\w*\d*\.*)", r"\2", extension)
+
     @property
     def video_format(self):
         """Video format to write with ffmpeg.
@@ -174,32 +573,79 @@ class Environment(object):
 
     @video_format.setter
     def video_format(self, extension):
-        # TODO: Is it lame that ffmpeg is queried whenever this obj is created?
-        format_ = re.sub(r"(\.?)(\w*\d*\.*)", r"\2", extension)
-        if not self.find_ffmpeg(silent=True):
-            # Just set it anyway and do an early return.
-            self._video_format = format_
-            return
-        available_formats = self.ffmpeg_available_formats()
-        if format_ in available_formats:
-            self._video_format = format_
-        else:
-            raise UnsupportedVideoFormatError(format_, available_formats)
+        self._video_format = re.sub(r"(\.?)(\w*\d*\.*)", r"\2", extension)
+
+    @property
+    def encode_profile(self):
+        """Video encoding settings to use.
+
+        Looked up the first time it's used.
+
+        :param name: Name of the profile
+        :type name: str
+        :raises UnsupportedEncodeProfileError: Unknown profile
+        """
+        if self._encode_profile is None:
+            self._encode_profile = EncodeProfile.named(
+                self._encode_profile_name)
+        return self._encode_profile
+
+    @encode_profile.setter
+    def encode_profile(self, name):
+        self._encode_profile_name = name
+        self._encode_profile = None
+
+    @property
+    def proxies(self):
+        """Smaller copies of each video to write alongside it.
+
+        :param sizes: Comma-separated scales (``0.5``) or max widths
+            (``1280``)
+        :type sizes: str
+        """
+        return self._proxies
+
+    @proxies.setter
+    def proxies(self, sizes):
+        try:
+            self._proxies = [
+                Proxy.parse(size) for size in sizes.split(",") if size.strip()
+            ]
+        except ValueError:
+            raise EnvironmentVariableTypeError(
+                "MPLAY_BATCH_PROXIES", "comma-separated numbers")
 
     @property
     def flipbook_dir(self):
         """Validate existence of and set flipbook directory to write to.
 
+        Expanded, and created if it doesn't exist, the first time it's
+        used.
+
         :param dir_: Directory to write flipbook sequences into
         :type dir_: str
+        :raises ValueError: The path isn't a directory, or has a
+            variable that isn't set
         """
+        if self._flipbook_dir is None:
+            self._flipbook_dir = self._make_flipbook_dir(
+                self._flipbook_dir_setting)
         return self._flipbook_dir
 
     @flipbook_dir.setter
     def flipbook_dir(self, dir_):
         # Replace everything surrounded by __ with a $ prefix
-        dir_ = re.sub(r"__(\w+)__", r"$\1", dir_)
-        dir_ = hou.expandString(dir_)
+        self._flipbook_dir_setting = re.sub(r"__(\w+)__", r"$\1", dir_)
+        self._flipbook_dir = None
+
+    @staticmethod
+    def _make_flipbook_dir(dir_):
+        try:
+            dir_ = _expand_string(dir_, strict=True)
+        except ValueError as err:
+            raise ValueError(
+                "{0}. Set MPLAY_BATCH_FLIPBOOK_DIR to where flipbooks "
+                "should go".format(err))
         if not os.path.exists(dir_):
             try:
                 os.makedirs(dir_)
@@ -209,7 +655,7 @@ class Environment(object):
         # Verify that it is a directory
         if not os.path.isdir(dir_):
             raise ValueError("{0} is not a directory".format(dir_))
-        self._flipbook_dir = dir_
+        return dir_
 
     @property
     def pad_sub_version(self):
@@ -239,6 +685,286 @@ class Environment(object):
         self._pad_seq_index = self._validate_padding(
             padding, "MPLAY_BATCH_PAD_SEQ_INDEX")
 
+    @property
+    def pipeline(self):
+        """Overlap image writes with ffmpeg encodes of previous sequences.
+
+        :param enabled: Whether to encode in the background
+        :type enabled: bool or int
+        """
+        return self._pipeline
+
+    @pipeline.setter
+    def pipeline(self, enabled):
+        try:
+            enabled = int(enabled)
+        except ValueError:
+            raise EnvironmentVariableTypeError("MPLAY_BATCH_PIPELINE", "int")
+        self._pipeline = bool(enabled)
+
+    @property
+    def encode_daemon(self):
+        """Hand encodes to a background daemon instead of waiting on them.
+
+        :param enabled: Whether to use the encode daemon
+        :type enabled: bool or int
+        """
+        return self._encode_daemon
+
+    @encode_daemon.setter
+    def encode_daemon(self, enabled):
+        try:
+            enabled = int(enabled)
+        except ValueError:
+            raise EnvironmentVariableTypeError(
+                "MPLAY_BATCH_ENCODE_DAEMON", "int")
+        self._encode_daemon = bool(enabled)
+
+    @property
+    def stats(self):
+        """Record how long each stage of each job takes.
+
+        :param enabled: Whether to write per-stage stats
+        :type enabled: bool or int
+        """
+        return self._stats
+
+    @stats.setter
+    def stats(self, enabled):
+        try:
+            enabled = int(enabled)
+        except ValueError:
+            raise EnvironmentVariableTypeError("MPLAY_BATCH_STATS", "int")
+        self._stats = bool(enabled)
+
+    @property
+    def incremental(self):
+        """Reuse the last sub-version's files for unchanged sequences.
+
+        Off by default, since it hashes every frame on MPlay's thread
+        after each imgsave.
+
+        :param enabled: Whether to skip encoding unchanged sequences
+        :type enabled: bool or int
+        """
+        return self._incremental
+
+    @incremental.setter
+    def incremental(self, enabled):
+        try:
+            enabled = int(enabled)
+        except ValueError:
+            raise EnvironmentVariableTypeError(
+                "MPLAY_BATCH_INCREMENTAL", "int")
+        self._incremental = bool(enabled)
+
+    @property
+    def held_frames(self):
+        """Store runs of identical frames once and encode them as holds.
+
+        Off by default. It hashes every frame on MPlay's thread, and mp4s
+        with holds are encoded at a variable frame rate.
+
+        :param enabled: Whether to look for held frames
+        :type enabled: bool or int
+        """
+        return self._held_frames
+
+    @held_frames.setter
+    def held_frames(self, enabled):
+        try:
+            enabled = int(enabled)
+        except ValueError:
+            raise EnvironmentVariableTypeError(
+                "MPLAY_BATCH_HELD_FRAMES", "int")
+        self._held_frames = bool(enabled)
+
+    @property
+    def catalog(self):
+        """Record finished sequences in the flipbook catalog.
+
+        See :class:`mplay_batch_catalog.FlipbookCatalog`.
+
+        :param enabled: Whether to catalog sequences
+        :type enabled: bool or int
+        """
+        return self._catalog
+
+    @catalog.setter
+    def catalog(self, enabled):
+        try:
+            enabled = int(enabled)
+        except ValueError:
+            raise EnvironmentVariableTypeError("MPLAY_BATCH_CATALOG", "int")
+        self._catalog = bool(enabled)
+
+    @property
+    def keep_sub_versions(self):
+        """Sub-versions of each name to keep when pruning.
+
+        A value of 0 keeps them all.
+
+        :param count: Number of sub-versions
+        :type count: int
+        """
+        return self._keep_sub_versions
+
+    @keep_sub_versions.setter
+    def keep_sub_versions(self, count):
+        self._keep_sub_versions = self._validate_padding(
+            count, "MPLAY_BATCH_KEEP_SUB_VERSIONS")
+
+    @property
+    def max_age_days(self):
+        """Days since it was written after which a sub-version is pruned.
+
+        A value of 0 prunes nothing for its age.
+
+        :param days: Age limit
+        :type days: float
+        """
+        return self._max_age_days
+
+    @max_age_days.setter
+    def max_age_days(self, days):
+        self._max_age_days = self._validate_amount(
+            days, "MPLAY_BATCH_MAX_AGE_DAYS")
+
+    @property
+    def max_size_gb(self):
+        """Size to keep the flipbook directory under by pruning.
+
+        A value of 0 prunes nothing for size.
+
+        :param size: Size limit in gigabytes
+        :type size: float
+        """
+        return self._max_size_gb
+
+    @max_size_gb.setter
+    def max_size_gb(self, size):
+        self._max_size_gb = self._validate_amount(
+            size, "MPLAY_BATCH_MAX_SIZE_GB")
+
+    @property
+    def gif_max_size_mb(self):
+        """Largest GIF to write, in megabytes.
+
+        Frames are dropped and the GIF scaled down to fit. A value of 0
+        writes every frame at full size.
+
+        :param size: Size limit
+        :type size: float
+        """
+        return self._gif_max_size_mb
+
+    @gif_max_size_mb.setter
+    def gif_max_size_mb(self, size):
+        self._gif_max_size_mb = self._validate_amount(
+            size, "MPLAY_BATCH_GIF_MAX_SIZE_MB")
+
+    @property
+    def gif_max_seconds(self):
+        """Longest a GIF may take to encode.
+
+        Frames are dropped and the GIF scaled down to finish in time. A
+        value of 0 writes every frame at full size.
+
+        :param seconds: Time limit
+        :type seconds: float
+        """
+        return self._gif_max_seconds
+
+    @gif_max_seconds.setter
+    def gif_max_seconds(self, seconds):
+        self._gif_max_seconds = self._validate_amount(
+            seconds, "MPLAY_BATCH_GIF_MAX_SECONDS")
+
+    @property
+    def max_batch_minutes(self):
+        """Longest a save from the menu should take, encodes included.
+
+        Saves the :class:`mplay_batch_plan.BatchPlan` expects to take
+        longer ask before they start. A value of 0 never asks.
+
+        :param minutes: Time limit
+        :type minutes: float
+        """
+        return self._max_batch_minutes
+
+    @max_batch_minutes.setter
+    def max_batch_minutes(self, minutes):
+        self._max_batch_minutes = self._validate_amount(
+            minutes, "MPLAY_BATCH_MAX_BATCH_MINUTES")
+
+    @property
+    def max_encoders(self):
+        """Maximum number of ffmpeg processes to run at once.
+
+        A value of 0 picks a count based on the CPUs available.
+
+        :param count: Number of concurrent encodes
+        :type count: int
+        """
+        if not self._max_encoders:
+            return max(1, available_cpus() // THREADS_PER_ENCODER)
+        return self._max_encoders
+
+    @max_encoders.setter
+    def max_encoders(self, count):
+        self._max_encoders = self._validate_padding(
+            count, "MPLAY_BATCH_MAX_ENCODERS")
+
+    @property
+    def chunk_frames(self):
+        """Length above which a video is encoded in parallel chunks.
+
+        A value of 0 always encodes a video in one piece.
+
+        :param count: Frames per chunk
+        :type count: int
+        """
+        return self._chunk_frames
+
+    @chunk_frames.setter
+    def chunk_frames(self, count):
+        self._chunk_frames = self._validate_padding(
+            count, "MPLAY_BATCH_CHUNK_FRAMES")
+
+    @property
+    def staging_dir(self):
+        """Local scratch directory for frames only kept until encoded.
+
+        ``auto`` uses ``/dev/shm`` where it exists, otherwise the
+        system's temp directory. An empty value disables staging. Looked
+        up the first time it's used.
+
+        :param dir_: Directory to stage frames in
+        :type dir_: str
+        :raises ValueError: The path isn't a directory
+        """
+        if self._staging_dir is None:
+            self._staging_dir = self._find_staging_dir(
+                self._staging_dir_setting)
+        return self._staging_dir
+
+    @staging_dir.setter
+    def staging_dir(self, dir_):
+        self._staging_dir_setting = dir_
+        self._staging_dir = None
+
+    @staticmethod
+    def _find_staging_dir(dir_):
+        if dir_ == "auto":
+            dir_ = "/dev/shm"
+            if not os.path.isdir(dir_):
+                dir_ = tempfile.gettempdir()
+        elif dir_:
+            dir_ = _expand_string(re.sub(r"__(\w+)__", r"$\1", dir_))
+            if not os.path.isdir(dir_):
+                raise ValueError("{0} is not a directory".format(dir_))
+        return dir_
+
     @staticmethod
     def _validate_padding(padding, var_name):
         try:
@@ -249,6 +975,16 @@ class Environment(object):
             raise EnvironmentVariableValueError(var_name)
         return padding
 
+    @staticmethod
+    def _validate_amount(amount, var_name):
+        try:
+            amount = float(amount)
+        except ValueError:
+            raise EnvironmentVariableTypeError(var_name, "float")
+        if amount < 0:
+            raise EnvironmentVariableValueError(var_name)
+        return amount
+
     @staticmethod
     def check_toggle_variable(var):
         """Check the state of menu toggle's variable.
@@ -265,36 +1001,67 @@ class Environment(object):
             value = 0
         return value
 
+    def check_ffmpeg(self, video=True):
+        """Check that ffmpeg can write what these settings ask for.
+
+        Only saves that export video or GIFs need ffmpeg, so this is
+        left to them instead of being done on construction. Bad
+        settings still fail before any sequences are written.
+
+        :param video: Also check the video format and encode profile
+        :type video: bool
+        :raises MissingFFmpegError: Can't find ffmpeg
+        :raises UnsupportedVideoFormatError: ffmpeg can't write
+            :attr:`video_format`
+        :raises UnsupportedEncodeProfileError: ffmpeg doesn't have the
+            encode profile's encoder
+        """
+        self.find_ffmpeg()
+        if not video:
+            return
+        available_formats = self.ffmpeg_available_formats()
+        if self.video_format not in available_formats:
+            raise UnsupportedVideoFormatError(
+                self.video_format, available_formats)
+        codec = self.encode_profile.codec
+        if codec not in self.ffmpeg_available_encoders():
+            raise UnsupportedEncodeProfileError(
+                self.encode_profile.name,
+                "ffmpeg has no \"{0}\" encoder".format(codec))
+
     @staticmethod
     def find_ffmpeg(silent=False):
         """Locate the ffmpeg executable on disk.
 
+        The location comes from the ffmpeg capability cache, so the
+        PATH is only searched when the cache is missing or stale.
+
         :raises MissingFFmpegError: Can't find ffmpeg
         :return: Path to ffmpeg executable
         :rtype: str
         """
-        ffmpeg_path = find_executable("ffmpeg")
+        ffmpeg_path = ffmpeg_capabilities().path
         if not ffmpeg_path and not silent:
             raise MissingFFmpegError
         return ffmpeg_path
 
-    def ffmpeg_available_formats(self):
+    @staticmethod
+    def ffmpeg_available_formats():
         """Get a list of available ffmpeg formats on this machine.
 
         :return: List of formats
         :rtype: list of str
         """
-        cmd = shlex.split("ffmpeg -hide_banner -loglevel error -formats")
-        if "linux" in sys.platform:
-            cmd.remove("-hide_banner")
-        out = subprocess.check_output(cmd, **self.subprocess_kwargs())
-        regex = re.compile(r"\s*(\w*)\s+(\w+)\s+(\w*)")
-        formats = []
-        for line in out.decode("utf-8").split("--")[1].split("\n"):
-            match = regex.match(line)
-            if match:
-                formats.append(match.group(2))
-        return formats
+        return ffmpeg_capabilities().formats
+
+    @staticmethod
+    def ffmpeg_available_encoders():
+        """Get a list of available ffmpeg encoders on this machine.
+
+        :return: List of encoder names
+        :rtype: list of str
+        """
+        return ffmpeg_capabilities().encoders
 
     @staticmethod
     def subprocess_kwargs():
@@ -316,24 +1083,78 @@ class Environment(object):
         return kwargs
 
 
-class SequenceDir(object):
-    """A place to write sequences into."""
+class MPlaySession(object):
+    """Snapshot of the MPlay session's frame range, sequences and fps.
 
-    def __init__(self, name, env):
-        self._env = None
-        self._name = ""
-        self._dirname = ""
-        self._sub_version = None
+    Each value is queried from MPlay the first time it is needed and
+    then reused, so building many :class:`Sequence` objects doesn't
+    cost an hscript round-trip each. Call :meth:`refresh` if the
+    session changes while the snapshot is still in use.
 
-        self.env = env
-        self.name = name
+    Values can also be given up front, to work without MPlay.
 
-    @property
-    def name(self):
-        """Name of the sequence, typically based on $HIPNAME.
+    :param frange: Frame range to use instead of MPlay's
+    :type frange: tuple
+    :param seqls: Sequence names to use instead of MPlay's
+    :type seqls: list of str
+    :param fps: Playback rate to use instead of MPlay's
+    :type fps: float
+    """
 
-        :param new_name: What to call the sequence
-        :type new_name: str
+    def __init__(self, frange=None, seqls=None, fps=None):
+        self._frange = frange
+        self._seqls = seqls
+        self._fps = fps
+
+    @property
+    def frange(self):
+        """Frame range of the MPlay session.
+
+        See :meth:`Environment.mplay_frange` for its caveats.
+        """
+        if self._frange is None:
+            self._frange = Environment.mplay_frange()
+        return self._frange
+
+    @property
+    def seqls(self):
+        """Names of the sequences loaded in MPlay."""
+        if self._seqls is None:
+            self._seqls = hou.hscript("seqls")[0].split("\n")[:-1]
+        return self._seqls
+
+    @property
+    def fps(self):
+        """Playback rate of the MPlay session."""
+        if self._fps is None:
+            self._fps = hou.fps()
+        return self._fps
+
+    def refresh(self):
+        """Forget the snapshot so the next access queries MPlay again."""
+        self._frange = None
+        self._seqls = None
+        self._fps = None
+
+
+class SequenceDir(object):
+    """A place to write sequences into."""
+
+    def __init__(self, name, env):
+        self._env = None
+        self._name = ""
+        self._dirname = ""
+        self._sub_version = None
+
+        self.env = env
+        self.name = name
+
+    @property
+    def name(self):
+        """Name of the sequence, typically based on $HIPNAME.
+
+        :param new_name: What to call the sequence
+        :type new_name: str
         """
         return self._name
 
@@ -370,22 +1191,67 @@ class SequenceDir(object):
         """Sub-version number for this sequence."""
         return self._sub_version
 
+    @classmethod
+    def from_path(cls, dirname, env):
+        """An existing sub-version directory, such as ``shot_003``.
+
+        Unlike the constructor, this doesn't claim a new sub-version.
+
+        :param dirname: Path to the sub-version directory
+        :type dirname: str
+        :param env: Environment settings to use for its sequences
+        :type env: :class:`Environment`
+        :raises ValueError: The directory isn't named like a sub-version
+        :return: The sub-version
+        :rtype: :class:`SequenceDir`
+        """
+        regex = SubVersionIndex._entry_regex
+        match = regex.match(os.path.basename(dirname))
+        if not match:
+            raise ValueError("{0} is not a sub-version directory".format(
+                dirname))
+        seq_dir = cls("", None)
+        seq_dir._env = env
+        seq_dir._name, seq_dir._sub_version = match.groups()
+        seq_dir._dirname = dirname.replace(os.sep, "/")
+        return seq_dir
+
+    @classmethod
+    def unclaimed(cls, name, env):
+        """Where the next sub-version of ``name`` would be saved.
+
+        Unlike the constructor, nothing is claimed or created, so the
+        directory may not exist.
+
+        :param name: Name of the sequence, typically $HIPNAME
+        :type name: str
+        :param env: Environment settings to use for its sequences
+        :type env: :class:`Environment`
+        :rtype: :class:`SequenceDir`
+        """
+        idx = name.rfind(".hip")
+        name = name[:idx] if idx >= 0 else name
+        sub_version = SubVersionIndex(env.flipbook_dir).peek(
+            name, env.pad_sub_version)
+        return cls.from_path(
+            os.path.join(env.flipbook_dir, "{0}_{1}".format(
+                name, sub_version)),
+            env
+        )
+
     def _next_sub_version(self):
-        """Determine the next subversion based on the sequence name."""
-        regex = re.compile(r"{0}_(\d+)".format(self.name))
-        dirs = [
-            item for item in os.listdir(self.env.flipbook_dir)
-            if os.path.isdir(os.path.join(self.env.flipbook_dir, item))
-            and regex.match(item)
-        ]
-        next_sub_version = 0
-        if dirs:
-            dirs = sorted(dirs, key=lambda x: int(regex.match(x).group(1)))
-            next_sub_version = int(regex.match(dirs[-1]).group(1)) + 1
-        return str(next_sub_version).zfill(self.env.pad_sub_version)
+        """Claim the next subversion based on the sequence name.
+
+        The directory for the new subversion is created as part of the
+        claim, so concurrent saves never share one.
+        """
+        index = SubVersionIndex(self.env.flipbook_dir)
+        return index.allocate(self.name, self.env.pad_sub_version)
 
     def _update(self):
         """Update internal attributes used for creating paths."""
+        if not (self.name and self.env):
+            return
         self._sub_version = self._next_sub_version()
         self._dirname = os.path.join(
             self.env.flipbook_dir,
@@ -405,6 +1271,230 @@ class SequenceDir(object):
                     raise
 
 
+class SubVersionIndex(object):
+    """Latest subversion of every name in a flipbook directory.
+
+    Scanning a flipbook directory with tens of thousands of entries is
+    slow on network storage, so the latest subversion of each name is
+    kept in an index file, along with the one before it. The index
+    remembers the directory's mtime and is rebuilt from a scan whenever
+    something else has changed the directory since. Allocation happens
+    under a file lock, so separate processes saving the same name get
+    separate subversions.
+    """
+
+    META_DIR = ".mplay_batch"
+    INDEX_FILE = "subversions.json"
+    LOCK_FILE = "subversions.lock"
+
+    _entry_regex = re.compile(r"^(.+)_(\d+)$")
+
+    def __init__(self, flipbook_dir):
+        self.flipbook_dir = flipbook_dir
+        self.meta_dir = os.path.join(flipbook_dir, self.META_DIR)
+        self.index_path = os.path.join(self.meta_dir, self.INDEX_FILE)
+        self.lock_path = os.path.join(self.meta_dir, self.LOCK_FILE)
+
+    def allocate(self, name, padding=0):
+        """Create the directory for the next subversion of ``name``.
+
+        :param name: Name to allocate a subversion for
+        :type name: str
+        :param padding: Number of digits to zfill
+        :type padding: int
+        :return: The allocated subversion, zero-padded
+        :rtype: str
+        """
+        try:
+            os.makedirs(self.meta_dir)
+        except OSError as error:
+            if error.errno != errno.EEXIST:
+                raise
+        with FileLock(self.lock_path):
+            versions, previous = self._load()
+            latest = versions.get(name)
+            sub_version = -1 if latest is None else latest
+            while True:
+                sub_version += 1
+                padded = str(sub_version).zfill(padding)
+                try:
+                    os.mkdir(os.path.join(
+                        self.flipbook_dir, "{0}_{1}".format(name, padded)))
+                    break
+                except OSError as error:
+                    # Made by something that doesn't use the index
+                    if error.errno != errno.EEXIST:
+                        raise
+                    latest = sub_version
+            versions[name] = sub_version
+            if latest is not None:
+                previous[name] = latest
+            self._save(versions, previous)
+        return padded
+
+    def peek(self, name, padding=0):
+        """Subversion :meth:`allocate` would create next, creating nothing.
+
+        Another save may still claim it first.
+
+        :param name: Name to look up
+        :type name: str
+        :param padding: Number of digits to zfill
+        :type padding: int
+        :rtype: str
+        """
+        return str(self._load()[0].get(name, -1) + 1).zfill(padding)
+
+    def previous(self, name, sub_version):
+        """Newest subversion of ``name`` before ``sub_version``.
+
+        Only the two newest subversions of a name are indexed, so older
+        ones have no previous subversion as far as this is concerned.
+
+        :param name: Name to look up
+        :type name: str
+        :param sub_version: Subversion to look back from
+        :type sub_version: int
+        :return: Subversion number, or None if there isn't one
+        :rtype: int
+        """
+        versions, previous = self._load()
+        latest = versions.get(name)
+        if latest is None or latest > sub_version:
+            return None
+        if latest < sub_version:
+            return latest
+        return previous.get(name)
+
+    def scan(self):
+        """Find the latest two subversions of every name on disk.
+
+        :return: Latest subversion number for each name, and the one
+            before it for names with more than one
+        :rtype: tuple of dict
+        """
+        versions = {}
+        previous = {}
+        for item in _list_subdirs(self.flipbook_dir, self._entry_regex):
+            name, sub_version = self._entry_regex.match(item).groups()
+            sub_version = int(sub_version)
+            latest = versions.get(name, -1)
+            if sub_version > latest:
+                if latest >= 0:
+                    previous[name] = latest
+                versions[name] = sub_version
+            elif previous.get(name, -1) < sub_version < latest:
+                previous[name] = sub_version
+        return versions, previous
+
+    def _dir_mtime(self):
+        return os.stat(self.flipbook_dir).st_mtime
+
+    def _load(self):
+        """Read the index, rescanning the directory if it is stale."""
+        try:
+            with open(self.index_path) as file_:
+                index = json.load(file_)
+            if index["mtime"] == self._dir_mtime():
+                return index["versions"], index["previous"]
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            pass
+        return self.scan()
+
+    def _save(self, versions, previous):
+        try:
+            _atomic_write_json(self.index_path, {
+                "mtime": self._dir_mtime(),
+                "versions": versions,
+                "previous": previous
+            })
+        except (IOError, OSError):
+            pass  # Next allocation will just rescan
+
+
+class FileLock(object):
+    """Exclusive lock on a file, shared between processes.
+
+    Uses POSIX record locks where available, which also work across
+    NFS, and ``msvcrt`` on Windows. Blocks until the lock is free.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    def acquire(self, blocking=True):
+        """Take the lock.
+
+        :param blocking: Wait for the lock if another process has it
+        :type blocking: bool
+        :return: Whether the lock was taken
+        :rtype: bool
+        """
+        self._file = open(self.path, "a")
+        try:
+            if fcntl:
+                flags = fcntl.LOCK_EX
+                if not blocking:
+                    flags |= fcntl.LOCK_NB
+                fcntl.lockf(self._file, flags)
+                return True
+            self._file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(self._file.fileno(), msvcrt.LK_NBLCK, 1)
+                    return True
+                except IOError:
+                    if not blocking:
+                        raise
+                    time.sleep(0.1)
+        except (IOError, OSError) as error:
+            self._file.close()
+            self._file = None
+            if blocking or error.errno not in (
+                    errno.EACCES, errno.EAGAIN, errno.EDEADLK):
+                raise
+            return False
+
+    def release(self):
+        """Give up the lock."""
+        if self._file is None:
+            return
+        if fcntl:
+            fcntl.lockf(self._file, fcntl.LOCK_UN)
+        else:
+            self._file.seek(0)
+            msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        self._file.close()
+        self._file = None
+
+
+def _list_subdirs(path, regex):
+    """Names of the directories in ``path`` that match ``regex``.
+
+    Uses a single listing. Only names that match are checked for being
+    a directory, which costs an extra stat when scandir is unavailable.
+    """
+    try:
+        scandir = os.scandir
+    except AttributeError:
+        return [
+            item for item in os.listdir(path)
+            if regex.match(item) and os.path.isdir(os.path.join(path, item))
+        ]
+    return [
+        entry.name for entry in scandir(path)
+        if regex.match(entry.name) and entry.is_dir()
+    ]
+
+
 class Sequence(object):
     """Sequence to write to disk."""
 
@@ -412,12 +1502,15 @@ class Sequence(object):
         self._seq_dir = None
         self._index = 0
         self._basename = ""
+        self._frame_index = None
+        self._frames_ext = None
+        self.stage_dir = None
         self.seq_dir = seq_dir
         self.index = index
 
         # Initialize Frame Range to the MPlay session's range for now
         # Will be overwritten with what's on disk before writing video
-        self._frange = self.seq_dir.env.mplay_frange()
+        self._frange = self.seq_dir.env.session.frange
 
     @property
     def seq_dir(self):
@@ -473,44 +1566,81 @@ class Sequence(object):
                 raise TypeError("Frames must be specified as int or float")
         self._frange = tuple(range_)
 
-    def frange_from_files(self):
+    def frange_from_files(self, rescan=True):
         """Get the actual frame range when files exist on disk.
 
-        :raises IndexError: No frame number found in the file path
-        :raises TypeError: Frame number is an invalid type
+        Rescans the sequence's directory by default, so the frame index
+        used by later steps reflects what was actually written.
+
+        :param rescan: Scan the directory again, rather than using the
+            :attr:`frame_index` from the last scan
+        :type rescan: bool
         :return: Frame Range on disk
         :rtype: tuple, size 2
         """
-        files = self.files()
-        if len(files) < 2:
+        index = self.scan_frames() if rescan else self.frame_index
+        if len(index) < 2:
             # self._frange = (0, 0)
             return None
-        frange = []
-        for file_ in (files[0], files[-1]):
-            try:
-                frame_number = re.findall(
-                    self._format_basename(frame_symbol=r"(\d+)"),
-                    os.path.basename(file_)
-                )[0]
-                frange.append(int(frame_number))
-            except IndexError:
-                raise IndexError("No frame number found")
-            except TypeError:
-                raise TypeError("Invalid frame number in file path")
-        frange = tuple(frange)
-        self._frange = frange
-        return frange
+        self._frange = index.frange
+        return self._frange
+
+    @property
+    def frame_index(self):
+        """Index of the frames on disk, from the most recent scan.
+
+        :return: Frame index, scanning the directory if it hasn't been
+        :rtype: :class:`FrameIndex`
+        """
+        if self._frame_index is None:
+            self.scan_frames()
+        return self._frame_index
+
+    def scan_frames(self):
+        """Index the frames on disk for this sequence.
+
+        :return: Fresh frame index
+        :rtype: :class:`FrameIndex`
+        """
+        prefix, suffix = self._format_basename(frame_symbol="\0").split("\0")
+        self._frame_index = FrameIndex.scan(
+            self.frames_dirname, prefix, suffix)
+        return self._frame_index
 
     @property
     def basename(self):
         """HScript-friendly basename for this sequence."""
         return self._basename
 
+    @property
+    def frames_ext(self):
+        """Image type imgsave writes, if not the environment's.
+
+        :param ext: Intermediate extension, or None for the default
+        :type ext: str
+        """
+        return self._frames_ext or self.seq_dir.env.ext
+
+    @frames_ext.setter
+    def frames_ext(self, ext):
+        self._frames_ext = ext
+        self._basename = self._format_basename()
+
+    @property
+    def frames_dirname(self):
+        """Directory the image sequence is written to.
+
+        This is the staging directory when the frames are staged,
+        otherwise the :class:`SequenceDir`. Videos and GIFs are always
+        written to the :class:`SequenceDir`.
+        """
+        return self.stage_dir or self.seq_dir.dirname
+
     @property
     def path(self):
         """Full path to this sequence."""
         # Avoid os.path.join to preserve escape characters on windows
-        return "{0}/{1}".format(self.seq_dir.dirname, self.basename)
+        return "{0}/{1}".format(self.frames_dirname, self.basename)
 
     @property
     def glob_pattern(self):
@@ -520,7 +1650,7 @@ class Sequence(object):
         :rtype: str
         """
         return "{0}/{1}".format(
-            self.seq_dir.dirname,
+            self.frames_dirname,
             self._format_basename(frame_symbol=r"[0-9]*")
         )
 
@@ -532,10 +1662,24 @@ class Sequence(object):
         :rtype: str
         """
         return "{0}/{1}".format(
-            self.seq_dir.dirname,
+            self.frames_dirname,
             self._format_basename(frame_symbol=r"%d")
         )
 
+    @property
+    def stem(self):
+        """Name shared by this sequence's frames, video and GIF."""
+        return "{0}_{1}_{2}".format(
+            self.seq_dir.name,
+            str(self.seq_dir.sub_version),
+            str(self.index).zfill(self.seq_dir.env.pad_seq_index)
+        )
+
+    @property
+    def stats_path(self):
+        """JSON lines file that per-stage timings are written to."""
+        return "{0}/mplay_batch_stats.jsonl".format(self.seq_dir.dirname)
+
     @property
     def video_path(self):
         """Path to the video component of this sequence.
@@ -551,6 +1695,17 @@ class Sequence(object):
             self.seq_dir.env.video_format
         )
 
+    def proxy_path(self, proxy):
+        """Path to one of this sequence's proxy videos.
+
+        :param proxy: Proxy to get the path for
+        :type proxy: :class:`Proxy`
+        :return: Path to the proxy, next to :attr:`video_path`
+        :rtype: str
+        """
+        root, ext = os.path.splitext(self.video_path)
+        return "{0}{1}{2}".format(root, proxy.suffix, ext)
+
     @property
     def gif_path(self):
         """Path to the gif component of this sequence.
@@ -568,169 +1723,1251 @@ class Sequence(object):
     def files(self):
         """Get a sorted list of files on disk for this sequence.
 
-        :return: Naturally sorted list of files
+        :return: Files sorted by frame number
         :rtype: list
         """
-        files_ = glob.glob(self.glob_pattern)
-        if not files_:
-            return []
-        files_.sort(
-            key=lambda name: [
-                int(text) if text.isdigit() else text.lower()
-                for text in re.split(r"(\d+)", name)
-            ]
-        )
-        return files_
+        return list(self.scan_frames().paths())
 
-    def _format_basename(self, frame_symbol=r"\$\F"):
+    def _format_basename(self, frame_symbol=r"\$\F", ext=None):
         """Format an HScript friendly basename for this sequence."""
         return r"{0}_{1}_{2}.{3}.{4}".format(
             self.seq_dir.name,
             str(self.seq_dir.sub_version),
             str(self.index).zfill(self.seq_dir.env.pad_seq_index),
             frame_symbol,
-            self.seq_dir.env.ext
+            ext or self.frames_ext
         )
 
     def __str__(self):
         return "Sequence: {0} at {1}".format(self.seq_dir.name, self.path)
 
 
+class FrameIndex(object):
+    """Frame numbers of an image sequence on disk.
+
+    Built from a single listing of the sequence's directory and stored
+    as a sorted integer array, so even very long sequences are cheap to
+    hold and query.
+    """
+
+    def __init__(self, dirname, prefix, suffix, frames=()):
+        self.dirname = dirname
+        self.prefix = prefix
+        self.suffix = suffix
+        self.frames = array.array("l", sorted(frames))
+
+    @classmethod
+    def scan(cls, dirname, prefix, suffix):
+        """Index every ``<prefix><frame><suffix>`` file in a directory.
+
+        :param dirname: Directory holding the sequence
+        :type dirname: str
+        :param prefix: File name before the frame number
+        :type prefix: str
+        :param suffix: File name after the frame number
+        :type suffix: str
+        :return: Index of the frames found
+        :rtype: :class:`FrameIndex`
+        """
+        start, end = len(prefix), -len(suffix) or None
+        try:
+            names = os.listdir(dirname)
+        except OSError:
+            names = []
+        frames = []
+        for name in names:
+            if name.startswith(prefix) and name.endswith(suffix):
+                frame = name[start:end]
+                if frame.isdigit():
+                    frames.append(int(frame))
+        return cls(dirname, prefix, suffix, frames)
+
+    def __len__(self):
+        return len(self.frames)
+
+    @property
+    def first(self):
+        """Lowest frame number, or None if there are no frames."""
+        return self.frames[0] if self.frames else None
+
+    @property
+    def last(self):
+        """Highest frame number, or None if there are no frames."""
+        return self.frames[-1] if self.frames else None
+
+    @property
+    def frange(self):
+        """First and last frame, or None if there are no frames."""
+        if not self.frames:
+            return None
+        return (self.first, self.last)
+
+    def gaps(self):
+        """Ranges of missing frames between the first and last frame.
+
+        :return: Inclusive start and end of each run of missing frames
+        :rtype: list of tuple
+        """
+        return [
+            (prev + 1, frame - 1)
+            for prev, frame in zip(self.frames, self.frames[1:])
+            if frame - prev > 1
+        ]
+
+    def to_dict(self):
+        """Plain-data form of this index, for JSON."""
+        return {
+            "dirname": self.dirname,
+            "prefix": self.prefix,
+            "suffix": self.suffix,
+            "frames": self.frames.tolist()
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """Rebuild an index from :meth:`to_dict` output."""
+        return cls(**data)
+
+    def path(self, frame):
+        """Path to the file for a frame number."""
+        return "{0}/{1}{2}{3}".format(
+            self.dirname, self.prefix, frame, self.suffix)
+
+    def paths(self):
+        """Paths to every frame, in frame order."""
+        for frame in self.frames:
+            yield self.path(frame)
+
+
+def find_sequences(root, env):
+    """Find the image sequences MPlay Batch has saved under a directory.
+
+    Frames are matched by the naming :class:`Sequence` writes them with.
+    A sequence saved in more than one image type is only found once,
+    preferring :attr:`Environment.ext`.
+
+    :param root: Flipbook directory, or one sub-version directory in it
+    :type root: str
+    :param env: Environment settings for the sequences. Its frame range
+        and fps must not need MPlay
+    :type env: :class:`Environment`
+    :return: Sequences with at least two frames, in path order
+    :rtype: list of :class:`Sequence`
+    """
+    import copy
+
+    # Sequence indices are matched as written, whatever their padding
+    env = copy.copy(env)
+    env.pad_seq_index = 0
+    regex = SubVersionIndex._entry_regex
+    root = os.path.normpath(root)
+    dirnames = [
+        os.path.join(root, name) for name in sorted(_list_subdirs(root, regex))
+    ]
+    if not dirnames and regex.match(os.path.basename(root)):
+        dirnames = [root]
+    sequences = []
+    for dirname in dirnames:
+        seq_dir = SequenceDir.from_path(dirname, env)
+        frame_regex = re.compile(r"^{0}_(\d+)\.\d+\.(\w+)$".format(
+            re.escape(os.path.basename(dirname))))
+        counts = {}
+        for name in os.listdir(dirname):
+            match = frame_regex.match(name)
+            if match:
+                counts[match.groups()] = counts.get(match.groups(), 0) + 1
+        exts = {}
+        for (index, ext), count in counts.items():
+            if count > 1:
+                exts.setdefault(index, []).append(ext)
+        for index in sorted(exts, key=int):
+            seq = Sequence(seq_dir, index=index)
+            if env.ext not in exts[index]:
+                seq.frames_ext = sorted(exts[index])[0]
+            sequences.append(seq)
+    return sequences
+
+
 class SequenceWriterJob(object):
     """Single job for SequenceWriter to process."""
 
-    def __init__(self, seq, hscript_cmd):
+    def __init__(self, seq, seq_name=None):
         self.seq = seq
-        self.hscript_cmd = hscript_cmd
+        self.seq_name = seq_name
+        self.stats = StageRecorder(None, "")
+        self.frame_hashes = {}
+        self.held_runs = []
+        self.fingerprint = None
+        self.reused = False
+        # Whether imgsave wrote the intermediate format, so the frames
+        # are this batch's own to convert and remove
+        self.intermediate = False
+        self.done = {}
+
+    @property
+    def hscript_cmd(self):
+        """imgsave command that writes this job's image sequence.
+
+        Formatted on access, so it follows the sequence if its frames
+        are moved to a staging directory.
+        """
+        if self.seq_name is None:
+            # When doing "Current", there is no way to query MPlay for name
+            return "imgsave -a {0}".format(self.seq.path)
+        return "imgsave -s {0} -a {1}".format(self.seq_name, self.seq.path)
 
 
 class SequenceWriter(object):
     """Handles writing sequences from MPlay."""
 
-    def __init__(self, env, video=False, gif=False, keep_video_source=False):
+    def __init__(self, env, video=False, gif=False, keep_video_source=False,
+                 proxies=None, dry_run=False):
         self.env = env
         self.video = video
         self.gif = gif
         self.keep_video_source = keep_video_source
-        self.location = SequenceDir(hou.hipFile.basename(), env)
-        self.queue = []
-        # Make sure ffmpeg is accessible
+        self.proxies = env.proxies if proxies is None else proxies
+        # Make sure ffmpeg can write what's asked for, before a
+        # sub-version is claimed
         if self.video or self.gif:
-            self.env.find_ffmpeg()
+            self.env.check_ffmpeg(video=self.video)
+        self._location = None
+        self.queue = []
+        self.failures = []
+        self.encoder_threads = 0
+        self._stage_dirs = []
+        self._staged_frame_bytes = 0
+        self._previous_outputs = None
+        self._catalog_pool = None
+        self.journal = None
+        self.progress = BatchProgress()
+        self.dry_run = dry_run
+
+    @property
+    def location(self):
+        """Sub-version to save into, claimed the first time it's used.
+
+        A :attr:`dry_run` writer only looks up which sub-version it
+        would be, so its queue can be planned without claiming one.
+        """
+        if self._location is None:
+            if self.dry_run:
+                self._location = SequenceDir.unclaimed(
+                    hou.hipFile.basename(), self.env)
+            else:
+                self._location = SequenceDir(
+                    hou.hipFile.basename(), self.env)
+        return self._location
+
+    def plan(self):
+        """Predict the disk space and time saving the queue will take.
+
+        :rtype: :class:`mplay_batch_plan.BatchPlan`
+        """
+        from mplay_batch_plan import BatchPlan
+
+        return BatchPlan(self)
 
     def execute(self):
-        """Run through command queue."""
+        """Run through command queue.
+
+        A failed encode does not stop the rest of the batch. Failures
+        are collected per sequence and raised once everything else has
+        been written. When nothing is encoded, each sequence is added to
+        the :class:`mplay_batch_catalog.FlipbookCatalog` in the
+        background while the next one is written, since making its
+        thumbnail runs ffmpeg.
+
+        :raises FFmpegFailedError: ffmpeg failed on a sequence
+        :raises FFmpegBatchFailedError: ffmpeg failed on several sequences
+        :raises RuntimeError: The writer is a :attr:`dry_run`
+        """
+        if self.dry_run:
+            raise RuntimeError("A dry run can only be planned")
+        self.failures = []
+        start = time.time()
+        self.progress = BatchProgress()
+        for job in self.queue:
+            frames = job.seq.frange[1] - job.seq.frange[0] + 1
+            self.progress.expect(job.seq.stem, frames)
+        if self.journal is None and self.queue:
+            self.journal = BatchJournal(self.location.dirname)
+            self.journal.start(self._journal_settings(), [{
+                "stem": job.seq.stem,
+                "index": job.seq.index,
+                "seq_name": job.seq_name,
+                "frange": list(job.seq.frange)
+            } for job in self.queue])
+        if self.env.encode_daemon and (self.video or self.gif):
+            self._execute_detached()
+            self._show_stats(time.time() - start)
+            return
+        try:
+            if self.env.pipeline and (self.video or self.gif):
+                self._execute_pipelined()
+            else:
+                self.encoder_threads = available_cpus()
+                if self.env.catalog and not (self.video or self.gif):
+                    self._catalog_pool = EncoderPool(1)
+                for job in self.queue:
+                    self._write_images(job)
+                    self._encode_safely(job)
+        finally:
+            if self._catalog_pool:
+                pool, self._catalog_pool = self._catalog_pool, None
+                pool.join(on_wait=self.progress.report)
+            self._remove_stage_dirs()
+        self._show_stats(time.time() - start)
+        self._raise_failures()
+
+    def _execute_pipelined(self):
+        """Run the queue, encoding in the background while MPlay writes.
+
+        MPlay can only run hscript from its own thread, so image writes
+        stay here while a pool of worker threads encodes each sequence
+        as soon as its frames are on disk. The CPUs are shared out
+        between the encoders so they don't oversubscribe the machine.
+        """
+        workers = min(self.env.max_encoders, max(1, len(self.queue)))
+        self.encoder_threads = max(1, available_cpus() // workers)
+        pool = EncoderPool(workers)
+        try:
+            for job in self.queue:
+                self._write_images(job)
+                pool.submit(self._encode_safely, job)
+                self.progress.report()
+        finally:
+            pool.join(on_wait=self.progress.report)
+
+    def _execute_detached(self):
+        """Write the queue and hand every encode to the encode daemon.
+
+        Returns as soon as the last image sequence is on disk. The
+        daemon owns the encodes, and any staged frames, from then on.
+        """
+        from mplay_batch_daemon import EncodeDaemon
+
+        daemon = EncodeDaemon()
+        self.encoder_threads = max(
+            1, available_cpus() // self.env.max_encoders)
+        queued = 0
         for job in self.queue:
-            # Write image sequence to disk
+            self._write_images(job)
+            task = self._next_encode(job)
+            if task:
+                daemon.submit(task)
+                queued += 1
+        if queued:
+            daemon.start(self.env.max_encoders)
+        _show_status(
+            "MPlay Batch: {0} sequence(s) queued for encoding".format(queued))
+
+    def _write_images(self, job):
+        """Write a job's image sequence to disk, staging it if possible.
+
+        :raises RuntimeError: The images have to be written, but this
+            isn't running in MPlay
+        """
+        job.stats = StageRecorder(
+            job.seq.stats_path if self.env.stats else None,
+            job.seq.stem,
+            history_path=throughput_history_path() if self.env.stats else None
+        )
+        if "imgsave" in job.done and self._restore_images(job):
+            return
+        if hou is None:
+            raise RuntimeError(
+                "{0} needs MPlay to write its images".format(job.seq.stem))
+        job.done = {}
+        job.intermediate = self._use_intermediate()
+        if job.intermediate:
+            job.seq.frames_ext = self.env.intermediate_format
+        if self._should_stage(job):
+            try:
+                job.seq.stage_dir = tempfile.mkdtemp(
+                    prefix="mplay_batch_", dir=self.env.staging_dir
+                ).replace(os.sep, "/")
+                self._stage_dirs.append(job.seq.stage_dir)
+            except OSError:
+                self.env.staging_dir = ""
+        with job.stats.stage("imgsave", history=True) as record:
             hou.hscript(job.hscript_cmd)
+            if job.seq.stage_dir and self._staging_filled(job):
+                # Frames may have been cut short, so write them again
+                # where they'd have gone without staging
+                shutil.rmtree(job.seq.stage_dir, ignore_errors=True)
+                job.seq.stage_dir = None
+                self.env.staging_dir = ""
+                hou.hscript(job.hscript_cmd)
+            # Every later step works from this one scan. Linking held
+            # frames changes their files but not which frames exist
+            index = job.seq.scan_frames()
+            record["frames"] = len(index)
+            if self.env.stats:
+                record["bytes"] = _file_sizes(index.paths())
+        if self.env.incremental or self.env.held_frames:
+            self._hash_frames(job)
+        if self.env.incremental:
+            self._reuse_previous(job)
+        if self.env.held_frames and not job.reused:
+            self._link_held_frames(job)
+        if self.env.staging_dir and (self.video or self.gif):
+            self._sample_staged_frame_size(job.seq)
+        self._checkpoint(
+            job,
+            "imgsave",
+            frames_ext=job.seq._frames_ext,
+            stage_dir=job.seq.stage_dir,
+            held_runs=job.held_runs,
+            fingerprint=job.fingerprint,
+            reused=job.reused
+        )
 
-            if self.video:
-                # Update sequence to actual frame range that was written
-                job.seq.frange_from_files()
-                # Write the video
-                try:
-                    subprocess.check_call(
-                        self.format_ffmpeg_cmd(job.seq, self.env),
-                        **self.env.subprocess_kwargs()
-                    )
-                except subprocess.CalledProcessError as err:
-                    raise FFmpegFailedError(job.seq.glob_pattern, err)
-
-            if self.gif:
-                # Update sequence to actual written range
-                job.seq.frange_from_files()
-                try:
-                    for cmd in self.format_ffmpeg_cmd_gif(job.seq, self.env):
-                        subprocess.check_call(
-                            cmd, **self.env.subprocess_kwargs())
-                except subprocess.CalledProcessError as err:
-                    raise FFmpegFailedError(job.seq.glob_pattern, err)
+    def _restore_images(self, job):
+        """Pick a resumed job up from its ``imgsave`` checkpoint.
+
+        :return: False if its frames are needed but have gone, so
+            imgsave has to run again
+        :rtype: bool
+        """
+        record = job.done["imgsave"]
+        job.held_runs = record.get("held_runs") or []
+        job.fingerprint = record.get("fingerprint")
+        job.reused = record.get("reused", False)
+        # Only recorded when imgsave wrote the intermediate format
+        job.intermediate = bool(record.get("frames_ext"))
+        restorable = self.restorable(job)
+        if job.seq.stage_dir:
+            self._stage_dirs.append(job.seq.stage_dir)
+        return restorable
+
+    @staticmethod
+    def restorable(job):
+        """Whether a resumed job can carry on without writing its images.
+
+        Jobs that can't have to be resumed from MPlay. Only looks, so
+        it's safe to ask of any job.
+
+        :param job: Job rebuilt by :meth:`from_journal`
+        :type job: :class:`SequenceWriterJob`
+        :rtype: bool
+        """
+        record = job.done.get("imgsave")
+        if record is None:
+            return False
+        if "encode" in job.done or record.get("reused", False):
+            return True
+        return len(job.seq.scan_frames()) > 0
+
+    def _journal_settings(self):
+        """Settings :meth:`from_journal` needs to resume this batch."""
+        return {
+            "video": bool(self.video),
+            "gif": bool(self.gif),
+            "keep_video_source": bool(self.keep_video_source),
+            "proxies": ",".join(proxy.setting for proxy in self.proxies),
+            "fps": self.env.fps,
+            "ext": self.env.ext,
+            "intermediate_format": self.env.intermediate_format,
+            "video_format": self.env.video_format,
+            "encode_profile": self.env.encode_profile.name,
+            "pad_seq_index": self.env.pad_seq_index,
+            "incremental": self.env.incremental,
+            "held_frames": self.env.held_frames,
+            "chunk_frames": self.env.chunk_frames,
+            "gif_max_size_mb": self.env.gif_max_size_mb,
+            "gif_max_seconds": self.env.gif_max_seconds
+        }
+
+    @classmethod
+    def from_journal(cls, dirname, env=None):
+        """Rebuild an unfinished batch from its :class:`BatchJournal`.
+
+        Jobs keep the stages they finished, so :meth:`execute` only
+        runs the rest, into the same sub-version. Jobs that never
+        finished imgsave need MPlay, with the same sequences loaded.
+
+        :param dirname: Sub-version directory the batch was saved to
+        :type dirname: str
+        :param env: Settings to start from. The batch's own save
+            settings override them
+        :type env: :class:`Environment`
+        :raises ValueError: The directory has no batch to resume
+        :return: Writer with the batch's queue
+        :rtype: :class:`SequenceWriter`
+        """
+        journal = BatchJournal(dirname)
+        batch, done = journal.load()
+        if batch is None:
+            raise ValueError("{0} has no batch to resume".format(dirname))
+        settings = batch["settings"]
+        env = env or Environment()
+        for attr in (
+                "ext", "intermediate_format", "video_format",
+                "encode_profile", "proxies", "pad_seq_index", "incremental",
+                "held_frames", "chunk_frames", "gif_max_size_mb",
+                "gif_max_seconds"
+        ):
+            if attr in settings:
+                setattr(env, attr, settings[attr])
+        env.session = MPlaySession(
+            frange=tuple(batch["jobs"][0]["frange"]) if batch["jobs"] else None,
+            seqls=[job["seq_name"] for job in batch["jobs"]],
+            fps=settings["fps"]
+        )
+        writer = cls(
+            env,
+            video=settings["video"],
+            gif=settings["gif"],
+            keep_video_source=settings["keep_video_source"]
+        )
+        env.flipbook_dir = os.path.dirname(dirname)
+        writer._location = SequenceDir.from_path(dirname, env)
+        writer.journal = journal
+        for data in batch["jobs"]:
+            seq = Sequence(writer._location, index=data["index"])
+            seq.frange = tuple(data["frange"])
+            job = SequenceWriterJob(seq, data["seq_name"])
+            job.done = done.get(data["stem"], {})
+            record = job.done.get("imgsave")
+            if record:
+                # Look for the frames where imgsave left them
+                seq.frames_ext = record.get("frames_ext")
+                stage_dir = record.get("stage_dir")
+                # Frames are moved out of staging when an encode fails
+                if stage_dir and os.path.isdir(stage_dir):
+                    seq.stage_dir = stage_dir
+            writer.queue.append(job)
+        return writer
+
+    def _checkpoint(self, job, stage, **state):
+        """Record a finished stage of a job in the batch's journal."""
+        if self.journal:
+            self.journal.checkpoint(job.seq.stem, stage, **state)
+
+    def _hash_frames(self, job):
+        """Hash the frames imgsave just wrote.
+
+        Incremental saves need every frame's hash. Finding held frames
+        only needs the frames that are the same size as a neighbour.
+        """
+        with job.stats.stage("hash") as record:
+            index = job.seq.frame_index
+            frames = None if self.env.incremental else _held_candidates(index)
+            job.frame_hashes = hash_frames(index, frames)
+            record["frames"] = len(job.frame_hashes)
+
+    def _reuse_previous(self, job):
+        """Link a job's files from the last sub-version if it's unchanged.
+
+        Fingerprints the frames imgsave just wrote. If the previous
+        sub-version saved identical frames with the same settings, its
+        files are hardlinked in under this job's names and the new
+        frames are dropped, leaving nothing to encode.
+        """
+        index = job.seq.frame_index
+        job.fingerprint = fingerprint_frames(
+            index, self._fingerprint_settings(job), job.frame_hashes)
+        if not job.fingerprint:
+            return
+        if self._previous_outputs is None:
+            self._previous_outputs = OutputManifest.previous(self.location)
+        previous = self._previous_outputs
+        entry = previous.find(job.fingerprint) if previous else None
+        if entry:
+            try:
+                with job.stats.stage("reuse", len(index)) as record:
+                    record["bytes"] = previous.link(
+                        entry, job.seq.seq_dir.dirname, job.seq.stem)
+            except (IOError, OSError):
+                # Any frames that were replaced are identical, so the
+                # job can still be encoded as usual
+                entry = None
+        if entry:
+            if not self._keeps_frames() or job.intermediate:
+                _remove_frames(index)
+            if job.seq.stage_dir:
+                shutil.rmtree(job.seq.stage_dir, ignore_errors=True)
+                job.seq.stage_dir = None
+            job.reused = True
+            self.progress.update(job.seq.stem, len(index), len(index), 0)
+            names = entry["names"]
+        elif not (self.video or self.gif):
+            names = self._output_names(job)
+        else:
+            return  # Recorded by the encode once its outputs exist
+        OutputManifest(job.seq.seq_dir.dirname).add({
+            "fingerprint": job.fingerprint,
+            "stem": job.seq.stem,
+            "names": names
+        })
+
+    def _link_held_frames(self, job):
+        """Hardlink every held frame to the first frame of its run.
+
+        The runs are kept on the job, so the encode can show each run
+        as a single frame for its whole duration.
+        """
+        index = job.seq.frame_index
+        job.held_runs = held_runs(index, job.frame_hashes)
+        if len(job.held_runs) == len(index):
+            return
+        with job.stats.stage("dedup", len(index)) as record:
+            freed = 0
+            for first, length in job.held_runs:
+                for frame in range(first + 1, first + length):
+                    path = index.path(frame)
+                    size = os.path.getsize(path)
+                    if _link_file(index.path(first), path, copy=False):
+                        freed += size
+            record["bytes"] = freed
+
+    def _fingerprint_settings(self, job):
+        """Settings that change what a job's frames are saved as."""
+        settings = {
+            "version": OutputManifest.VERSION,
+            "ext": self.env.ext,
+            "frames_ext": job.seq.frames_ext,
+            "keep_frames": self._keeps_frames(),
+            "fps": self.env.fps,
+            "video": None,
+            "gif": self.gif,
+            "held_frames": self.env.held_frames
+        }
+        budget = GifBudget.from_env(self.env)
+        if self.gif and budget.enabled:
+            settings["gif"] = budget.to_dict()
+        if self.video:
+            settings["video"] = {
+                "format": self.env.video_format,
+                "encode": self.env.encode_profile.ffmpeg_args(),
+                "proxies": [proxy.scale_filter() for proxy in self.proxies]
+            }
+        return settings
+
+    def _output_names(self, job):
+        """Names of the files a job leaves behind, minus its stem."""
+        names = []
+        if self._keeps_frames():
+            names += [
+                ".{0}.{1}".format(frame, self.env.ext)
+                for frame in job.seq.frame_index.frames
+            ]
+        if self.video:
+            names.append("." + self.env.video_format)
+            names += [
+                "{0}.{1}".format(proxy.suffix, self.env.video_format)
+                for proxy in self.proxies
+            ]
+        if self.gif:
+            names.append(".gif")
+        return names
+
+    def _keeps_frames(self):
+        """Whether the image sequence is kept once everything is saved."""
+        return self.keep_video_source or not (self.video or self.gif)
+
+    def _should_stage(self, job):
+        """Whether a job's frames can go to the staging directory.
+
+        Only frames that are deleted once encoded are staged, and only
+        when the staging volume has room for the whole sequence. Nothing
+        is staged until a job has been written to disk to size frames
+        from, since resolutions vary too much to guess.
+        """
+        if not self.env.staging_dir or not (self.video or self.gif):
+            return False
+        if self.keep_video_source and not self._use_intermediate():
+            return False
+        if not self._staged_frame_bytes:
+            return False
+        free = free_disk_space(self.env.staging_dir)
+        if free is None:
+            return True
+        frames = job.seq.frange[1] - job.seq.frange[0] + 1
+        return free - frames * self._staged_frame_bytes > STAGING_RESERVE_BYTES
+
+    def _staging_filled(self, job):
+        """Whether the staging volume ran out of space during imgsave.
+
+        MPlay doesn't report a failed write, so a volume left without
+        room for another frame is taken to mean frames were lost.
+        """
+        free = free_disk_space(job.seq.stage_dir)
+        return free is not None and free < self._staged_frame_bytes
+
+    def _use_intermediate(self):
+        """Whether imgsave writes the intermediate format.
+
+        Only worth it when the frames are encoded, since ffmpeg can
+        read them directly.
+        """
+        return bool(
+            self.env.intermediate_format
+            and self.env.intermediate_format != self.env.ext
+            and (self.video or self.gif)
+        )
+
+    def _sample_staged_frame_size(self, seq, samples=5):
+        """Remember the largest frame size seen, to estimate later jobs."""
+        index = seq.frame_index
+        step = max(1, len(index) // samples)
+        for frame in index.frames[::step]:
+            try:
+                size = os.path.getsize(index.path(frame))
+            except OSError:
+                continue
+            self._staged_frame_bytes = max(self._staged_frame_bytes, size)
+
+    def _remove_stage_dirs(self):
+        for dir_ in self._stage_dirs:
+            shutil.rmtree(dir_, ignore_errors=True)
+        self._stage_dirs = []
+
+    def _encode_safely(self, job):
+        """Encode a job, recording any failure instead of raising it."""
+        try:
+            self.encode(job)
+        except Exception as err:
+            if job.seq.stage_dir:
+                # Keep the frames so the encode can be retried by hand
+                _move_frames(job.seq.frame_index, job.seq.seq_dir.dirname)
+                job.seq.stage_dir = None
+            self.failures.append(err)
+
+    def _raise_failures(self):
+        """Raise the failures collected while encoding, if any."""
+        for failure in self.failures:
+            if not isinstance(failure, FFmpegFailedError):
+                raise failure
+        if len(self.failures) == 1:
+            raise self.failures[0]
+        if self.failures:
+            raise FFmpegBatchFailedError(self.failures)
+
+    def encode(self, job):
+        """Encode a job's image sequence once it has been written.
+
+        :param job: Job whose image sequence is on disk
+        :type job: :class:`SequenceWriterJob`
+        :raises FFmpegFailedError: ffmpeg returned an error
+        """
+        task = self._next_encode(job)
+        if task:
+            try:
+                task.run(on_progress=self.progress.update)
+            finally:
+                job.stats.records.extend(task.records)
+
+    def _next_encode(self, job):
+        """Encode task still to run for a job, finishing it if there's none.
+
+        Jobs with nothing to encode, and resumed jobs whose encode had
+        already finished, are cleaned up, cataloged and checkpointed
+        here instead.
 
-            if (self.gif or self.video) and not self.keep_video_source:
-                self.remove_image_sequence(job.seq)
+        :return: Task to run, or None
+        :rtype: :class:`EncodeTask`
+        """
+        if "cleanup" in job.done:
+            return None
+        encoded = "encode" in job.done
+        task = None if encoded else self.encode_task(job)
+        if task:
+            return task
+        if encoded and (self.video or self.gif) and (
+                not self.keep_video_source or job.intermediate):
+            _remove_frames(job.seq.frame_index)
+        if self.env.catalog:
+            from mplay_batch_catalog import FlipbookCatalog
+
+            if self._catalog_pool:
+                self._catalog_pool.submit(
+                    FlipbookCatalog().add, self._catalog_entry(job))
+            else:
+                FlipbookCatalog().add(self._catalog_entry(job))
+        if not encoded:
+            self._checkpoint(job, "encode")
+        self._checkpoint(job, "cleanup")
+        return None
+
+    def encode_task(self, job):
+        """Describe the encode for a job whose images are on disk.
+
+        :param job: Job whose image sequence is on disk
+        :type job: :class:`SequenceWriterJob`
+        :return: Task to run, or None if there is nothing to encode
+        :rtype: :class:`EncodeTask`
+        """
+        if not (self.video or self.gif) or job.reused:
+            return None
+        # Update sequence to actual frame range that was written
+        with job.stats.stage("frange_from_files") as record:
+            job.seq.frange_from_files(rescan=False)
+            record["frames"] = len(job.seq.frame_index)
+        budget = GifBudget.from_env(self.env)
+        budget_gif = bool(self.gif) and budget.enabled
+        palette = None
+        frame_count = job.seq.frange[1] - job.seq.frange[0] + 1
+        if self.gif and frame_count > GIF_SINGLE_PASS_MAX_FRAMES:
+            handle, palette = tempfile.mkstemp(
+                prefix="mplay_batch_", suffix=".png",
+                dir=self.env.staging_dir or None)
+            os.close(handle)
+        concat_list = None
+        if job.held_runs and len(job.held_runs) < len(job.seq.frame_index):
+            concat_list = "{0}/{1}.ffconcat".format(
+                job.seq.frames_dirname, job.seq.stem)
+            write_concat_list(
+                concat_list, job.seq.frame_index, job.held_runs, self.env.fps)
+        ranges = []
+        if self.video and not concat_list:
+            ranges = self._chunk_ranges(job)
+        chunks = chunk_dir = None
+        chunk_workers = 1
+        if ranges:
+            chunk_workers = min(
+                len(ranges), self.encoder_threads // THREADS_PER_ENCODER)
+            chunk_dir = tempfile.mkdtemp(
+                prefix="mplay_batch_chunks_", dir=job.seq.frames_dirname
+            ).replace(os.sep, "/")
+            segments = _chunk_segments(
+                job.seq, len(ranges), chunk_dir, self.proxies)
+            for _, list_path, paths in segments:
+                _write_segment_list(list_path, paths)
+            chunks, join = self.format_ffmpeg_cmd_chunks(
+                job.seq,
+                self.env,
+                ranges,
+                segments,
+                threads=max(1, self.encoder_threads // chunk_workers),
+                proxies=self.proxies
+            )
+        commands = self.format_ffmpeg_cmd_combined(
+            job.seq,
+            self.env,
+            video=self.video and not chunks,
+            gif=self.gif and not budget_gif,
+            threads=self.encoder_threads,
+            palette=None if budget_gif else palette,
+            proxies=self.proxies,
+            concat_list=concat_list
+        )
+        stages = ["video"] if self.video else []
+        if self.video and self.proxies:
+            stages.append("proxies")
+        if chunks:
+            commands.insert(0, join)
+            video_stage = "+".join(stages)
+            stages = []
+        convert = None
+        if job.intermediate and self.keep_video_source:
+            convert = {"dirname": job.seq.seq_dir.dirname, "ext": self.env.ext}
+        combined_gif = self.gif and not budget_gif
+        if palette and combined_gif:
+            stages = ["+".join(stages + ["palettegen"]), "paletteuse"]
+        else:
+            stages = ["+".join(stages + (["gif"] if combined_gif else []))]
+        if chunks:
+            stages = [video_stage, "join"] + (stages if combined_gif else [])
+        elif not commands:
+            stages = []
+        gif_budget = None
+        if budget_gif:
+            stages += ["palettegen", "paletteuse"] if palette else ["gif"]
+            gif_budget = dict(
+                budget.to_dict(),
+                source=_ffmpeg_source(job.seq, self.env.fps, concat_list),
+                path=job.seq.gif_path,
+                fps=self.env.fps,
+                threads=self.encoder_threads,
+                scratch=self.env.staging_dir or tempfile.gettempdir()
+            )
+        return EncodeTask(
+            job.seq.glob_pattern,
+            commands,
+            job.seq.frame_index,
+            palette=palette,
+            concat_list=concat_list,
+            chunks=chunks,
+            chunk_workers=chunk_workers,
+            chunk_dir=chunk_dir,
+            gif_budget=gif_budget,
+            remove_frames=not self.keep_video_source or job.intermediate,
+            convert=convert,
+            stage_dir=job.seq.stage_dir,
+            seq_dirname=job.seq.seq_dir.dirname,
+            stages=stages,
+            stats_path=job.stats.path,
+            job=job.stats.job,
+            profile=self.env.encode_profile.name if self.video else None,
+            outputs={
+                "fingerprint": job.fingerprint,
+                "stem": job.seq.stem,
+                "names": self._output_names(job)
+            } if job.fingerprint else None,
+            catalog=self._catalog_entry(job) if self.env.catalog else None,
+            journal=self.journal.dirname if self.journal else None
+        )
+
+    def _catalog_entry(self, job):
+        """What the flipbook catalog needs to record a job.
+
+        See :meth:`mplay_batch_catalog.FlipbookCatalog.add`.
+        """
+        return {
+            "dirname": job.seq.seq_dir.dirname,
+            "stem": job.seq.stem,
+            "hip": job.seq.seq_dir.name,
+            "sub_version": job.seq.seq_dir.sub_version,
+            "name": job.seq_name,
+            "frange": list(job.seq.frange),
+            "fps": self.env.fps,
+            "created": time.time()
+        }
+
+    def _chunk_ranges(self, job):
+        """Frame ranges to encode a job's video in, if it's worth it.
+
+        Only sequences longer than :attr:`Environment.chunk_frames`,
+        with no missing frames, are split, and only when there are
+        enough threads to run more than one chunk at once.
+
+        :return: First frame and length of each chunk, or an empty list
+            to encode the video in one piece
+        :rtype: list of tuple
+        """
+        index = job.seq.frame_index
+        if (not self.env.chunk_frames or index.gaps()
+                or self.encoder_threads // THREADS_PER_ENCODER < 2):
+            return []
+        ranges = chunk_ranges(index.frange, self.env.chunk_frames)
+        return ranges if len(ranges) > 1 else []
+
+    def encode_existing(self, claims=None, workers=None):
+        """Encode queued sequences whose frames are already on disk.
+
+        For sequences found with :func:`find_sequences` rather than
+        written from MPlay. With ``claims``, a sequence is only encoded
+        if this process claims it, so several machines can work through
+        the same sequences. Failures are collected and raised at the
+        end, like :meth:`execute`.
+
+        :param claims: Claims shared with the other machines, if any
+        :type claims: :class:`mplay_batch_cli.ClaimDir`
+        :param workers: Encodes to run at once. Defaults to
+            :attr:`Environment.max_encoders`
+        :type workers: int
+        :raises FFmpegFailedError: ffmpeg failed on a sequence
+        :raises FFmpegBatchFailedError: ffmpeg failed on several sequences
+        :return: Jobs encoded by this process
+        :rtype: list of :class:`SequenceWriterJob`
+        """
+        self.failures = []
+        self.progress = BatchProgress()
+        workers = min(workers or self.env.max_encoders,
+                      max(1, len(self.queue)))
+        self.encoder_threads = max(1, available_cpus() // workers)
+        encoded = []
+
+        def encode(job):
+            key = job.seq.stem
+            if claims and not claims.claim(key):
+                return
+            job.stats = StageRecorder(
+                job.seq.stats_path if self.env.stats else None, key)
+            try:
+                if self.env.held_frames:
+                    index = job.seq.frame_index
+                    job.held_runs = held_runs(
+                        index, hash_frames(index, _held_candidates(index)))
+                self.encode(job)
+            except Exception as err:
+                self.failures.append(err)
+                if claims:
+                    claims.release(key)
+            else:
+                encoded.append(job)
+                if claims:
+                    claims.finish(key)
+
+        def on_wait():
+            self.progress.report()
+            if claims:
+                claims.refresh()
+
+        pool = EncoderPool(workers)
+        for job in self.queue:
+            pool.submit(encode, job)
+        pool.join(on_wait=on_wait)
+        self._raise_failures()
+        return encoded
+
+    def _show_stats(self, seconds):
+        """Show how long the batch took and where the time went."""
+        totals = {}
+        for job in self.queue:
+            for record in job.stats.records:
+                totals.setdefault(record["stage"], 0.0)
+                totals[record["stage"]] += record["seconds"]
+        message = "MPlay Batch: {0} sequence(s) in {1:.2f}s".format(
+            len(self.queue), seconds)
+        if totals:
+            message += " ({0})".format(", ".join(
+                "{0} {1:.2f}s".format(stage, total)
+                for stage, total in sorted(totals.items())
+            ))
+        over = [job.seq.stem for job in self.queue
+                if _over_gif_budget(job.stats.records)]
+        if over:
+            message += ". May not fit their GIF budget: {0}".format(
+                ", ".join(over))
+        _show_status(message)
 
     @staticmethod
     def remove_image_sequence(seq):
         """Remove an image sequence from disk.
 
+        Uses the sequence's existing frame index rather than scanning
+        the directory again.
+
         :param seq: Sequence to remove
         :type seq: :class:`Sequence`
         """
-        files = glob.glob(seq.glob_pattern)
-        for file_ in files:
-            try:
-                os.remove(file_)
-            except OSError:
-                continue  # For now...
+        _remove_frames(seq.frame_index)
 
     def save_current(self):
         """Save the currently selected sequence to disk."""
-        # When doing "Current", there is no way to query MPlay for seq name
         seq = Sequence(self.location)
-        job = SequenceWriterJob(seq, "imgsave -a {0}".format(seq.path))
-        self.queue.append(job)
+        self.queue.append(SequenceWriterJob(seq))
         return self
 
     def save_all_seqs(self):
         """Save all sequences in the Sequence List to disk."""
-        seqls = hou.hscript("seqls")[0].split("\n")[:-1]
-        for i, seq_name in enumerate(seqls):
+        for i, seq_name in enumerate(self.env.session.seqls):
             seq = Sequence(self.location, index=i)
-            job = SequenceWriterJob(
-                seq,
-                "imgsave -s {0} -a {1}".format(seq_name, seq.path)
-            )
-            self.queue.append(job)
+            self.queue.append(SequenceWriterJob(seq, seq_name))
         return self
 
     @staticmethod
-    def format_ffmpeg_cmd(seq, env):
+    def format_ffmpeg_cmd(seq, env, threads=0):
         """Format a command for ffmpeg to export video.
 
         :param seq: Sequence to render
         :type seq: :class:`Sequence`
         :param env: Current session/env settings
         :type env: :class:`Environment`
+        :param threads: Threads for ffmpeg to use. 0 lets ffmpeg decide
+        :type threads: int
         :return: Shlex-formatted command list
         :rtype: list
         """
-        # Could move this to be an attribute of the Sequence class...
-        ffmpeg_cmd = (
-            "ffmpeg -nostdin -hide_banner -loglevel error -framerate {0} "
-            "-start_number {1} -pix_fmt yuv420p -pattern_type sequence "
-            "-i \"{2}\" -vf \"crop=trunc(iw/2)*2:trunc(ih/2)*2\" "
-            "\"{3}\" "
-            "-c:v libx264 -movflags faststart ".format(
-                env.fps, seq.frange[0], seq.ffmpeg_pattern, seq.video_path)
-        )
-        cmd = shlex.split(ffmpeg_cmd)
-        # TODO: Not very DRY. If more issues arise, take care of this elsewhere
-        if "linux" in sys.platform:
-            cmd.remove("-hide_banner")
-        return cmd
+        return _ffmpeg_base_cmd() + [
+            "-framerate", str(env.fps),
+            "-start_number", str(seq.frange[0]),
+            "-pattern_type", "sequence",
+            "-i", seq.ffmpeg_pattern,
+            "-vf", "crop=trunc(iw/2)*2:trunc(ih/2)*2"
+        ] + env.encode_profile.ffmpeg_args(threads) + _faststart_args(
+            seq.video_path) + ["-y", seq.video_path]
 
     @staticmethod
-    def format_ffmpeg_cmd_gif(seq, env):
-        """Format a command for ffmpeg to export a GIF.
-
-        This is a 2-part process that requires generating a tempfile
-        for the gif "palette" to make a higher quality gif. The commands
-        should run in the order in which they are stored in the returned
-        tuple.
+    def format_ffmpeg_cmd_combined(
+            seq, env, video=True, gif=True, threads=0, palette=None,
+            proxies=(), concat_list=None):
+        """Format ffmpeg commands that decode the sequence only once.
+
+        Every requested output is written from one filter graph,
+        including the GIF palette, instead of decoding the sequence
+        once per output like :meth:`format_ffmpeg_cmd` and
+        :meth:`format_ffmpeg_cmd_gif` do.
+
+        ``paletteuse`` can't write a frame until ``palettegen`` has seen
+        the whole sequence, so ffmpeg holds every decoded frame in
+        memory until then. For long sequences, pass ``palette`` to write
+        the palette to that file alongside the video instead, and map it
+        into the GIF with a second command.
+
+        Sequences with held frames can be read from a ``concat_list``
+        written by :func:`write_concat_list` instead of the image
+        sequence, so each hold is encoded once as a long frame.
 
         :param seq: Sequence to render
         :type seq: :class:`Sequence`
         :param env: Current session/env settings
         :type env: :class:`Environment`
-        :return: 2-tuple of Shlex-formatted command lists
-        :rtype: tuple of list
+        :param video: Write the video
+        :type video: bool
+        :param gif: Write the GIF
+        :type gif: bool
+        :param threads: Threads for ffmpeg to use. 0 lets ffmpeg decide
+        :type threads: int
+        :param palette: Path to write the GIF palette to, if any
+        :type palette: str
+        :param proxies: Smaller copies of the video to write as well
+        :type proxies: list of :class:`Proxy`
+        :param concat_list: ffconcat file to read the frames from
+        :type concat_list: str
+        :return: Shlex-formatted command lists, to be run in order
+        :rtype: list of list
         """
-        tfile = tempfile.NamedTemporaryFile(
+        source = _ffmpeg_source(seq, env.fps, concat_list)
+        cmd = _ffmpeg_base_cmd() + source
+        video_args = env.encode_profile.ffmpeg_args(threads)
+        video_args += _faststart_args(seq.video_path) + ["-y"]
+        # (label, filter chain, output options) for each output
+        outputs = []
+        if video:
+            outputs.append((
+                "v",
+                "crop=trunc(iw/2)*2:trunc(ih/2)*2",
+                video_args + [seq.video_path]
+            ))
+            for i, proxy in enumerate(proxies):
+                outputs.append((
+                    "r{0}".format(i),
+                    proxy.scale_filter(),
+                    video_args + [seq.proxy_path(proxy)]
+                ))
+        if gif and palette:
+            outputs.append((
+                "p",
+                "fps={0},palettegen".format(env.fps),
+                [
+                    "-threads", str(threads),
+                    "-frames:v", "1", "-update", "1", "-y", palette
+                ]
+            ))
+        elif gif:
+            outputs.append((
+                "g",
+                "fps={0},split[g0][g1];[g0]palettegen[p];"
+                "[g1][p]paletteuse".format(env.fps),
+                ["-threads", str(threads), "-y", seq.gif_path]
+            ))
+        if not outputs:
+            return []
+
+        if len(outputs) > 1:
+            graph = ["[0:v]split={0}{1}".format(
+                len(outputs),
+                "".join("[{0}]".format(name) for name, _, _ in outputs)
+            )]
+            graph += [
+                "[{0}]{1}[{0}out]".format(name, chain)
+                for name, chain, _ in outputs
+            ]
+        else:
+            graph = ["[0:v]{1}[{0}out]".format(*outputs[0])]
+        cmd += ["-filter_complex", ";".join(graph)]
+        for name, _, args in outputs:
+            cmd += ["-map", "[{0}out]".format(name)] + args
+        cmds = [cmd]
+
+        if gif and palette:
+            cmds.append(_ffmpeg_base_cmd() + source + [
+                "-i", palette,
+                "-lavfi", "fps={0}[x];[x][1:v]paletteuse".format(env.fps),
+                "-threads", str(threads),
+                "-y", seq.gif_path
+            ])
+        return cmds
+
+    @staticmethod
+    def format_ffmpeg_cmd_chunks(seq, env, ranges, segments, threads=0,
+                                 proxies=()):
+        """Format ffmpeg commands that encode the video in chunks.
+
+        Each chunk command writes its frame range of the video, and of
+        every proxy, to its own segment file, with a fixed keyframe
+        interval and no scene-cut keyframes so every chunk has the same
+        GOP structure. The chunks don't depend on each other so they can
+        run at once. The join command then copies
+        the segments into the final videos without encoding them again,
+        and must run after every chunk has finished.
+
+        :param seq: Sequence to render
+        :type seq: :class:`Sequence`
+        :param env: Current session/env settings
+        :type env: :class:`Environment`
+        :param ranges: First frame and length of each chunk, from
+            :func:`chunk_ranges`
+        :type ranges: list of tuple
+        :param segments: Segment files from :func:`_chunk_segments`
+        :type segments: list of tuple
+        :param threads: Threads for each chunk's ffmpeg to use
+        :type threads: int
+        :param proxies: Smaller copies of the video to write as well
+        :type proxies: list of :class:`Proxy`
+        :return: Chunk commands, and the command to join them
+        :rtype: tuple
+        """
+        chains = ["crop=trunc(iw/2)*2:trunc(ih/2)*2"]
+        chains += [proxy.scale_filter() for proxy in proxies]
+        video_args = env.encode_profile.ffmpeg_args(threads) + [
+            "-g", str(CHUNK_GOP_FRAMES),
+            "-keyint_min", str(CHUNK_GOP_FRAMES),
+            "-sc_threshold", "0"
+        ]
+        chunks = []
+        for i, (first, length) in enumerate(ranges):
+            cmd = _ffmpeg_base_cmd() + [
+                "-framerate", str(env.fps),
+                "-start_number", str(first),
+                "-pattern_type", "sequence",
+                "-i", seq.ffmpeg_pattern
+            ]
+            if len(chains) > 1:
+                graph = ["[0:v]split={0}{1}".format(
+                    len(chains),
+                    "".join("[s{0}]".format(n) for n in range(len(chains)))
+                )]
+                graph += [
+                    "[s{0}]{1}[s{0}out]".format(n, chain)
+                    for n, chain in enumerate(chains)
+                ]
+            else:
+                graph = ["[0:v]{0}[s0out]".format(chains[0])]
+            cmd += ["-filter_complex", ";".join(graph)]
+            for n, (_, _, paths) in enumerate(segments):
+                cmd += ["-map", "[s{0}out]".format(n)] + video_args + [
+                    "-frames:v", str(length), "-y", paths[i]
+                ]
+            chunks.append(cmd)
+
+        join = _ffmpeg_base_cmd()
+        for _, list_path, _ in segments:
+            join += ["-f", "concat", "-safe", "0", "-i", list_path]
+        for n, (path, _, _) in enumerate(segments):
+            join += [
+                "-map", "{0}:v".format(n), "-c", "copy"
+            ] + _faststart_args(path) + ["-y", path]
+        return chunks, join
+
+    @staticmethod
+    def format_ffmpeg_cmd_gif(seq, env, threads=0):
+        """Format a command for ffmpeg to export a GIF.
+
+        This is a 2-part process that requires generating a tempfile
+        for the gif "palette" to make a higher quality gif. The commands
+        should run in the order in which they are stored in the returned
+        tuple.
+
+        :param seq: Sequence to render
+        :type seq: :class:`Sequence`
+        :param env: Current session/env settings
+        :type env: :class:`Environment`
+        :param threads: Threads for ffmpeg to use. 0 lets ffmpeg decide
+        :type threads: int
+        :return: 2-tuple of Shlex-formatted command lists
+        :rtype: tuple of list
+        """
+        tfile = tempfile.NamedTemporaryFile(
             prefix="mplay_batch_", suffix=".png")
         palette_cmd = (
             "ffmpeg -nostdin -loglevel error -start_number {0} -i {1} "
-            "-vf \"fps={2},palettegen\" -y {3}".format(
-                seq.frange[0], seq.ffmpeg_pattern, env.fps, tfile.name
+            "-vf \"fps={2},palettegen\" -threads {4} -y {3}".format(
+                seq.frange[0], seq.ffmpeg_pattern, env.fps, tfile.name, threads
             )
         )
         palette_cmd = shlex.split(palette_cmd)
@@ -738,63 +2975,1945 @@ class SequenceWriter(object):
         gif_cmd = (
             "ffmpeg -nostdin -loglevel error "
             "-start_number {0} -i {1} -i {2} -lavfi "
-            "\"fps={3} [x]; [x][1:v] paletteuse\" -y {4}".format(
+            "\"fps={3} [x]; [x][1:v] paletteuse\" -threads {5} -y {4}".format(
                 seq.frange[0],
                 seq.ffmpeg_pattern,
                 tfile.name,
                 env.fps,
-                seq.gif_path
+                seq.gif_path,
+                threads
             )
         )
         gif_cmd = shlex.split(gif_cmd)
         return (palette_cmd, gif_cmd)
 
 
+class EncodeTask(object):
+    """Everything needed to encode one written image sequence.
+
+    Holds plain data only, so a task can run in MPlay's process or be
+    handed to the :class:`mplay_batch_daemon.EncodeDaemon` as JSON.
+    """
+
+    def __init__(self, label, commands, frames, palette=None,
+                 remove_frames=False, stage_dir=None, seq_dirname=None,
+                 stages=None, stats_path=None, job="", profile=None,
+                 convert=None, outputs=None, concat_list=None, chunks=None,
+                 chunk_workers=1, chunk_dir=None, catalog=None,
+                 journal=None, gif_budget=None):
+        self.label = label
+        self.commands = commands
+        self.frames = frames
+        self.palette = palette
+        self.concat_list = concat_list
+        self.chunks = chunks
+        self.chunk_workers = chunk_workers
+        self.chunk_dir = chunk_dir
+        self.gif_budget = gif_budget
+        self.remove_frames = remove_frames
+        self.stage_dir = stage_dir
+        self.seq_dirname = seq_dirname
+        self.stages = stages or (
+            ["encode"] * (len(commands) + bool(chunks)))
+        self.stats_path = stats_path
+        self.job = job
+        self.profile = profile
+        self.convert = convert
+        self.outputs = outputs
+        self.catalog = catalog
+        self.journal = journal
+        self.records = []
+
+    def run(self, on_progress=None):
+        """Run the ffmpeg commands, then clean up the source frames.
+
+        Each command, and the cleanup, is recorded as a stage in
+        :attr:`records` and in the stats file, if there is one. Encode
+        stages are also added to the throughput history.
+
+        Intermediate frames that should be kept are converted to their
+        final type first, if :attr:`convert` says where to. Any
+        :attr:`chunks` are encoded next, up to :attr:`chunk_workers` at
+        once, as the first stage. With a :attr:`gif_budget`, the GIF's
+        settings are planned by :meth:`GifBudget.plan` and its commands
+        run last. Each command writes its outputs under temporary names,
+        which are moved into place once it succeeds.
+
+        Once encoded, :attr:`outputs` is added to the sequence
+        directory's :class:`OutputManifest`, and :attr:`catalog` to the
+        :class:`mplay_batch_catalog.FlipbookCatalog` after cleanup, if
+        there are any. With a :attr:`journal` directory, the ``encode``
+        and ``cleanup`` stages are checkpointed in its
+        :class:`BatchJournal`.
+
+        :param on_progress: Called as ffmpeg reports progress, with the
+            job name, frames done, total frames and frames per second.
+            Frames are counted over every pass
+        :type on_progress: callable
+        :raises ImageConversionError: Intermediate frames failed to
+            convert
+        :raises FFmpegFailedError: ffmpeg returned an error
+        """
+        recorder = StageRecorder(
+            self.stats_path, self.job, history_path=throughput_history_path())
+        self.records = recorder.records
+        frames = len(self.frames)
+        if self.convert:
+            with recorder.stage("convert", frames) as record:
+                converted = convert_frames(
+                    self.frames, self.convert["dirname"], self.convert["ext"])
+                record["bytes"] = _file_sizes(converted.paths())
+        commands = list(self.commands)
+        gif_commands = 0
+        if self.gif_budget:
+            gif_commands = 2 if self.palette else 1
+        passes = len(commands) + bool(self.chunks) + gif_commands
+        total = frames * passes
+
+        def report(passes_done, values):
+            if on_progress:
+                done = passes_done * frames + int(values.get("frame", 0))
+                fps = float(values.get("fps", 0) or 0)
+                on_progress(self.job, min(done, total), total, fps)
+
+        try:
+            if self.chunks:
+                with recorder.stage(
+                        self.stages[0], frames, history=True) as record:
+                    self._run_chunks(lambda values: report(0, values))
+                    record["bytes"] = _file_sizes(
+                        path for cmd in self.chunks
+                        for path in _command_outputs(cmd))
+                    record["threads"] = _command_threads(self.chunks[0])
+                    record["workers"] = self.chunk_workers
+                    record["profile"] = self.profile
+                report(1, {})
+            if self.gif_budget:
+                with recorder.stage("gif_plan", frames) as record:
+                    commands += self._plan_gif(record)
+            first = passes - len(commands)
+            for i, (stage, cmd) in enumerate(
+                    zip(self.stages[first:], commands), first):
+                with recorder.stage(stage, frames, history=True) as record:
+                    temp_cmd, outputs = _temp_outputs(cmd)
+                    try:
+                        run_ffmpeg(
+                            temp_cmd, lambda values, i=i: report(i, values))
+                        for temp, path in outputs:
+                            _replace(temp, path)
+                    finally:
+                        for temp, _ in outputs:
+                            try:
+                                os.remove(temp)
+                            except OSError:
+                                pass
+                    record["bytes"] = _file_sizes(_command_outputs(cmd))
+                    record["threads"] = _command_threads(cmd)
+                    record["profile"] = self.profile
+                # Held frames are encoded once, so the count falls short
+                report(i + 1, {})
+        except subprocess.CalledProcessError as err:
+            raise FFmpegFailedError(self.label, err)
+        finally:
+            for temp in (self.palette, self.concat_list):
+                if not temp:
+                    continue
+                try:
+                    os.remove(temp)
+                except OSError:
+                    pass
+            if self.chunk_dir:
+                shutil.rmtree(self.chunk_dir, ignore_errors=True)
+        if self.outputs:
+            OutputManifest(self.seq_dirname).add(self.outputs)
+        journal = BatchJournal(self.journal) if self.journal else None
+        if journal:
+            journal.checkpoint(self.job, "encode")
+        if self.remove_frames:
+            with recorder.stage("cleanup", frames=frames) as record:
+                record["bytes"] = _remove_frames(
+                    self.frames, measure=bool(self.stats_path))
+        if self.catalog:
+            from mplay_batch_catalog import FlipbookCatalog
+
+            FlipbookCatalog().add(self.catalog)
+        if journal:
+            journal.checkpoint(self.job, "cleanup")
+
+    def _plan_gif(self, record):
+        """Plan the GIF within :attr:`gif_budget` and format its commands.
+
+        :param record: Stage record to add the plan to
+        :type record: dict
+        :raises subprocess.CalledProcessError: A test encode failed
+        :return: Commands that make the GIF
+        :rtype: list of list
+        """
+        budget = self.gif_budget
+        plan = GifBudget(budget["max_bytes"], budget["max_seconds"]).plan(
+            self.frames,
+            budget["fps"],
+            budget["scratch"],
+            threads=budget["threads"]
+        )
+        record["plan"] = plan
+        return GifBudget.format_cmds(
+            budget["source"],
+            budget["path"],
+            budget["fps"],
+            plan,
+            threads=budget["threads"],
+            palette=self.palette
+        )
+
+    def _run_chunks(self, on_progress):
+        """Run every chunk command, several at once.
+
+        Once a chunk fails, chunks that haven't started are skipped.
+
+        :param on_progress: Called with the ``frame`` and ``fps`` of
+            all the chunks together as they make progress
+        :type on_progress: callable
+        :raises subprocess.CalledProcessError: A chunk failed
+        """
+        progress = {}
+        errors = []
+
+        def run(i, cmd):
+            if errors:
+                return
+
+            def update(values):
+                progress[i] = values
+                on_progress({
+                    key: sum(float(chunk.get(key, 0) or 0)
+                             for chunk in list(progress.values()))
+                    for key in ("frame", "fps")
+                })
+
+            try:
+                run_ffmpeg(cmd, update)
+            except Exception as err:
+                errors.append(err)
+
+        pool = EncoderPool(self.chunk_workers)
+        for i, cmd in enumerate(self.chunks):
+            pool.submit(run, i, cmd)
+        pool.join()
+        if errors:
+            raise errors[0]
+
+    def release_stage_dir(self, failed=False):
+        """Remove this task's staging directory once it is done with.
+
+        :param failed: Move the staged frames into the sequence's
+            directory first, so a failed encode can be retried by hand
+        :type failed: bool
+        """
+        if not self.stage_dir:
+            return
+        if failed:
+            _move_frames(self.frames, self.seq_dirname)
+        shutil.rmtree(self.stage_dir, ignore_errors=True)
+
+    def to_dict(self):
+        """Plain-data form of this task, for JSON."""
+        data = dict(self.__dict__)
+        data["frames"] = self.frames.to_dict()
+        del data["records"]
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        """Rebuild a task from :meth:`to_dict` output."""
+        data = dict(data)
+        data["frames"] = FrameIndex.from_dict(data["frames"])
+        return cls(**data)
+
+
+def convert_frames(index, dirname, ext, workers=None):
+    """Convert every frame of a sequence to another image type.
+
+    Frames are converted in parallel, one process each. Houdini's
+    ``iconvert`` is used when it is on the PATH, ffmpeg otherwise.
+
+    :param index: Frames to convert
+    :type index: :class:`FrameIndex`
+    :param dirname: Directory to write the converted frames to
+    :type dirname: str
+    :param ext: Image type to convert to
+    :type ext: str
+    :param workers: Conversions to run at once. Defaults to the CPUs
+        available
+    :type workers: int
+    :raises ValueError: The frames would be converted onto themselves
+    :raises ImageConversionError: Any frame failed to convert
+    :return: Index of the converted frames
+    :rtype: :class:`FrameIndex`
+    """
+    converted = FrameIndex(dirname, index.prefix, "." + ext, index.frames)
+    if index.frames and _same_path(
+            index.path(index.frames[0]), converted.path(index.frames[0])):
+        raise ValueError("{0} frames are already {1}".format(
+            os.path.join(dirname, index.prefix), ext))
+    iconvert = find_executable("iconvert")
+    errors = []
+
+    def convert(src, dst):
+        if iconvert:
+            cmd = [iconvert, src, dst]
+        else:
+            cmd = _ffmpeg_base_cmd() + ["-i", src, "-update", "1", "-y", dst]
+        try:
+            subprocess.check_call(cmd, **Environment.subprocess_kwargs())
+        except (subprocess.CalledProcessError, OSError) as err:
+            errors.append(err)
+
+    pool = EncoderPool(workers or available_cpus())
+    for frame in index.frames:
+        pool.submit(convert, index.path(frame), converted.path(frame))
+    pool.join()
+    if errors:
+        raise ImageConversionError(
+            "{0}/{1}*{2}".format(dirname, index.prefix, converted.suffix),
+            errors)
+    return converted
+
+
+def _same_path(path, other):
+    """Whether two paths name the same file, existing or not."""
+    return (os.path.normcase(os.path.abspath(path))
+            == os.path.normcase(os.path.abspath(other)))
+
+
+def hash_frames(index, frames=None, workers=None):
+    """Hash the contents of an image sequence's frames.
+
+    Frames are hashed in parallel, since hashlib releases the GIL while
+    it works.
+
+    :param index: Sequence to hash
+    :type index: :class:`FrameIndex`
+    :param frames: Frame numbers to hash. Defaults to every frame
+    :type frames: list of int
+    :param workers: Frames to hash at once. Defaults to the CPUs
+        available
+    :type workers: int
+    :return: Size and SHA-1 hex digest of each frame, leaving out
+        frames that couldn't be read
+    :rtype: dict
+    """
+    import hashlib
+
+    frames = index.frames if frames is None else frames
+    hashes = {}
+    if not len(frames):
+        return hashes
+
+    def digest(frame):
+        sha = hashlib.sha1()
+        try:
+            with open(index.path(frame), "rb") as file_:
+                for chunk in iter(lambda: file_.read(1024 * 1024), b""):
+                    sha.update(chunk)
+                hashes[frame] = (file_.tell(), sha.hexdigest())
+        except (IOError, OSError):
+            pass
+
+    pool = EncoderPool(min(len(frames), workers or available_cpus()))
+    for frame in frames:
+        pool.submit(digest, frame)
+    pool.join()
+    return hashes
+
+
+def fingerprint_frames(index, settings, hashes=None):
+    """Fingerprint an image sequence and the settings it's saved with.
+
+    Covers every frame's number, size and content, so changing any
+    frame changes the fingerprint.
+
+    :param index: Frames to fingerprint
+    :type index: :class:`FrameIndex`
+    :param settings: JSON-able settings that affect the saved files
+    :type settings: dict
+    :param hashes: Frame hashes from :func:`hash_frames`, if they've
+        already been made
+    :type hashes: dict
+    :return: Hex digest, or None if there are no frames or one
+        couldn't be read
+    :rtype: str
+    """
+    import hashlib
+
+    if not index:
+        return None
+    if hashes is None:
+        hashes = hash_frames(index)
+    sha = hashlib.sha1(json.dumps(settings, sort_keys=True).encode("utf-8"))
+    for frame in index.frames:
+        if frame not in hashes:
+            return None
+        sha.update("{0}:{1}:{2}\n".format(frame, *hashes[frame]).encode(
+            "utf-8"))
+    return sha.hexdigest()
+
+
+def held_runs(index, hashes):
+    """Split a sequence into runs of consecutive identical frames.
+
+    :param index: Sequence to split
+    :type index: :class:`FrameIndex`
+    :param hashes: Frame hashes from :func:`hash_frames`. Frames that
+        weren't hashed are never part of a hold
+    :type hashes: dict
+    :return: First frame and length of each run, in frame order
+    :rtype: list of list
+    """
+    runs = []
+    previous = None
+    for frame in index.frames:
+        digest = hashes.get(frame)
+        if (runs and digest is not None and digest == previous
+                and frame == runs[-1][0] + runs[-1][1]):
+            runs[-1][1] += 1
+        else:
+            runs.append([frame, 1])
+        previous = digest
+    return runs
+
+
+def _held_candidates(index):
+    """Frames the same size as a neighbour, which any hold is among."""
+    sizes = []
+    for path in index.paths():
+        try:
+            sizes.append(os.path.getsize(path))
+        except OSError:
+            sizes.append(None)
+    frames = index.frames
+    return [
+        frames[i] for i, size in enumerate(sizes)
+        if size is not None and (
+            (i > 0 and sizes[i - 1] == size)
+            or (i + 1 < len(sizes) and sizes[i + 1] == size))
+    ]
+
+
+def write_concat_list(path, index, runs, fps):
+    """Write an ffconcat file showing each run of frames once.
+
+    Each run's first frame is listed with the duration of the whole
+    run, so ffmpeg encodes it once instead of once per frame. The
+    concat demuxer ignores the duration of the last file, so the last
+    run's final frame is listed on its own to end the sequence on time
+    without adding a frame.
+
+    :param path: ffconcat file to write
+    :type path: str
+    :param index: Sequence the runs are from
+    :type index: :class:`FrameIndex`
+    :param runs: Runs from :func:`held_runs`
+    :type runs: list of list
+    :param fps: Frames per second the sequence plays at
+    :type fps: float
+    """
+    def entry(frame):
+        return "file '{0}'".format(index.path(frame).replace("'", "'\\''"))
+
+    runs = [tuple(run) for run in runs]
+    if runs and runs[-1][1] > 1:
+        first, length = runs.pop()
+        runs += [(first, length - 1), (first + length - 1, 1)]
+    lines = ["ffconcat version 1.0"]
+    for first, length in runs:
+        lines.append(entry(first))
+        lines.append("duration {0:.6f}".format(length / float(fps)))
+    with open(path, "w") as file_:
+        file_.write("\n".join(lines) + "\n")
+
+
+def chunk_ranges(frange, size):
+    """Split a frame range into chunks to encode separately.
+
+    :param frange: First and last frame
+    :type frange: tuple
+    :param size: Frames per chunk. Rounded up to a multiple of
+        :data:`CHUNK_GOP_FRAMES`
+    :type size: int
+    :return: First frame and length of each chunk
+    :rtype: list of tuple
+    """
+    size = -(-size // CHUNK_GOP_FRAMES) * CHUNK_GOP_FRAMES
+    first, last = frange
+    return [
+        (start, min(size, last - start + 1))
+        for start in range(first, last + 1, size)
+    ]
+
+
+def _chunk_segments(seq, count, dirname, proxies=()):
+    """Segment files to encode the chunks of a sequence's videos to.
+
+    :return: Final path, ffconcat list and segment paths of the video
+        and of each proxy
+    :rtype: list of tuple
+    """
+    ext = os.path.splitext(seq.video_path)[1]
+    paths = [seq.video_path] + [seq.proxy_path(proxy) for proxy in proxies]
+    return [
+        (path, "{0}/{1}.ffconcat".format(dirname, n), [
+            "{0}/{1}_{2:04d}{3}".format(dirname, n, i, ext)
+            for i in range(count)
+        ])
+        for n, path in enumerate(paths)
+    ]
+
+
+def _write_segment_list(path, segments):
+    """Write an ffconcat file that plays ``segments`` back to back."""
+    lines = ["ffconcat version 1.0"] + [
+        "file '{0}'".format(segment.replace("'", "'\\''"))
+        for segment in segments
+    ]
+    with open(path, "w") as file_:
+        file_.write("\n".join(lines) + "\n")
+
+
+def _ffmpeg_source(seq, fps, concat_list=None):
+    """ffmpeg input options that read a sequence's frames.
+
+    :param seq: Sequence to read
+    :type seq: :class:`Sequence`
+    :param fps: Frames per second to read the frames at
+    :type fps: float
+    :param concat_list: ffconcat file from :func:`write_concat_list` to
+        read the frames from instead of the image sequence
+    :type concat_list: str
+    :rtype: list
+    """
+    if concat_list:
+        return [
+            "-f", "concat", "-safe", "0", "-i", concat_list, "-vsync", "vfr"
+        ]
+    return [
+        "-framerate", str(fps),
+        "-start_number", str(seq.frange[0]),
+        "-pattern_type", "sequence",
+        "-i", seq.ffmpeg_pattern
+    ]
+
+
+class GifBudget(object):
+    """Largest file and longest encode time to make a GIF within.
+
+    Long or high resolution flipbooks make GIFs that are slow to encode
+    and too big to share. Within a budget, frames are dropped and the
+    GIF scaled down until it fits, judged by test encodes of a few
+    short windows of the sequence before the real encode starts.
+
+    :param max_bytes: Largest GIF to write. 0 for no limit
+    :type max_bytes: int
+    :param max_seconds: Longest the GIF may take to encode, including
+        the test encodes. 0 for no limit
+    :type max_seconds: float
+    """
+
+    # Widths to try below the sequence's own, largest first
+    WIDTHS = (1920, 1280, 960, 720, 640, 480, 320)
+
+    # Keep every Nth frame, as a fraction of the session's fps
+    STEPS = (1, 2, 3, 4)
+
+    # Output frames in each sampled window, and the most windows to
+    # sample. Shorter sequences get fewer windows, so the sample stays
+    # under 1/SAMPLE_FRACTION of the sequence
+    SAMPLE_FRAMES = 8
+    SAMPLE_WINDOWS = 3
+    SAMPLE_FRACTION = 4
+
+    # Test encodes to make before settling on the smallest settings
+    MAX_TRIALS = 5
+
+    def __init__(self, max_bytes=0, max_seconds=0):
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+
+    @classmethod
+    def from_env(cls, env):
+        """Budget set by an :class:`Environment`'s GIF settings."""
+        return cls(
+            max_bytes=int(env.gif_max_size_mb * 1024 ** 2),
+            max_seconds=env.gif_max_seconds
+        )
+
+    @property
+    def enabled(self):
+        """Whether any limit is set."""
+        return bool(self.max_bytes or self.max_seconds)
+
+    def to_dict(self):
+        """Plain-data form of this budget, for JSON."""
+        return {"max_bytes": self.max_bytes, "max_seconds": self.max_seconds}
+
+    def candidates(self, width):
+        """Frame steps and widths to try, best looking first.
+
+        Ordered by the pixels each second of the GIF holds, so dropping
+        frames and scaling down take turns.
+
+        :param width: Width of the sequence's frames
+        :type width: int
+        :return: Frame step and width of each candidate
+        :rtype: list of tuple
+        """
+        widths = [width] + [size for size in self.WIDTHS if size < width]
+        return sorted(
+            ((step, size) for step in self.STEPS for size in widths),
+            key=lambda item: (-float(item[1]) ** 2 / item[0], -item[1])
+        )
+
+    def plan(self, index, fps, dirname, threads=0):
+        """Pick the settings to encode a sequence's GIF with.
+
+        The palette's ``stats_mode`` is picked by test encoding the
+        sample at full quality both ways and keeping the smaller, if
+        the first doesn't already fit.
+        Candidates are then tried, skipping any the previous test
+        predicts won't fit, until one fits or :attr:`MAX_TRIALS` runs
+        out, leaving the smallest. Sizes and times are extrapolated from
+        the sample by the sequence's frame count.
+
+        :param index: Frames of the sequence
+        :type index: :class:`FrameIndex`
+        :param fps: Frames per second the sequence plays at
+        :type fps: float
+        :param dirname: Local directory to write the test encodes in
+        :type dirname: str
+        :param threads: Threads for ffmpeg to use. 0 lets ffmpeg decide
+        :type threads: int
+        :raises subprocess.CalledProcessError: A test encode failed
+        :return: ``step``, ``width`` and ``stats_mode`` to encode with,
+            the estimated ``bytes`` and ``seconds`` it will take, and
+            whether it ``fits``
+        :rtype: dict
+        """
+        start = _timer()
+        sample_dir = tempfile.mkdtemp(prefix="mplay_batch_gif_", dir=dirname)
+        trials = []
+
+        def trial(step, width, stats_mode):
+            sample = self._sample(index, step)
+            list_path = os.path.join(sample_dir, "{0}.ffconcat".format(step))
+            write_concat_list(
+                list_path, index, [(frame, 1) for frame in sample], fps)
+            path = os.path.join(sample_dir, "{0}.gif".format(len(trials)))
+            cmd, = self.format_cmds(
+                ["-f", "concat", "-safe", "0", "-i", list_path],
+                path,
+                fps,
+                {"step": step, "width": width, "stats_mode": stats_mode},
+                threads=threads
+            )
+            began = _timer()
+            subprocess.check_call(cmd, **Environment.subprocess_kwargs())
+            scale = len(index) / float(len(sample))
+            result = {
+                "step": step,
+                "width": width or _gif_width(path),
+                "stats_mode": stats_mode,
+                "bytes": int(os.path.getsize(path) * scale),
+                "seconds": (_timer() - began) * scale
+            }
+            trials.append(result)
+            return result
+
+        def fits(result):
+            seconds = result["seconds"] + _timer() - start
+            return bool(
+                (not self.max_bytes or result["bytes"] <= self.max_bytes)
+                and (not self.max_seconds or seconds <= self.max_seconds))
+
+        try:
+            best = trial(1, None, "full")
+            if self.max_bytes and not fits(best):
+                diff = trial(1, best["width"], "diff")
+                if diff["bytes"] < best["bytes"]:
+                    best = diff
+            candidates = self.candidates(best["width"])
+            last = best
+
+            def predict(step, width):
+                # Both scale with the pixels the GIF holds, roughly
+                ratio = (
+                    float(width) ** 2 / step
+                    / (float(last["width"]) ** 2 / last["step"]))
+                return dict(
+                    last, step=step, width=width,
+                    bytes=int(last["bytes"] * ratio),
+                    seconds=last["seconds"] * ratio)
+
+            for step, width in candidates[1:]:
+                if fits(last) or len(trials) >= self.MAX_TRIALS:
+                    break
+                if (fits(predict(step, width))
+                        or (step, width) == candidates[-1]):
+                    last = trial(step, width, best["stats_mode"])
+            if not fits(last):
+                last = predict(*candidates[-1])
+        finally:
+            shutil.rmtree(sample_dir, ignore_errors=True)
+        last["fits"] = fits(last)
+        last["trials"] = len(trials)
+        return last
+
+    def _sample(self, index, step):
+        """Frames of evenly spaced windows through a sequence.
+
+        Each window is long enough for :attr:`SAMPLE_FRAMES` frames to
+        be left once every ``step``-th frame is kept.
+
+        :rtype: list of int
+        """
+        frames = index.frames
+        length = self.SAMPLE_FRAMES * step
+        if len(frames) <= length:
+            return list(frames)
+        windows = max(1, min(
+            self.SAMPLE_WINDOWS,
+            len(frames) // (length * self.SAMPLE_FRACTION)))
+        spacing = (len(frames) - length) // max(1, windows - 1)
+        sample = []
+        for i in range(windows):
+            start = i * spacing
+            sample += frames[start:start + length]
+        return sample
+
+    @staticmethod
+    def format_cmds(source, path, fps, plan, threads=0, palette=None):
+        """Format ffmpeg commands that make a GIF with a :meth:`plan`.
+
+        :param source: ffmpeg input options that read the frames
+        :type source: list
+        :param path: GIF to write
+        :type path: str
+        :param fps: Frames per second the sequence plays at
+        :type fps: float
+        :param plan: Settings from :meth:`plan`
+        :type plan: dict
+        :param threads: Threads for ffmpeg to use. 0 lets ffmpeg decide
+        :type threads: int
+        :param palette: Path to write the palette to, so the frames don't
+            have to be held in memory until it's made
+        :type palette: str
+        :return: Shlex-formatted command lists, to be run in order
+        :rtype: list of list
+        """
+        chain = "fps={0}/{1}".format(fps, plan["step"])
+        if plan["width"]:
+            chain += ",scale={0}:-1:flags=lanczos".format(plan["width"])
+        palettegen = "palettegen=stats_mode={0}".format(plan["stats_mode"])
+        if not palette:
+            return [_ffmpeg_base_cmd() + source + [
+                "-lavfi",
+                "{0},split[g0][g1];[g0]{1}[p];[g1][p]paletteuse".format(
+                    chain, palettegen),
+                "-threads", str(threads), "-y", path
+            ]]
+        return [
+            _ffmpeg_base_cmd() + source + [
+                "-vf", "{0},{1}".format(chain, palettegen),
+                "-threads", str(threads),
+                "-frames:v", "1", "-update", "1", "-y", palette
+            ],
+            _ffmpeg_base_cmd() + source + [
+                "-i", palette,
+                "-lavfi", "[0:v]{0}[x];[x][1:v]paletteuse".format(chain),
+                "-threads", str(threads), "-y", path
+            ]
+        ]
+
+
+def _gif_width(path):
+    """Width of a GIF, from its logical screen descriptor."""
+    with open(path, "rb") as file_:
+        header = bytearray(file_.read(10))
+    return header[6] | header[7] << 8
+
+
+class OutputManifest(object):
+    """Fingerprints and files of the sequences saved to a sub-version.
+
+    Each finished sequence adds a JSON line with its fingerprint from
+    :func:`fingerprint_frames` and the names of the files it left in
+    the sub-version's directory. Names are stored without the
+    sequence's stem, so a later save with the same fingerprint can
+    link the files in under its own stem instead of encoding them.
+    """
+
+    FILE = "mplay_batch_outputs.jsonl"
+
+    # Bump when a change to saving means old outputs can't be reused
+    VERSION = 1
+
+    _write_lock = threading.Lock()
+
+    def __init__(self, dirname):
+        self.dirname = dirname
+        self.path = "{0}/{1}".format(dirname, self.FILE)
+        self._entries = None
+
+    @classmethod
+    def previous(cls, seq_dir):
+        """Manifest of the newest earlier sub-version of a name.
+
+        :param seq_dir: Sub-version to look back from
+        :type seq_dir: :class:`SequenceDir`
+        :return: Manifest, or None if this is the first sub-version
+        :rtype: :class:`OutputManifest`
+        """
+        try:
+            current = int(seq_dir.sub_version)
+        except (TypeError, ValueError):
+            return None
+        version = SubVersionIndex(seq_dir.env.flipbook_dir).previous(
+            seq_dir.name, current)
+        if version is None:
+            return None
+        return cls(os.path.join(
+            seq_dir.env.flipbook_dir,
+            "{0}_{1}".format(
+                seq_dir.name, str(version).zfill(seq_dir.env.pad_sub_version))
+        ).replace(os.sep, "/"))
+
+    def add(self, entry):
+        """Record a saved sequence.
+
+        :param entry: ``fingerprint``, ``stem`` and file ``names``
+        :type entry: dict
+        """
+        line = json.dumps(entry, sort_keys=True) + "\n"
+        try:
+            with self._write_lock:
+                with open(self.path, "a") as file_:
+                    file_.write(line)
+        except (IOError, OSError):
+            pass  # Only costs the next save an encode
+
+    def find(self, fingerprint):
+        """Latest entry for a fingerprint whose files all still exist.
+
+        :return: Entry, or None if there's no usable match
+        :rtype: dict
+        """
+        if self._entries is None:
+            self._entries = {}
+            try:
+                with open(self.path) as file_:
+                    for line in file_:
+                        try:
+                            entry = json.loads(line)
+                            self._entries[entry["fingerprint"]] = entry
+                        except (ValueError, KeyError, TypeError):
+                            continue
+            except (IOError, OSError):
+                pass
+        entry = self._entries.get(fingerprint)
+        if not entry:
+            return None
+        for name in entry["names"]:
+            if not os.path.isfile(self._path(entry, name)):
+                return None
+        return entry
+
+    def link(self, entry, dirname, stem):
+        """Hardlink an entry's files into a directory under a new stem.
+
+        Files are copied where hardlinks aren't supported.
+
+        :param entry: Entry from :meth:`find`
+        :type entry: dict
+        :param dirname: Directory to link into
+        :type dirname: str
+        :param stem: Stem to name the links with
+        :type stem: str
+        :raises OSError: A file couldn't be linked or copied
+        :return: Total size of the linked files
+        :rtype: int
+        """
+        total = 0
+        for name in entry["names"]:
+            src = self._path(entry, name)
+            _link_file(src, "{0}/{1}{2}".format(dirname, stem, name))
+            total += os.path.getsize(src)
+        return total
+
+    def _path(self, entry, name):
+        return "{0}/{1}{2}".format(self.dirname, entry["stem"], name)
+
+
+class BatchJournal(object):
+    """Checkpoints of a batch saved from MPlay, for resuming it.
+
+    Kept as JSON lines in the batch's sub-version directory. The first
+    line records the save settings and every job in the queue. Then a
+    line is added as each job finishes a stage: ``imgsave`` once its
+    frames are on disk, ``encode`` once its videos and GIF are, and
+    ``cleanup`` once it is done. Lines are only ever appended, so a
+    crash loses at most the half-written last one. Unfinished batches
+    are also listed in :func:`cache_dir`, so they can be found without
+    scanning the flipbook directory.
+    """
+
+    FILE = "mplay_batch_journal.jsonl"
+    UNFINISHED_DIR = "unfinished"
+
+    _write_lock = threading.Lock()
+
+    def __init__(self, dirname):
+        self.dirname = dirname
+        self.path = "{0}/{1}".format(dirname, self.FILE)
+
+    def start(self, settings, jobs):
+        """Record a new batch and list it as unfinished.
+
+        :param settings: Save settings to resume the batch with
+        :type settings: dict
+        :param jobs: ``stem``, ``index``, ``seq_name`` and ``frange``
+            of each job, in queue order
+        :type jobs: list of dict
+        """
+        self._append({
+            "event": "batch",
+            "settings": settings,
+            "jobs": jobs,
+            "time": time.time()
+        })
+        try:
+            dir_ = os.path.join(cache_dir(), self.UNFINISHED_DIR)
+            try:
+                os.makedirs(dir_)
+            except OSError as error:
+                if error.errno != errno.EEXIST:
+                    raise
+            _atomic_write_json(self._marker(), {"dirname": self.dirname})
+        except (IOError, OSError):
+            pass  # Can still be resumed by naming the directory
+
+    def checkpoint(self, stem, stage, **state):
+        """Record that a job finished a stage.
+
+        Once every job in the batch has been cleaned up, the batch is
+        no longer listed as unfinished.
+
+        :param stem: The job's :attr:`Sequence.stem`
+        :type stem: str
+        :param stage: ``imgsave``, ``encode`` or ``cleanup``
+        :type stage: str
+        :param state: Anything else needed to resume from this stage
+        """
+        record = {"event": "stage", "stem": stem, "stage": stage}
+        record.update(state)
+        record["time"] = time.time()
+        self._append(record)
+        if stage == "cleanup" and self.finished():
+            try:
+                os.remove(self._marker())
+            except OSError:
+                pass
+
+    def load(self):
+        """Read the batch and the stages each job has finished.
+
+        :return: The latest ``batch`` record, or None if there isn't one,
+            and each job's stage records by stem and stage
+        :rtype: tuple
+        """
+        batch = None
+        done = {}
+        try:
+            with open(self.path) as file_:
+                lines = file_.readlines()
+        except (IOError, OSError):
+            lines = []
+        for line in lines:
+            try:
+                record = json.loads(line)
+                if record["event"] == "batch":
+                    batch = record
+                    done = {}
+                elif record["event"] == "stage":
+                    done.setdefault(record["stem"], {})[
+                        record["stage"]] = record
+            except (ValueError, KeyError, TypeError):
+                continue  # Cut short by a crash
+        return batch, done
+
+    def finished(self):
+        """Whether every job in the batch has been cleaned up."""
+        batch, done = self.load()
+        return batch is not None and all(
+            "cleanup" in done.get(job["stem"], {}) for job in batch["jobs"])
+
+    @classmethod
+    def unfinished(cls):
+        """Sub-version directories of the batches that haven't finished.
+
+        :return: Directories, oldest batch first
+        :rtype: list of str
+        """
+        dir_ = os.path.join(cache_dir(), cls.UNFINISHED_DIR)
+        try:
+            names = os.listdir(dir_)
+        except OSError:
+            return []
+        batches = []
+        for name in names:
+            path = os.path.join(dir_, name)
+            try:
+                with open(path) as file_:
+                    dirname = json.load(file_)["dirname"]
+                mtime = os.path.getmtime(path)
+            except (IOError, OSError, ValueError, KeyError, TypeError):
+                continue
+            if os.path.isdir(dirname):
+                batches.append((mtime, dirname))
+            else:
+                # Pruned or removed by hand, so there's nothing to resume
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        return [dirname for _, dirname in sorted(batches)]
+
+    def _append(self, record):
+        line = json.dumps(record, sort_keys=True) + "\n"
+        try:
+            with self._write_lock:
+                with open(self.path, "a") as file_:
+                    file_.write(line)
+        except (IOError, OSError):
+            pass  # Only costs redoing the stage if the batch is resumed
+
+    def _marker(self):
+        import hashlib
+
+        return os.path.join(
+            cache_dir(), self.UNFINISHED_DIR, "{0}.json".format(
+                hashlib.sha1(self.dirname.encode("utf-8")).hexdigest()))
+
+
+def _link_file(src, dst, copy=True):
+    """Hardlink ``src`` to ``dst``, replacing it.
+
+    :param copy: Copy the file where hardlinks aren't supported
+    :type copy: bool
+    :raises OSError: Copying failed
+    :return: Whether ``dst`` was replaced
+    :rtype: bool
+    """
+    tmp = "{0}.mplay_batch_link".format(dst)
+    try:
+        os.link(src, tmp)
+    except (AttributeError, OSError):
+        if not copy:
+            return False
+        shutil.copy2(src, tmp)
+    _replace(tmp, dst)
+    return True
+
+
+def _remove_frames(index, measure=False):
+    """Delete every frame in a :class:`FrameIndex` from disk.
+
+    :param measure: Stat each frame first, to report the bytes freed
+    :type measure: bool
+    :return: Bytes freed, if measured
+    :rtype: int
+    """
+    freed = 0 if measure else None
+    for file_ in index.paths():
+        try:
+            if measure:
+                freed += os.path.getsize(file_)
+            os.remove(file_)
+        except OSError:
+            continue  # For now...
+    return freed
+
+
+def _file_sizes(paths):
+    """Total size of the files that exist among ``paths``."""
+    total = 0
+    for path in paths:
+        try:
+            total += os.path.getsize(path)
+        except OSError:
+            continue
+    return total
+
+
+def _command_threads(cmd):
+    """Value of the first ``-threads`` option of an ffmpeg command."""
+    try:
+        return int(cmd[cmd.index("-threads") + 1])
+    except (ValueError, IndexError):
+        return None
+
+
+def _command_outputs(cmd):
+    """Output files of an ffmpeg command, the paths that follow ``-y``."""
+    return [cmd[i + 1] for i, arg in enumerate(cmd[:-1]) if arg == "-y"]
+
+
+def _temp_outputs(cmd):
+    """Point an ffmpeg command's outputs at temporary files beside them.
+
+    The temporary names keep the extension, so ffmpeg still picks the
+    same format. Moving them over the real outputs once the command
+    succeeds means a crash never leaves a half-written file in place.
+
+    :return: The command, and each output's temporary and real path
+    :rtype: tuple
+    """
+    cmd = list(cmd)
+    outputs = []
+    for i, arg in enumerate(cmd[:-1]):
+        if arg == "-y":
+            dirname, name = os.path.split(cmd[i + 1])
+            temp = os.path.join(dirname, ".mplay_batch_tmp_" + name)
+            outputs.append((temp, cmd[i + 1]))
+            cmd[i + 1] = temp
+    return cmd, outputs
+
+
+class StageRecorder(object):
+    """Records wall time, bytes and frames for each stage of a job.
+
+    Every finished stage is appended to :attr:`records`, and written
+    as a JSON line to ``path`` when there is one.
+    """
+
+    _write_lock = threading.Lock()
+
+    def __init__(self, path, job, history_path=None):
+        self.path = path
+        self.job = job
+        self.history_path = history_path
+        self.records = []
+
+    @contextlib.contextmanager
+    def stage(self, name, frames=None, history=False):
+        """Time the body of a ``with`` block as one stage.
+
+        Yields the record, so the block can fill in ``frames`` and
+        ``bytes`` once it knows them.
+
+        :param name: Name of the stage
+        :type name: str
+        :param frames: Frames the stage works on, if known up front
+        :type frames: int
+        :param history: Also add the stage to the throughput history
+        :type history: bool
+        """
+        record = {
+            "job": self.job,
+            "stage": name,
+            "frames": frames,
+            "bytes": None,
+            "time": time.time(),
+            "ok": False
+        }
+        start = _timer()
+        try:
+            yield record
+            record["ok"] = True
+        finally:
+            record["seconds"] = _timer() - start
+            if record["frames"] and record["seconds"]:
+                record["fps"] = record["frames"] / record["seconds"]
+            self.records.append(record)
+            self._write(self.path, record)
+            if history and record["ok"]:
+                self._write(self.history_path, record)
+
+    def _write(self, path, record):
+        if not path:
+            return
+        line = json.dumps(record, sort_keys=True) + "\n"
+        try:
+            with self._write_lock:
+                with open(path, "a") as file_:
+                    file_.write(line)
+        except (IOError, OSError):
+            pass  # Stats are never worth failing a save over
+
+
+def throughput_history_path():
+    """JSON lines file of past encode stages, for throughput analysis."""
+    return os.path.join(cache_dir(), "throughput.jsonl")
+
+
+class BatchProgress(object):
+    """Encode progress of every sequence in a batch.
+
+    Updated from encoder threads, reported from MPlay's own thread,
+    which is the only one allowed to touch its UI. That's taken to be
+    the thread the progress is created on.
+    """
+
+    def __init__(self, interval=1.0, show=None):
+        self.interval = interval
+        self.show = show or _show_status
+        self._ui_thread = threading.current_thread().ident
+        self._jobs = {}
+        self._order = []
+        self._lock = threading.Lock()
+        self._start = None
+        self._last_report = 0.0
+
+    def expect(self, job, total):
+        """Register a job before its encode starts, with a rough size."""
+        with self._lock:
+            if job not in self._jobs:
+                self._order.append(job)
+            self._jobs[job] = {"done": 0, "total": total, "fps": 0.0}
+
+    def update(self, job, done, total, fps):
+        """Record a job's progress. Safe to call from any thread."""
+        with self._lock:
+            if self._start is None:
+                self._start = time.time()
+            if job not in self._jobs:
+                self._order.append(job)
+            self._jobs[job] = {"done": done, "total": total, "fps": fps}
+        if threading.current_thread().ident == self._ui_thread:
+            self.report()
+
+    def report(self, force=False):
+        """Show progress, at most once per ``interval`` seconds."""
+        now = time.time()
+        if not force and now - self._last_report < self.interval:
+            return
+        message = self.message()
+        if message:
+            self._last_report = now
+            self.show(message)
+
+    def message(self):
+        """One-line summary of the jobs encoding now and the batch.
+
+        :return: Progress summary, or "" before any encode has started
+        :rtype: str
+        """
+        with self._lock:
+            if self._start is None:
+                return ""
+            jobs = [(name, dict(self._jobs[name])) for name in self._order]
+            elapsed = time.time() - self._start
+        done = sum(job["done"] for _, job in jobs)
+        total = sum(job["total"] for _, job in jobs)
+        parts = []
+        for name, job in jobs:
+            if 0 < job["done"] < job["total"]:
+                parts.append("{0} {1}/{2} ({3:.0f} fps, ETA {4})".format(
+                    name, job["done"], job["total"], job["fps"],
+                    _format_eta(job["total"] - job["done"], job["fps"])
+                ))
+        rate = done / elapsed if elapsed else 0.0
+        parts.append("Batch {0}/{1} frames, ETA {2}".format(
+            done, total, _format_eta(total - done, rate)))
+        return "MPlay Batch: " + " | ".join(parts)
+
+
+def _format_eta(frames, fps):
+    if frames <= 0:
+        return "0s"
+    if fps <= 0:
+        return "?"
+    return _format_duration(frames / fps)
+
+
+def _format_duration(seconds):
+    seconds = int(seconds)
+    if seconds < 60:
+        return "{0}s".format(seconds)
+    minutes, seconds = divmod(seconds, 60)
+    if minutes < 60:
+        return "{0}m{1:02d}s".format(minutes, seconds)
+    return "{0}h{1:02d}m".format(*divmod(minutes, 60))
+
+
+def run_ffmpeg(cmd, on_progress=None):
+    """Run an ffmpeg command, following its machine-readable progress.
+
+    :param cmd: ffmpeg command, as a list
+    :type cmd: list
+    :param on_progress: Called with a dict of ffmpeg's progress values
+        (``frame``, ``fps``, ``out_time_ms``, ...) on every update
+    :type on_progress: callable
+    :raises subprocess.CalledProcessError: ffmpeg failed. ``output``
+        holds what ffmpeg wrote to stderr
+    """
+    cmd = cmd[:1] + ["-progress", "pipe:1", "-nostats"] + cmd[1:]
+    process = subprocess.Popen(
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        **Environment.subprocess_kwargs()
+    )
+    # Drain stderr alongside stdout so neither pipe can fill up and block
+    errors = []
+    reader = threading.Thread(
+        target=lambda: errors.append(process.stderr.read()))
+    reader.daemon = True
+    reader.start()
+    values = {}
+    for line in iter(process.stdout.readline, b""):
+        key, _, value = line.decode("utf-8", "replace").strip().partition("=")
+        values[key] = value
+        if key == "progress":
+            if on_progress:
+                on_progress(values)
+            values = {}
+    process.wait()
+    reader.join()
+    if process.returncode:
+        raise subprocess.CalledProcessError(
+            process.returncode,
+            cmd,
+            output=b"".join(errors).decode("utf-8", "replace")
+        )
+
+
+def _over_gif_budget(records):
+    """Whether a GIF was planned in ``records`` that didn't fit its budget."""
+    return any(
+        not record["plan"]["fits"]
+        for record in records
+        if record["stage"] == "gif_plan" and "plan" in record
+    )
+
+
+def _move_frames(index, dest):
+    """Move every frame in a :class:`FrameIndex` into ``dest``."""
+    for file_ in index.paths():
+        try:
+            shutil.move(file_, dest)
+        except (IOError, OSError, shutil.Error):
+            continue
+
+
+def _faststart_args(path):
+    """Options that move a video's index to the front, where supported.
+
+    Only the mp4 and mov muxers have ``faststart``.
+    """
+    if os.path.splitext(path)[1].lower() in (".mp4", ".mov"):
+        return ["-movflags", "+faststart"]
+    return []
+
+
+def _ffmpeg_base_cmd():
+    """Start of every ffmpeg command, before any inputs."""
+    cmd = ["ffmpeg", "-nostdin", "-hide_banner", "-loglevel", "error"]
+    if "linux" in sys.platform:
+        cmd.remove("-hide_banner")
+    return cmd
+
+
+class FFmpegCapabilities(object):
+    """What the ffmpeg on this machine is and what it can do.
+
+    Probing ffmpeg means forking it several times and parsing its
+    output, which is slow on network-mounted builds. Results are cached
+    on disk, keyed on the executable's path, size and modification
+    time, so a rebuilt or replaced ffmpeg is probed again on its own.
+    """
+
+    CACHE_FILE = "ffmpeg_capabilities.json"
+
+    def __init__(self, path=None, size=0, mtime=0.0, version="",
+                 formats=None, encoders=None):
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.version = version
+        self.formats = formats or []
+        self.encoders = encoders or []
+
+    @classmethod
+    def probe(cls):
+        """Find ffmpeg on the PATH and query it directly.
+
+        :return: Freshly probed capabilities. ``path`` is None when
+            ffmpeg can't be found
+        :rtype: :class:`FFmpegCapabilities`
+        """
+        path = find_executable("ffmpeg")
+        if not path:
+            return cls()
+        stat = os.stat(path)
+        return cls(
+            path=path,
+            size=stat.st_size,
+            mtime=stat.st_mtime,
+            version=cls._parse_version(cls._run("-version")),
+            formats=cls._parse_formats(cls._run("-formats")),
+            encoders=cls._parse_encoders(cls._run("-encoders"))
+        )
+
+    @classmethod
+    def load(cls, refresh=False):
+        """Get capabilities from the cache, probing ffmpeg if needed.
+
+        :param refresh: Ignore the cache and probe ffmpeg again
+        :type refresh: bool
+        :return: ffmpeg capabilities
+        :rtype: :class:`FFmpegCapabilities`
+        """
+        cache_path = os.path.join(cache_dir(), cls.CACHE_FILE)
+        search_path = os.environ.get("PATH", "")
+        if not refresh:
+            try:
+                with open(cache_path) as file_:
+                    entry = json.load(file_)[search_path]
+                caps = cls(**entry)
+                if caps.is_current():
+                    return caps
+            except (IOError, OSError, ValueError, KeyError, TypeError):
+                pass
+        caps = cls.probe()
+        if caps.path:
+            caps.save(cache_path, search_path)
+        return caps
+
+    def is_current(self):
+        """Whether the executable still matches what was probed.
+
+        :return: True if the cached results can be trusted
+        :rtype: bool
+        """
+        if not self.path:
+            return False
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return False
+        return stat.st_size == self.size and stat.st_mtime == self.mtime
+
+    def save(self, cache_path, search_path):
+        """Store these capabilities in the cache file.
+
+        Entries are keyed on the PATH they were found with, since that
+        decides which ffmpeg ``find_executable`` would return.
+
+        :param cache_path: Cache file to write
+        :type cache_path: str
+        :param search_path: Value of PATH when ffmpeg was found
+        :type search_path: str
+        """
+        try:
+            with open(cache_path) as file_:
+                entries = json.load(file_)
+        except (IOError, OSError, ValueError):
+            entries = {}
+        entries[search_path] = self.__dict__
+        try:
+            _atomic_write_json(cache_path, entries)
+        except (IOError, OSError):
+            pass  # A cache that can't be written just isn't used
+
+    @staticmethod
+    def _run(flag):
+        cmd = _ffmpeg_base_cmd() + [flag]
+        out = subprocess.check_output(cmd, **Environment.subprocess_kwargs())
+        return out.decode("utf-8")
+
+    @staticmethod
+    def _parse_version(out):
+        match = re.match(r"\S+ version (\S+)", out)
+        return match.group(1) if match else ""
+
+    @staticmethod
+    def _parse_formats(out):
+        regex = re.compile(r"\s*(\w*)\s+(\w+)\s+(\w*)")
+        formats = []
+        for line in out.split("--")[1].split("\n"):
+            match = regex.match(line)
+            if match:
+                formats.append(match.group(2))
+        return formats
+
+    @staticmethod
+    def _parse_encoders(out):
+        regex = re.compile(r"\s*[VAS][\w.]{5}\s+(\S+)")
+        encoders = []
+        for line in out.split("------")[-1].split("\n"):
+            match = regex.match(line)
+            if match:
+                encoders.append(match.group(1))
+        return encoders
+
+
+_FFMPEG_CAPABILITIES = None
+
+
+def ffmpeg_capabilities(refresh=False):
+    """Capabilities of the ffmpeg on this machine.
+
+    Loaded once per session from the on-disk cache.
+
+    :param refresh: Probe ffmpeg again and rewrite the cache
+    :type refresh: bool
+    :return: ffmpeg capabilities
+    :rtype: :class:`FFmpegCapabilities`
+    """
+    global _FFMPEG_CAPABILITIES
+    if refresh or _FFMPEG_CAPABILITIES is None:
+        _FFMPEG_CAPABILITIES = FFmpegCapabilities.load(refresh=refresh)
+    return _FFMPEG_CAPABILITIES
+
+
+def cache_dir():
+    """Directory for mplay_batch's caches, created if needed.
+
+    Set by MPLAY_BATCH_CACHE_DIR, otherwise a folder in the user's
+    home directory.
+
+    :return: Path to the cache directory
+    :rtype: str
+    """
+    dir_ = os.environ.get(
+        "MPLAY_BATCH_CACHE_DIR",
+        os.path.join(os.path.expanduser("~"), ".cache", "mplay_batch")
+    )
+    try:
+        os.makedirs(dir_)
+    except OSError as error:
+        if error.errno != errno.EEXIST:
+            raise
+    return dir_
+
+
+def _atomic_write_json(path, data):
+    """Write JSON to a temp file next to ``path``, then move it over.
+
+    Readers never see a half-written file, even if this process dies.
+    """
+    handle, tmp_path = tempfile.mkstemp(
+        prefix=".mplay_batch_", dir=os.path.dirname(path) or ".")
+    try:
+        with os.fdopen(handle, "w") as file_:
+            json.dump(data, file_, indent=4, sort_keys=True)
+        _replace(tmp_path, path)
+    except Exception:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def _replace(src, dst):
+    """Rename ``src`` to ``dst``, overwriting it, on Python 2 and 3."""
+    try:
+        os.replace(src, dst)
+    except AttributeError:
+        if "win32" in sys.platform and os.path.exists(dst):
+            os.remove(dst)
+        os.rename(src, dst)
+
+
+class EncoderPool(object):
+    """Fixed number of worker threads running encodes in the background.
+
+    Each worker mostly waits on an ffmpeg subprocess, so threads are
+    enough to keep several encodes going at once. A task that raises
+    doesn't stop its worker. The first error is raised again from
+    :meth:`join` once every task has run.
+    """
+
+    def __init__(self, size):
+        self.size = max(1, size)
+        self._tasks = queue.Queue()
+        self._threads = []
+        self._errors = []
+        for i in range(self.size):
+            thread = threading.Thread(
+                target=self._work, name="mplay_batch_encode_{0}".format(i))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, func, *args):
+        """Queue a function to be called on the next free worker."""
+        self._tasks.put((func, args))
+
+    def join(self, on_wait=None, interval=0.5):
+        """Wait for every queued task to finish and stop the workers.
+
+        :param on_wait: Called every ``interval`` seconds while waiting,
+            on the calling thread
+        :type on_wait: callable
+        :param interval: Seconds between calls to ``on_wait``
+        :type interval: float
+        :raises Exception: The first error a task raised, if any
+        """
+        for _ in self._threads:
+            self._tasks.put(None)
+        for thread in self._threads:
+            while thread.is_alive():
+                thread.join(interval)
+                if on_wait:
+                    on_wait()
+        if self._errors:
+            raise self._errors[0]
+
+    def _work(self):
+        while True:
+            task = self._tasks.get()
+            if task is None:
+                return
+            func, args = task
+            try:
+                func(*args)
+            except Exception as err:
+                self._errors.append(err)
+
+
+def available_cpus():
+    """Number of CPUs this process is allowed to use.
+
+    Takes CPU affinity and Linux cgroup quotas (containers, farm
+    schedulers) into account, not just the cores in the machine.
+
+    :return: Usable CPU count, at least 1
+    :rtype: int
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        import multiprocessing
+
+        cpus = multiprocessing.cpu_count()
+    quota = _cgroup_cpu_quota()
+    if quota:
+        cpus = min(cpus, quota)
+    return max(1, cpus)
+
+
+def _cgroup_cpu_quota():
+    """Whole CPUs allowed by the cgroup quota, or None if unlimited."""
+    quota, period = None, None
+    try:
+        # cgroup v2
+        with open("/sys/fs/cgroup/cpu.max") as file_:
+            quota, period = file_.read().split()[:2]
+    except (IOError, OSError, ValueError):
+        try:
+            # cgroup v1
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as file_:
+                quota = file_.read().strip()
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as file_:
+                period = file_.read().strip()
+        except (IOError, OSError):
+            return None
+    try:
+        quota, period = int(quota), int(period)
+    except ValueError:
+        # "max" means no limit
+        return None
+    if quota <= 0 or period <= 0:
+        return None
+    return max(1, -(-quota // period))
+
+
+def free_disk_space(path):
+    """Bytes free for this user on the volume holding ``path``.
+
+    :return: Free bytes, or None if it can't be determined
+    :rtype: int
+    """
+    try:
+        return shutil.disk_usage(path).free
+    except AttributeError:
+        pass
+    except OSError:
+        return None
+    try:
+        stat = os.statvfs(path)
+    except (AttributeError, OSError):
+        return None
+    return stat.f_bavail * stat.f_frsize
+
+
+def _expand_string(value, strict=False):
+    """Expand variables like ``$JOB`` in a path, in or out of Houdini.
+
+    :param strict: Raise instead of leaving unset variables in the path
+    :type strict: bool
+    :raises ValueError: ``strict``, and a variable isn't set
+    """
+    if strict:
+        getenv = os.environ.get if hou is None else hou.getenv
+        for name in re.findall(r"\$\{?(\w+)", value):
+            if getenv(name) is None:
+                raise ValueError("Can't expand {0}, as ${1} isn't set".format(
+                    value, name))
+    if hou is None:
+        return os.path.expandvars(value)
+    return hou.expandString(value)
+
+
+def _python_executable():
+    """Python interpreter to run mplay_batch's background processes with.
+
+    Houdini's own ``sys.executable`` is usually the Houdini binary, so
+    look for the Python that ships with it. MPLAY_BATCH_PYTHON
+    overrides this.
+
+    :return: Path to a Python interpreter
+    :rtype: str
+    """
+    try:
+        return os.environ["MPLAY_BATCH_PYTHON"]
+    except KeyError:
+        pass
+    version = "{0}.{1}".format(*sys.version_info[:2])
+    hfs = os.environ.get("HFS", "")
+    candidates = [
+        os.path.join(hfs, "python", "bin", "python" + version),
+        os.path.join(hfs, "python{0}".format(version.replace(".", "")),
+                     "python.exe"),
+        os.path.join(hfs, "Frameworks", "Python.framework", "Versions",
+                     version, "bin", "python" + version),
+    ]
+    for path in candidates:
+        if hfs and os.path.isfile(path):
+            return path
+    return sys.executable
+
+
+def _spawn_detached(cmd, log_path):
+    """Start a process that outlives MPlay, logging to ``log_path``."""
+    kwargs = {}
+    if "win32" in sys.platform:
+        # DETACHED_PROCESS | CREATE_NEW_PROCESS_GROUP
+        kwargs["creationflags"] = 0x00000008 | 0x00000200
+    else:
+        # Own session, so closing MPlay doesn't take the process with it
+        kwargs["preexec_fn"] = os.setsid
+    with open(os.devnull) as devnull, open(log_path, "a") as log:
+        subprocess.Popen(
+            cmd,
+            stdin=devnull,
+            stdout=log,
+            stderr=log,
+            close_fds=True,
+            **kwargs
+        )
+
+
+def _cli_source():
+    """Path to :mod:`mplay_batch_cli`'s source, to run it as a script."""
+    return os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "mplay_batch_cli.py")
+
+
+def _show_status(text):
+    """Show a short message in MPlay's status bar, or print it."""
+    try:
+        hou.ui.setStatusMessage(text)
+    except AttributeError:
+        print(text)
+
+
+def _show_message(text):
+    """Show a message to the artist, in a dialog where MPlay allows."""
+    try:
+        hou.ui.displayMessage(text)
+    except AttributeError:
+        print(text)
+
+
+def _confirm(text, action="Continue"):
+    """Ask the artist whether to go ahead, in a dialog where MPlay allows.
+
+    :return: Whether to go ahead. Always True when there's no dialog
+    :rtype: bool
+    """
+    try:
+        choice = hou.ui.displayMessage(
+            text, buttons=(action, "Cancel"), default_choice=0,
+            close_choice=1)
+    except AttributeError:
+        print(text)
+        return True
+    return choice == 0
+
+
 def open_flipbook_dir(env):
     """Open the flipbook directory in the OS's file browser.
 
     :param env: Environment object to get directory from
     :type env: :class:`Environment`
     """
+    _open_path(env.flipbook_dir)
+
+
+def _open_path(path):
+    """Open a directory in the OS's file browser."""
     if "win32" in sys.platform:
-        os.startfile(env.flipbook_dir)
+        os.startfile(path)
     elif "darwin" in sys.platform:
-        os.system("open {0}".format(env.flipbook_dir))
+        os.system("open {0}".format(path))
     elif "linux" in sys.platform:
-        os.system("gio open {0}".format(env.flipbook_dir))
+        os.system("gio open {0}".format(path))
 
 
 def main(kwargs):
     """Entry point for the MPlay Batch program.
 
+    Set MPLAY_BATCH_PROFILE=1 to write a cProfile dump of the whole
+    call to the cache directory.
+
     :param kwargs: Houdini `kwargs` dict passed from the menu
     :type kwargs: dict
     :raises RuntimeError: Invalid tool selection
     """
+    try:
+        profile = int(os.environ.get("MPLAY_BATCH_PROFILE", 0))
+    except ValueError:
+        raise EnvironmentVariableTypeError("MPLAY_BATCH_PROFILE", "int")
+    if not profile:
+        _main(kwargs)
+        return
+
+    import cProfile
+
+    profiler = cProfile.Profile()
+    try:
+        profiler.runcall(_main, kwargs)
+    finally:
+        dir_ = os.path.join(cache_dir(), "profiles")
+        try:
+            os.makedirs(dir_)
+        except OSError as error:
+            if error.errno != errno.EEXIST:
+                raise
+        path = os.path.join(dir_, "mplay_batch_{0}_{1}.prof".format(
+            kwargs["toolname"], time.strftime("%Y%m%d-%H%M%S")))
+        profiler.dump_stats(path)
+        _show_status("MPlay Batch: profile written to {0}".format(path))
+
+
+def _main(kwargs):
+    """Run the tool selected from the menu."""
+    tool = kwargs["toolname"]
+
+    # Re-probe ffmpeg before anything reads the stale cache
+    if tool == "refresh_ffmpeg_cache":
+        ffmpeg_capabilities(refresh=True)
+        return
+
+    if tool == "encode_status":
+        from mplay_batch_daemon import EncodeDaemon
+
+        _show_message(EncodeDaemon().status_message())
+        return
+
+    if tool == "browse_flipbooks":
+        from mplay_batch_catalog import browse_flipbooks
+
+        browse_flipbooks()
+        return
+
     # Get the flipbook directory
     env = Environment()
-    tool = kwargs["toolname"]
 
     # Open the flipbook dir
     if tool == "open_flipbook_dir":
         open_flipbook_dir(env)
         return
 
+    if tool == "resume_batches":
+        dirnames = BatchJournal.unfinished()
+        if not dirnames:
+            _show_message("No unfinished batches to resume")
+        failures = []
+        for dirname in dirnames:
+            # Each batch brings its own save settings
+            try:
+                SequenceWriter.from_journal(dirname, Environment()).execute()
+            except ValueError as err:
+                failures.append(str(err))
+            except FFmpegFailedError as err:
+                failures.append("{0}: {1}".format(dirname, err))
+        if failures:
+            _show_message("MPlay Batch: {0} batch(es) failed to resume\n\n"
+                          "{1}".format(len(failures), "\n".join(failures)))
+        return
+
     # Check video options
     # TODO: Revert back to Radio Button style when RFE is fixed.
     keep_source = env.check_toggle_variable("MPLAY_BATCH_KEEP_VIDEO_SOURCE")
     export_video = env.check_toggle_variable("MPLAY_BATCH_OUTPUT_VIDEO")
     export_gif = env.check_toggle_variable("MPLAY_BATCH_OUTPUT_GIF")
 
+    def new_writer(dry_run=False):
+        return SequenceWriter(
+            env,
+            video=export_video,
+            gif=export_gif,
+            keep_video_source=keep_source,
+            dry_run=dry_run
+        )
+
+    if tool == "plan_all_seqs":
+        plan = new_writer(dry_run=True).save_all_seqs().plan()
+        _show_message(plan.message())
+        return
+
     # Handle menu selection
-    writer = SequenceWriter(
-        env,
-        video=export_video,
-        gif=export_gif,
-        keep_video_source=keep_source
-    )
+    writer = new_writer()
     try:
         command = getattr(writer, tool)
     except AttributeError:
         raise RuntimeError("Not a valid tool selection")
-    command().execute()
+    command()
+    # Only worth planning when there's a budget to check it against
+    if env.max_batch_minutes or env.max_size_gb:
+        plan = writer.plan()
+        if plan.warnings and not _confirm(plan.message(), "Save Anyway"):
+            try:
+                os.rmdir(writer.location.dirname)  # Still empty
+            except OSError:
+                pass
+            return
+    try:
+        writer.execute()
+    finally:
+        from mplay_batch_retention import prune_in_background
+
+        prune_in_background(env)
+
+
+def _format_size(size):
+    """Human-readable size of a number of bytes."""
+    if size < 1024:
+        return "{0} B".format(int(size))
+    for unit in ("KB", "MB", "GB"):
+        size /= 1024.0
+        if size < 1024:
+            return "{0:.1f} {1}".format(size, unit)
+    size /= 1024.0
+    return "{0:.1f} TB".format(size)
+
+
+if __name__ == "__main__":
+    # The command line moved to mplay_batch_cli. Still run it from here,
+    # for scripts written before it did
+    from mplay_batch_cli import main as _cli_main
+
+    sys.exit(_cli_main(sys.argv[1:]))
@@ -0,0 +1,412 @@
+"""MPlay Batch flipbook catalog
+
+An index of saved flipbooks and their thumbnails, to browse without
+walking the flipbook directory.
+"""
+import contextlib
+import errno
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import subprocess
+import time
+
+from mplay_batch import (
+    Environment,
+    SequenceDir,
+    SubVersionIndex,
+    _ffmpeg_base_cmd,
+    _file_sizes,
+    _format_size,
+    _list_subdirs,
+    _open_path,
+    _show_message,
+    cache_dir,
+    ffmpeg_capabilities,
+    hou
+)
+
+
+class FlipbookCatalog(object):
+    """Local SQLite index of the sequences saved to flipbook directories.
+
+    Listing a flipbook directory with thousands of sub-versions is slow
+    on network storage, so each sequence is recorded here as it
+    finishes: its frame range, resolution, size on disk, files and a
+    small cached thumbnail. Browsing and searching only read the index.
+    It is kept in :func:`cache_dir`, as SQLite's locking isn't safe on
+    network filesystems.
+    """
+
+    FILE = "catalog.sqlite"
+    THUMBNAIL_DIR = "thumbnails"
+    THUMBNAIL_WIDTH = 160
+
+    COLUMNS = (
+        "key", "dirname", "stem", "hip", "sub_version", "name",
+        "first_frame", "last_frame", "frames", "width", "height", "bytes",
+        "outputs", "thumbnail", "created"
+    )
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS sequences (
+            key TEXT PRIMARY KEY,
+            dirname TEXT NOT NULL,
+            stem TEXT NOT NULL,
+            hip TEXT,
+            sub_version TEXT,
+            name TEXT,
+            first_frame INTEGER,
+            last_frame INTEGER,
+            frames INTEGER,
+            width INTEGER,
+            height INTEGER,
+            bytes INTEGER,
+            outputs TEXT,
+            thumbnail TEXT,
+            created REAL
+        );
+        CREATE INDEX IF NOT EXISTS sequences_created ON sequences (created);
+        CREATE INDEX IF NOT EXISTS sequences_dirname ON sequences (dirname);
+        CREATE INDEX IF NOT EXISTS sequences_stem ON sequences (stem);
+        CREATE INDEX IF NOT EXISTS sequences_hip ON sequences (hip);
+    """
+
+    # Most values to bind in one query, under SQLite's oldest limit
+    MAX_PARAMS = 500
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(cache_dir(), self.FILE)
+
+    @contextlib.contextmanager
+    def _connect(self):
+        """Open the index, creating it if needed, and commit on success."""
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            conn.executescript(self._SCHEMA)
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def add(self, entry, names=None):
+        """Record a finished sequence, replacing any earlier record of it.
+
+        Lists the sequence's directory once to find its files, and
+        makes its thumbnail from the middle frame, or from the video or
+        GIF when the frames weren't kept.
+
+        :param entry: ``dirname``, ``stem``, ``hip``, ``sub_version``,
+            ``name``, ``frange``, ``fps`` and ``created`` of the
+            sequence
+        :type entry: dict
+        :param names: Files in the sequence's directory, if already
+            listed
+        :type names: list of str
+        """
+        dirname, stem = entry["dirname"], entry["stem"]
+        if names is None:
+            try:
+                names = os.listdir(dirname)
+            except OSError:
+                names = []
+        frame_regex = re.compile(r"^{0}\.(\d+)\.\w+$".format(re.escape(stem)))
+        frames = {}
+        outputs = []
+        for name in names:
+            match = frame_regex.match(name)
+            if match:
+                frames[int(match.group(1))] = name
+            elif name.startswith(stem + ".") or name.startswith(stem + "_"):
+                outputs.append(name)
+        outputs.sort()
+        frange = entry.get("frange")
+        if frames:
+            frange = [min(frames), max(frames)]
+        row = {
+            "key": "{0}/{1}".format(dirname, stem),
+            "dirname": dirname,
+            "stem": stem,
+            "hip": entry.get("hip"),
+            "sub_version": entry.get("sub_version"),
+            "name": entry.get("name"),
+            "first_frame": frange[0] if frange else None,
+            "last_frame": frange[1] if frange else None,
+            "frames": len(frames) or (
+                int(frange[1] - frange[0] + 1) if frange else None),
+            "width": None,
+            "height": None,
+            "bytes": _file_sizes(
+                "{0}/{1}".format(dirname, name)
+                for name in list(frames.values()) + outputs),
+            "outputs": json.dumps(outputs),
+            "thumbnail": None,
+            "created": entry.get("created") or time.time(),
+        }
+
+        source, seek = None, 0.0
+        if frames:
+            middle = sorted(frames)[len(frames) // 2]
+            source = "{0}/{1}".format(dirname, frames[middle])
+        elif outputs:
+            videos = [name for name in outputs if not name.endswith(".gif")]
+            source = "{0}/{1}".format(dirname, (videos or outputs)[0])
+            if row["frames"] and entry.get("fps"):
+                seek = row["frames"] // 2 / float(entry["fps"])
+        if source:
+            row["thumbnail"], size = self._make_thumbnail(
+                source, row["key"], seek)
+            if size:
+                row["width"], row["height"] = size
+
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO sequences ({0}) VALUES ({1})"
+                    .format(", ".join(self.COLUMNS),
+                            ", ".join("?" * len(self.COLUMNS))),
+                    [row[column] for column in self.COLUMNS]
+                )
+        except (sqlite3.Error, OSError):
+            pass  # Only costs finding this sequence in the catalog
+
+    def search(self, text="", limit=100):
+        """Newest sequences whose name, hip name or path match ``text``.
+
+        :param text: Words that must all appear, in any order. Empty
+            matches everything
+        :type text: str
+        :param limit: Most sequences to return
+        :type limit: int
+        :return: Matching sequences, newest first, as dicts keyed by
+            :attr:`COLUMNS`. ``outputs`` is a list of file names
+        :rtype: list of dict
+        """
+        query = "SELECT {0} FROM sequences".format(", ".join(self.COLUMNS))
+        words = text.split()
+        params = []
+        if words:
+            query += " WHERE " + " AND ".join(
+                "(key LIKE ? OR hip LIKE ? OR name LIKE ?)" for _ in words)
+            for word in words:
+                params += ["%{0}%".format(word)] * 3
+        query += " ORDER BY created DESC LIMIT ?"
+        params.append(limit)
+        try:
+            with self._connect() as conn:
+                rows = conn.execute(query, params).fetchall()
+        except sqlite3.Error:
+            return []
+        results = []
+        for values in rows:
+            row = dict(zip(self.COLUMNS, values))
+            row["outputs"] = json.loads(row["outputs"] or "[]")
+            results.append(row)
+        return results
+
+    def resolutions(self, hip, stems=()):
+        """Pixels per frame of some of the sequences in the catalog.
+
+        :param hip: Hip name to find the newest save of each sequence
+            name for
+        :type hip: str
+        :param stems: Sequences to look up by stem
+        :type stems: iterable of str
+        :return: Pixels of each of ``stems`` found, by stem, and of the
+            newest save of each sequence name from ``hip``, by name
+        :rtype: tuple of dict
+        """
+        by_stem = {}
+        by_name = {}
+        stems = sorted(stems)
+        try:
+            with self._connect() as conn:
+                rows = conn.execute(
+                    "SELECT stem, name, width, height FROM sequences "
+                    "WHERE hip = ? AND width IS NOT NULL ORDER BY created",
+                    (hip,)).fetchall()
+                for i in range(0, len(stems), self.MAX_PARAMS):
+                    batch = stems[i:i + self.MAX_PARAMS]
+                    rows += conn.execute(
+                        "SELECT stem, NULL, width, height FROM sequences "
+                        "WHERE width IS NOT NULL AND stem IN ({0})".format(
+                            ", ".join("?" * len(batch))),
+                        batch).fetchall()
+        except sqlite3.Error:
+            return by_stem, by_name
+        for stem, name, width, height in rows:
+            by_stem[stem] = width * height
+            if name is not None:
+                by_name[name] = width * height
+        return by_stem, by_name
+
+    def remove(self, dirname):
+        """Forget every sequence in a sub-version, and its thumbnails.
+
+        :param dirname: Sub-version directory that was removed
+        :type dirname: str
+        """
+        try:
+            with self._connect() as conn:
+                rows = conn.execute(
+                    "SELECT thumbnail FROM sequences WHERE dirname = ?",
+                    (dirname,)).fetchall()
+                conn.execute(
+                    "DELETE FROM sequences WHERE dirname = ?", (dirname,))
+        except sqlite3.Error:
+            return
+        for (thumbnail,) in rows:
+            if not thumbnail:
+                continue
+            try:
+                os.remove(thumbnail)
+            except OSError:
+                pass
+
+    def scan(self, root, env):
+        """Add every sequence already saved under a flipbook directory.
+
+        For flipbooks saved before the catalog existed. Each sub-version
+        directory is listed once.
+
+        :param root: Flipbook directory, or one sub-version directory
+        :type root: str
+        :param env: Environment settings the flipbooks were saved with
+        :type env: :class:`Environment`
+        :return: Number of sequences added
+        :rtype: int
+        """
+        regex = SubVersionIndex._entry_regex
+        root = os.path.normpath(root)
+        dirnames = [
+            os.path.join(root, name)
+            for name in sorted(_list_subdirs(root, regex))
+        ]
+        if not dirnames and regex.match(os.path.basename(root)):
+            dirnames = [root]
+        count = 0
+        for dirname in dirnames:
+            seq_dir = SequenceDir.from_path(dirname, env)
+            try:
+                names = os.listdir(dirname)
+                created = os.path.getmtime(dirname)
+            except OSError:
+                continue
+            stem_regex = re.compile(r"^({0}_\d+)[._]".format(
+                re.escape(os.path.basename(dirname))))
+            stems = set()
+            for name in names:
+                match = stem_regex.match(name)
+                if match:
+                    stems.add(match.group(1))
+            for stem in sorted(stems):
+                self.add({
+                    "dirname": seq_dir.dirname,
+                    "stem": stem,
+                    "hip": seq_dir.name,
+                    "sub_version": seq_dir.sub_version,
+                    "fps": env.fps,
+                    "created": created,
+                }, names)
+                count += 1
+        return count
+
+    def _make_thumbnail(self, source, key, seek=0.0):
+        """Write a small JPEG of one frame to the thumbnail cache.
+
+        :return: Path to the thumbnail and the source's resolution, or
+            None for both if ffmpeg isn't available or failed
+        :rtype: tuple
+        """
+        if not ffmpeg_capabilities().path:
+            return None, None
+        dir_ = os.path.join(cache_dir(), self.THUMBNAIL_DIR)
+        try:
+            os.makedirs(dir_)
+        except OSError as error:
+            if error.errno != errno.EEXIST:
+                return None, None
+        path = os.path.join(dir_, "{0}.jpg".format(
+            hashlib.sha1(key.encode("utf-8")).hexdigest()[:20]))
+        cmd = _ffmpeg_base_cmd()
+        # Stream info is only logged at the default level
+        cmd[cmd.index("-loglevel") + 1] = "info"
+        if seek:
+            cmd += ["-ss", "{0:.3f}".format(seek)]
+        cmd += [
+            "-i", source,
+            "-vf", "scale={0}:-2".format(self.THUMBNAIL_WIDTH),
+            "-frames:v", "1", "-y", path
+        ]
+        try:
+            process = subprocess.Popen(
+                cmd,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                **Environment.subprocess_kwargs()
+            )
+            _, err = process.communicate()
+        except OSError:
+            return None, None
+        if process.returncode:
+            return None, None
+        match = re.search(
+            r"Stream #0:0.*?Video: .*?(\d{2,})x(\d{2,})",
+            err.decode("utf-8", "replace"))
+        size = (int(match.group(1)), int(match.group(2))) if match else None
+        return path.replace(os.sep, "/"), size
+
+
+def browse_flipbooks():
+    """Search the :class:`FlipbookCatalog` and open a flipbook's folder.
+
+    Only the catalog is read, so this stays quick however many
+    sub-versions the flipbook directory holds.
+    """
+    try:
+        button, text = hou.ui.readInput(
+            "Search flipbooks (empty for the newest)",
+            buttons=("Search", "Cancel"),
+            default_choice=0,
+            close_choice=1,
+            title="MPlay Batch"
+        )
+    except AttributeError:
+        button, text = 0, ""
+    if button:
+        return
+    rows = FlipbookCatalog().search(text)
+    if not rows:
+        _show_message("No flipbooks found")
+        return
+    labels = [_format_catalog_row(row) for row in rows]
+    try:
+        chosen = hou.ui.selectFromList(
+            labels,
+            exclusive=True,
+            title="MPlay Batch",
+            column_header="Flipbooks"
+        )
+    except AttributeError:
+        print("\n".join(labels))
+        return
+    if chosen:
+        _open_path(rows[chosen[0]]["dirname"])
+
+
+def _format_catalog_row(row):
+    """One line describing a :class:`FlipbookCatalog` row."""
+    resolution = ""
+    if row["width"]:
+        resolution = "{0}x{1}".format(row["width"], row["height"])
+    return "{0}  {1}  {2}-{3}  {4}  {5}{6}".format(
+        time.strftime("%Y-%m-%d %H:%M", time.localtime(row["created"])),
+        row["stem"],
+        row["first_frame"],
+        row["last_frame"],
+        resolution,
+        _format_size(row["bytes"] or 0),
+        "  ({0})".format(row["name"]) if row["name"] else ""
+    )
@@ -0,0 +1,441 @@
+"""MPlay Batch command line
+
+Encodes, catalogs, prunes and resumes flipbooks outside of MPlay, and
+runs the encode daemon. Run ``python mplay_batch_cli.py --help``.
+"""
+import argparse
+import errno
+import hashlib
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+from mplay_batch import (
+    BatchJournal,
+    Environment,
+    FFmpegFailedError,
+    GifBudget,
+    MPlaySession,
+    SequenceWriter,
+    SequenceWriterJob,
+    SubVersionIndex,
+    _expand_string,
+    _format_size,
+    _replace,
+    find_sequences,
+    hou
+)
+from mplay_batch_catalog import FlipbookCatalog, _format_catalog_row
+from mplay_batch_daemon import EncodeDaemon
+from mplay_batch_retention import RetentionPolicy, prune_flipbook_dir
+
+
+class ClaimDir(object):
+    """Lock files that let several machines share out a batch of work.
+
+    Work is claimed by creating its lock file exclusively, so all the
+    machines need is a directory they can all write to, not a central
+    service. Held claims are kept fresh by :meth:`refresh`, and a claim
+    nobody has refreshed for ``stale_after`` seconds is taken over, so
+    a crashed machine's work still gets done. Finished work leaves a
+    ``.done`` file, so machines that start later skip it.
+
+    The machines' clocks are assumed to be roughly in sync.
+
+    :param path: Shared directory to keep the claims in
+    :type path: str
+    :param stale_after: Seconds before an unrefreshed claim is taken over
+    :type stale_after: float
+    """
+
+    STALE_AFTER = 600
+
+    def __init__(self, path, stale_after=STALE_AFTER):
+        self.path = path
+        self.stale_after = stale_after
+        self._held = {}
+        self._mutex = threading.Lock()
+        try:
+            os.makedirs(path)
+        except OSError as error:
+            if error.errno != errno.EEXIST:
+                raise
+
+    def claim(self, key):
+        """Try to claim a piece of work.
+
+        :param key: Name of the work, the same on every machine
+        :type key: str
+        :return: Whether this process now holds the claim
+        :rtype: bool
+        """
+        lock, done = self._path(key, "lock"), self._path(key, "done")
+        while True:
+            if os.path.exists(done):
+                return False
+            try:
+                handle = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                break
+            except OSError as error:
+                if error.errno != errno.EEXIST:
+                    raise
+            if not self._take_over(lock):
+                return False
+        with os.fdopen(handle, "w") as file_:
+            json.dump({
+                "host": socket.gethostname(),
+                "pid": os.getpid(),
+                "time": time.time()
+            }, file_)
+        if os.path.exists(done):
+            # Finished elsewhere between the first check and the claim
+            self.release(key)
+            return False
+        with self._mutex:
+            self._held[key] = time.time()
+        return True
+
+    def refresh(self):
+        """Touch held claims so other machines don't take them over.
+
+        Cheap enough to call often. Each claim is only touched a few
+        times per ``stale_after``.
+        """
+        now = time.time()
+        with self._mutex:
+            keys = [
+                key for key, touched in self._held.items()
+                if now - touched > self.stale_after / 4.0
+            ]
+            for key in keys:
+                self._held[key] = now
+        for key in keys:
+            try:
+                os.utime(self._path(key, "lock"), None)
+            except OSError:
+                continue
+
+    def finish(self, key):
+        """Mark claimed work as done, so no machine does it again."""
+        with self._mutex:
+            self._held.pop(key, None)
+        _replace(self._path(key, "lock"), self._path(key, "done"))
+
+    def release(self, key):
+        """Give up a claim, leaving the work for any machine to retry."""
+        with self._mutex:
+            self._held.pop(key, None)
+        try:
+            os.remove(self._path(key, "lock"))
+        except OSError:
+            pass
+
+    def _take_over(self, lock):
+        """Remove a stale lock file, if it is stale.
+
+        :return: Whether claiming should be tried again
+        :rtype: bool
+        """
+        try:
+            age = time.time() - os.path.getmtime(lock)
+        except OSError:
+            return True  # Released since
+        if age < self.stale_after:
+            return False
+        # Only one machine can move the stale lock out of the way
+        stale = "{0}.{1}_{2}.stale".format(
+            lock, os.getpid(), threading.current_thread().ident)
+        try:
+            os.rename(lock, stale)
+        except OSError:
+            return False
+        try:
+            os.remove(stale)
+        except OSError:
+            pass
+        return True
+
+    def _path(self, key, kind):
+        return os.path.join(self.path, "{0}.{1}".format(key, kind))
+
+
+def _environment(flipbook_dir, fps=24.0):
+    """Settings for a command, outside of MPlay.
+
+    A flipbook directory given on the command line takes precedence
+    over MPLAY_BATCH_FLIPBOOK_DIR, so it's set once that has been read.
+
+    :param flipbook_dir: Flipbook directory the command works in
+    :type flipbook_dir: str
+    :param fps: Frame rate to encode at
+    :type fps: float
+    :rtype: :class:`mplay_batch.Environment`
+    """
+    env = Environment()
+    env.flipbook_dir = flipbook_dir
+    env.session = MPlaySession(frange=(1, 1), seqls=[], fps=fps)
+    return env
+
+
+def main(argv):
+    """Command-line entry point, for running outside of MPlay.
+
+    :param argv: Command-line arguments, without the program name
+    :type argv: list of str
+    :return: Exit code
+    :rtype: int
+    """
+    parser = argparse.ArgumentParser(prog="mplay_batch")
+    commands = parser.add_subparsers(dest="command")
+    daemon = commands.add_parser(
+        "daemon", help="Run queued encodes in the background")
+    daemon.add_argument("--spool", help="Spool directory to serve")
+    daemon.add_argument("--workers", type=int, default=1)
+    daemon.add_argument(
+        "--idle-timeout", type=float, default=EncodeDaemon.IDLE_TIMEOUT)
+    commands.add_parser("status", help="Show the encode daemon's queue")
+    encode = commands.add_parser(
+        "encode", help="Encode image sequences that are already on disk")
+    encode.add_argument(
+        "paths", nargs="*",
+        help="Flipbook or sub-version directories to search. Defaults to "
+             "MPLAY_BATCH_FLIPBOOK_DIR")
+    encode.add_argument("--video", action="store_true")
+    encode.add_argument("--gif", action="store_true")
+    encode.add_argument("--fps", type=float, default=24.0)
+    encode.add_argument("--format", help="Overrides MPLAY_BATCH_VIDEO_FORMAT")
+    encode.add_argument(
+        "--profile", help="Overrides MPLAY_BATCH_ENCODE_PROFILE")
+    encode.add_argument("--proxies", help="Overrides MPLAY_BATCH_PROXIES")
+    encode.add_argument(
+        "--gif-max-size", type=float, metavar="MB",
+        help="Overrides MPLAY_BATCH_GIF_MAX_SIZE_MB")
+    encode.add_argument(
+        "--gif-max-seconds", type=float,
+        help="Overrides MPLAY_BATCH_GIF_MAX_SECONDS")
+    encode.add_argument(
+        "--workers", type=int, default=0,
+        help="Encodes to run at once. Defaults to MPLAY_BATCH_MAX_ENCODERS")
+    encode.add_argument(
+        "--claims",
+        help="Directory for machines to split the work through. Defaults "
+             "to one per batch in the first path's .mplay_batch directory")
+    encode.add_argument(
+        "--batch",
+        help="Name machines share to work on the same batch. Defaults to "
+             "one based on the encode settings")
+    encode.add_argument(
+        "--stale-after", type=float, default=ClaimDir.STALE_AFTER,
+        help="Seconds before another machine's claim is taken over")
+    catalog = commands.add_parser(
+        "catalog", help="Search the catalog of saved flipbooks")
+    catalog.add_argument(
+        "text", nargs="*", help="Words the flipbook's name or path has")
+    catalog.add_argument("--limit", type=int, default=50)
+    catalog.add_argument(
+        "--json", action="store_true", help="Print every field as JSON")
+    catalog.add_argument(
+        "--scan", metavar="PATH", action="append", default=[],
+        help="Add flipbooks already saved under a flipbook or sub-version "
+             "directory first. Can be given more than once")
+    resume = commands.add_parser(
+        "resume", help="Finish batches that were cut short")
+    resume.add_argument(
+        "paths", nargs="*",
+        help="Sub-version directories of the batches. Defaults to every "
+             "unfinished batch")
+    prune = commands.add_parser(
+        "prune", help="Remove old sub-versions from a flipbook directory")
+    prune.add_argument(
+        "path", nargs="?",
+        help="Flipbook directory. Defaults to MPLAY_BATCH_FLIPBOOK_DIR")
+    prune.add_argument(
+        "--dry-run", action="store_true",
+        help="Only report what would be removed and how much it frees")
+    prune.add_argument(
+        "--keep", type=int, help="Overrides MPLAY_BATCH_KEEP_SUB_VERSIONS")
+    prune.add_argument(
+        "--max-age", type=float, help="Overrides MPLAY_BATCH_MAX_AGE_DAYS")
+    prune.add_argument(
+        "--max-size", type=float, help="Overrides MPLAY_BATCH_MAX_SIZE_GB")
+    prune.add_argument(
+        "--workers", type=int, help="Directories to measure at once")
+    args = parser.parse_args(argv)
+
+    if args.command == "daemon":
+        EncodeDaemon(args.spool).serve(args.workers, args.idle_timeout)
+    elif args.command == "status":
+        print(EncodeDaemon().status_message())
+    elif args.command == "encode":
+        if not (args.video or args.gif):
+            parser.error("encode needs --video, --gif or both")
+        return _encode(args)
+    elif args.command == "catalog":
+        _catalog(args)
+    elif args.command == "prune":
+        return _prune(args)
+    elif args.command == "resume":
+        return _resume(args)
+    else:
+        parser.print_help()
+        return 1
+    return 0
+
+
+def _encode(args):
+    """Run the ``encode`` command. See :func:`main`."""
+    paths = args.paths or [os.environ.get("MPLAY_BATCH_FLIPBOOK_DIR", "")]
+    if not paths[0]:
+        print("No paths given and MPLAY_BATCH_FLIPBOOK_DIR isn't set")
+        return 1
+    env = _environment(paths[0], args.fps)
+    if args.format:
+        env.video_format = args.format
+    if args.profile:
+        env.encode_profile = args.profile
+    if args.proxies is not None:
+        env.proxies = args.proxies
+    if args.gif_max_size is not None:
+        env.gif_max_size_mb = args.gif_max_size
+    if args.gif_max_seconds is not None:
+        env.gif_max_seconds = args.gif_max_seconds
+    writer = SequenceWriter(
+        env, video=args.video, gif=args.gif, keep_video_source=True)
+    for path in paths:
+        for seq in find_sequences(_expand_string(path), env):
+            writer.queue.append(SequenceWriterJob(seq))
+
+    batch = args.batch
+    if not batch:
+        settings = {
+            "video": args.video and {
+                "format": env.video_format,
+                "encode": env.encode_profile.ffmpeg_args(),
+                "proxies": [proxy.scale_filter() for proxy in writer.proxies]
+            },
+            "gif": args.gif,
+            "fps": args.fps
+        }
+        budget = GifBudget.from_env(env)
+        if args.gif and budget.enabled:
+            settings["gif"] = budget.to_dict()
+        batch = hashlib.sha1(json.dumps(settings, sort_keys=True).encode(
+            "utf-8")).hexdigest()[:12]
+    claims_dir = args.claims or os.path.join(
+        _expand_string(paths[0]), SubVersionIndex.META_DIR, "encode_claims")
+    claims = ClaimDir(os.path.join(claims_dir, batch), args.stale_after)
+
+    print("MPlay Batch: {0} sequence(s) found, batch {1}".format(
+        len(writer.queue), batch))
+    try:
+        encoded = writer.encode_existing(claims, args.workers)
+    except FFmpegFailedError as err:
+        print(err)
+        return 1
+    print("MPlay Batch: encoded {0} sequence(s) here".format(len(encoded)))
+    return 0
+
+
+def _catalog(args):
+    """Run the ``catalog`` command. See :func:`main`."""
+    catalog = FlipbookCatalog()
+    if args.scan:
+        env = _environment(args.scan[0])
+        for path in args.scan:
+            print("MPlay Batch: cataloged {0} sequence(s) in {1}".format(
+                catalog.scan(_expand_string(path), env), path))
+    rows = catalog.search(" ".join(args.text), args.limit)
+    if args.json:
+        print(json.dumps(rows, indent=4, sort_keys=True))
+        return
+    for row in rows:
+        print(_format_catalog_row(row))
+        if row["thumbnail"]:
+            print("    {0}".format(row["thumbnail"]))
+
+
+def _resume(args):
+    """Run the ``resume`` command. See :func:`main`.
+
+    Outside MPlay, only jobs whose images are still on disk can be
+    finished.
+    """
+    dirnames = [_expand_string(path) for path in args.paths]
+    dirnames = dirnames or BatchJournal.unfinished()
+    if not dirnames:
+        print("MPlay Batch: no unfinished batches to resume")
+    code = 0
+    for dirname in dirnames:
+        dirname = os.path.normpath(dirname).replace(os.sep, "/")
+        env = _environment(os.path.dirname(dirname))
+        try:
+            writer = SequenceWriter.from_journal(dirname, env)
+        except ValueError as err:
+            print(err)
+            code = 1
+            continue
+        if hou is None:
+            queue = []
+            for job in writer.queue:
+                if writer.restorable(job):
+                    queue.append(job)
+                    continue
+                print("MPlay Batch: {0} needs MPlay, as its images "
+                      "aren't on disk".format(job.seq.stem))
+                code = 1
+            writer.queue = queue
+        try:
+            writer.execute()
+        except FFmpegFailedError as err:
+            print(err)
+            code = 1
+    return code
+
+
+def _prune(args):
+    """Run the ``prune`` command. See :func:`main`."""
+    path = args.path or os.environ.get("MPLAY_BATCH_FLIPBOOK_DIR", "")
+    if not path:
+        print("No path given and MPLAY_BATCH_FLIPBOOK_DIR isn't set")
+        return 1
+    env = _environment(path)
+    for attr, value in (
+            ("keep_sub_versions", args.keep),
+            ("max_age_days", args.max_age),
+            ("max_size_gb", args.max_size)
+    ):
+        if value is not None:
+            setattr(env, attr, value)
+    policy = RetentionPolicy.from_env(env)
+    if not policy.enabled:
+        print("No retention rules set, so there is nothing to prune")
+        return 0
+    flipbook_dir = _expand_string(path)
+    report = prune_flipbook_dir(
+        flipbook_dir, policy, dry_run=args.dry_run, workers=args.workers)
+    if report["skipped"]:
+        print("MPlay Batch: {0} is already being pruned".format(
+            flipbook_dir))
+        return 0
+    for result in report["pruned"]:
+        print("{0} {1} ({2}, {3})".format(
+            "Would remove" if args.dry_run else (
+                "Removed" if result["removed"] else "Couldn't remove"),
+            result["dirname"],
+            _format_size(result["bytes"]),
+            result["reason"]
+        ))
+    print("MPlay Batch: {0} {1} of {2} in {3}".format(
+        "would free" if args.dry_run else "freed",
+        _format_size(report["freed"]),
+        _format_size(report["total"]),
+        flipbook_dir
+    ))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,270 @@
+"""MPlay Batch encode daemon
+
+Runs encodes in a detached process after MPlay has written the images.
+Only imported by saves that use MPLAY_BATCH_ENCODE_DAEMON, and by the
+daemon itself.
+"""
+import errno
+import json
+import os
+import threading
+import time
+
+from mplay_batch import (
+    EncodeTask,
+    EncoderPool,
+    FileLock,
+    _atomic_write_json,
+    _cli_source,
+    _format_eta,
+    _over_gif_budget,
+    _python_executable,
+    _spawn_detached,
+    cache_dir
+)
+
+
+class EncodeDaemon(object):
+    """Local background service that runs encodes after MPlay is done.
+
+    Jobs are JSON files in a spool directory under :func:`cache_dir`.
+    They move from ``queue`` to ``running`` and then to ``done`` or
+    ``failed``. The daemon is a separate, detached Python process. Only
+    one runs at a time, guarded by a lock file. It exits once it has
+    been idle for a while and is started again on the next submission.
+    """
+
+    IDLE_TIMEOUT = 300
+    POLL_INTERVAL = 1.0
+    # Finished jobs older than this are cleared out when the daemon starts
+    KEEP_FINISHED = 7 * 24 * 60 * 60
+
+    STATES = ("queue", "running", "done", "failed")
+
+    def __init__(self, spool_dir=None):
+        self.spool_dir = spool_dir or os.path.join(cache_dir(), "spool")
+        self.lock_path = os.path.join(self.spool_dir, "daemon.lock")
+        self.log_path = os.path.join(self.spool_dir, "daemon.log")
+        for state in self.STATES:
+            try:
+                os.makedirs(self._state_dir(state))
+            except OSError as error:
+                if error.errno != errno.EEXIST:
+                    raise
+        self._active = 0
+        self._mutex = threading.Lock()
+
+    def _state_dir(self, state):
+        return os.path.join(self.spool_dir, state)
+
+    def _jobs(self, state):
+        """Job files in a state, oldest first."""
+        return sorted(
+            name for name in os.listdir(self._state_dir(state))
+            if name.endswith(".json")
+        )
+
+    def submit(self, task):
+        """Add an encode to the queue.
+
+        :param task: Encode to run
+        :type task: :class:`EncodeTask`
+        :return: Job ID
+        :rtype: str
+        """
+        job_id = "{0:.6f}_{1}_{2}".format(
+            time.time(), os.getpid(), threading.current_thread().ident)
+        data = {"id": job_id, "task": task.to_dict(), "submitted": time.time()}
+        path = os.path.join(self._state_dir("queue"), job_id + ".json")
+        _atomic_write_json(path, data)
+        return job_id
+
+    def is_running(self):
+        """Whether a daemon currently holds the spool's lock."""
+        lock = FileLock(self.lock_path)
+        if lock.acquire(blocking=False):
+            lock.release()
+            return False
+        return True
+
+    def start(self, workers=1):
+        """Launch a detached daemon, unless one is already running.
+
+        :param workers: Number of encodes the daemon runs at once
+        :type workers: int
+        """
+        if self.is_running():
+            return
+        _spawn_detached([
+            _python_executable(),
+            _cli_source(),
+            "daemon",
+            "--spool", self.spool_dir,
+            "--workers", str(workers)
+        ], self.log_path)
+
+    def serve(self, workers=1, idle_timeout=None):
+        """Run queued jobs until idle. Called in the daemon process.
+
+        :param workers: Number of encodes to run at once
+        :type workers: int
+        :param idle_timeout: Seconds to wait for new jobs before exiting
+        :type idle_timeout: float
+        :return: False if another daemon is already running
+        :rtype: bool
+        """
+        if idle_timeout is None:
+            idle_timeout = self.IDLE_TIMEOUT
+        while True:
+            lock = FileLock(self.lock_path)
+            if not lock.acquire(blocking=False):
+                return False
+            try:
+                self._recover()
+                self._prune()
+                self._serve_locked(workers, idle_timeout)
+            finally:
+                lock.release()
+            # A job may have been queued after the last check but while
+            # the lock was still held, so its submitter didn't start a
+            # new daemon.
+            if not self._jobs("queue"):
+                return True
+
+    def _serve_locked(self, workers, idle_timeout):
+        pool = EncoderPool(workers)
+        idle_since = time.time()
+        try:
+            while True:
+                with self._mutex:
+                    free = workers - self._active
+                for name in self._jobs("queue")[:max(0, free)]:
+                    running = os.path.join(self._state_dir("running"), name)
+                    os.rename(
+                        os.path.join(self._state_dir("queue"), name), running)
+                    with self._mutex:
+                        self._active += 1
+                    pool.submit(self._run_job, running)
+                with self._mutex:
+                    busy = self._active
+                if busy:
+                    idle_since = time.time()
+                elif time.time() - idle_since > idle_timeout:
+                    return
+                time.sleep(self.POLL_INTERVAL)
+        finally:
+            pool.join()
+
+    def _run_job(self, path):
+        state = "done"
+        try:
+            with open(path) as file_:
+                data = json.load(file_)
+            task = EncodeTask.from_dict(data["task"])
+            data["started"] = time.time()
+            last_write = [0.0]
+
+            def on_progress(job, done, total, fps):
+                # Only for status reports, so don't rewrite it too often
+                if time.time() - last_write[0] < 1.0:
+                    return
+                last_write[0] = time.time()
+                data["progress"] = {"done": done, "total": total, "fps": fps}
+                _atomic_write_json(path, data)
+
+            try:
+                task.run(on_progress=on_progress)
+            except Exception as err:
+                state = "failed"
+                data["error"] = str(err)
+            task.release_stage_dir(failed=state == "failed")
+            data["over_gif_budget"] = _over_gif_budget(task.records)
+            data["finished"] = time.time()
+            _atomic_write_json(
+                os.path.join(self._state_dir(state), os.path.basename(path)),
+                data
+            )
+            os.remove(path)
+        except Exception as err:
+            # Never let a bad job file take the daemon down. Failing it
+            # puts the error in the status report instead
+            self._fail_job(path, err)
+        finally:
+            with self._mutex:
+                self._active -= 1
+
+    def _fail_job(self, path, err):
+        """Move a job the daemon couldn't run to ``failed``."""
+        name = os.path.basename(path)
+        try:
+            _atomic_write_json(os.path.join(self._state_dir("failed"), name), {
+                "id": os.path.splitext(name)[0],
+                "error": "{0}: {1}".format(name, err),
+                "finished": time.time()
+            })
+            os.remove(path)
+        except (IOError, OSError):
+            pass
+
+    def _recover(self):
+        """Requeue jobs that a previous daemon didn't get to finish."""
+        for name in self._jobs("running"):
+            os.rename(
+                os.path.join(self._state_dir("running"), name),
+                os.path.join(self._state_dir("queue"), name)
+            )
+
+    def _prune(self):
+        cutoff = time.time() - self.KEEP_FINISHED
+        for state in ("done", "failed"):
+            for name in self._jobs(state):
+                path = os.path.join(self._state_dir(state), name)
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                except OSError:
+                    continue
+
+    def status(self):
+        """Jobs in each state, for reporting back to the artist.
+
+        :return: Job data for each state, oldest first
+        :rtype: dict
+        """
+        status = {}
+        for state in self.STATES:
+            status[state] = []
+            for name in self._jobs(state):
+                try:
+                    with open(os.path.join(self._state_dir(state), name)) as f:
+                        status[state].append(json.load(f))
+                except (IOError, OSError, ValueError):
+                    continue  # Moved on to the next state while listing
+        return status
+
+    def status_message(self):
+        """Human-readable summary of :meth:`status`."""
+        status = self.status()
+        lines = ["Encode daemon is {0}".format(
+            "running" if self.is_running() else "not running")]
+        for state in self.STATES:
+            lines.append("{0}: {1}".format(state, len(status[state])))
+        for data in status["running"]:
+            progress = data.get("progress")
+            if progress:
+                lines.append("  {0} {1}/{2} ({3:.0f} fps, ETA {4})".format(
+                    data["task"]["job"],
+                    progress["done"],
+                    progress["total"],
+                    progress["fps"],
+                    _format_eta(
+                        progress["total"] - progress["done"], progress["fps"])
+                ))
+        over = [data["task"]["job"] for data in status["done"]
+                if data.get("over_gif_budget")]
+        if over:
+            lines.append("May not fit their GIF budget: {0}".format(
+                ", ".join(over)))
+        for data in status["failed"]:
+            lines.append("\n{0}".format(data.get("error", data["id"])))
+        return "\n".join(lines)
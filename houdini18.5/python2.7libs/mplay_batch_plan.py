@@ -0,0 +1,332 @@
+"""MPlay Batch save planner
+
+Predicts how much disk space and time a save will take before it runs.
+"""
+import json
+import os
+
+from mplay_batch import (
+    STAGING_DEFAULT_FRAME_BYTES,
+    _format_duration,
+    _format_size,
+    free_disk_space,
+    throughput_history_path
+)
+from mplay_batch_catalog import FlipbookCatalog
+
+
+class BatchPlan(object):
+    """Predicted disk usage and time of a :class:`SequenceWriter`'s queue.
+
+    Nothing is written. Each job's frame count comes from the MPlay
+    session, and its resolution from the newest save of the same
+    sequence name from the same hip file in the :class:`FlipbookCatalog`.
+    Rates come from the end of the throughput history: imgsave stages,
+    and the encodes of past jobs that wrote the same kinds of output.
+    Where a past job and the planned one both have a resolution, rates
+    are scaled by pixels per frame, otherwise they are per frame.
+
+    :param writer: Writer with its queue built, usually a
+        :attr:`SequenceWriter.dry_run` one
+    :type writer: :class:`SequenceWriter`
+    :param history: Stage records to learn from. Defaults to the end of
+        the file at :func:`throughput_history_path`
+    :type history: list of dict
+    """
+
+    # Most of the throughput history to read, from its end
+    HISTORY_BYTES = 1024 * 1024
+
+    def __init__(self, writer, history=None):
+        self.writer = writer
+        env = writer.env
+        if history is None:
+            history = self.read_history(throughput_history_path())
+        by_stem, by_name = {}, {}
+        if env.catalog:
+            by_stem, by_name = FlipbookCatalog().resolutions(
+                writer.location.name,
+                set(record.get("job") for record in history) - set([None]))
+        imgsave, encodes = self._samples(history, by_stem)
+        video_profile = env.encode_profile.name if writer.video else None
+        matching = [
+            sample for sample in encodes if sample[3] == video_profile]
+        encodes = matching or encodes
+        encodes = encodes if (writer.video or writer.gif) else None
+        self.jobs = [
+            self._estimate(job, by_name.get(job.seq_name), imgsave, encodes)
+            for job in writer.queue
+        ]
+        self.known = all(job["seconds"] is not None for job in self.jobs)
+        self._schedule()
+        self.warnings = []
+        self._check_space()
+        self._check_size()
+        self._check_time()
+
+    @classmethod
+    def read_history(cls, path):
+        """Read the last :attr:`HISTORY_BYTES` of a stage history file.
+
+        :return: Stage records, oldest first
+        :rtype: list of dict
+        """
+        try:
+            with open(path, "rb") as file_:
+                file_.seek(0, os.SEEK_END)
+                start = max(0, file_.tell() - cls.HISTORY_BYTES)
+                file_.seek(start)
+                lines = file_.read().decode("utf-8", "replace").splitlines()
+        except (IOError, OSError):
+            return []
+        if start:
+            lines = lines[1:]  # Probably cut short
+        records = []
+        for line in lines:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+        return records
+
+    def _samples(self, history, by_stem):
+        """Per-frame rates of the past jobs in a stage history.
+
+        Encode stages are summed per job, and a job's stages show what
+        it wrote. Stage names repeat when a job is encoded again, which
+        starts a new sample.
+
+        :return: Seconds, bytes and pixels per frame of each imgsave,
+            and the same plus the video profile of each job's encode
+            that wrote the same outputs as the writer
+        :rtype: tuple of list
+        """
+        imgsave = []
+        jobs = []
+        current = {}
+        for record in history:
+            frames = record.get("frames")
+            if not (record.get("ok") and frames and record.get("seconds")):
+                continue
+            stem = record.get("job")
+            pixels = by_stem.get(stem)
+            if record.get("stage") == "imgsave":
+                imgsave.append((
+                    record["seconds"] / frames,
+                    (record.get("bytes") or 0) / float(frames),
+                    pixels
+                ))
+                continue
+            job = current.get(stem)
+            if job is None or record["stage"] in job["stages"]:
+                job = current[stem] = {
+                    "stages": set(), "seconds": 0.0, "bytes": 0, "frames": 0,
+                    "profile": None, "pixels": pixels
+                }
+                jobs.append(job)
+            job["stages"].add(record["stage"])
+            job["seconds"] += record["seconds"]
+            # Joining chunks copies the video the chunks already counted
+            if record["stage"] != "join":
+                job["bytes"] += record.get("bytes") or 0
+            job["frames"] = max(job["frames"], frames)
+            job["profile"] = record.get("profile") or job["profile"]
+
+        writes = (bool(self.writer.video), bool(self.writer.gif))
+        encodes = []
+        for job in jobs:
+            video = any("video" in stage for stage in job["stages"])
+            gif = any(
+                "gif" in stage or "palette" in stage
+                for stage in job["stages"])
+            if (video, gif) != writes:
+                continue
+            encodes.append((
+                job["seconds"] / job["frames"],
+                job["bytes"] / float(job["frames"]),
+                job["pixels"],
+                job["profile"] if video else None
+            ))
+        return imgsave, encodes
+
+    @staticmethod
+    def _rate(samples, field, pixels):
+        """Median rate of one field of ``samples``, for ``pixels``.
+
+        :return: The rate, or None without any samples
+        :rtype: float
+        """
+        if not samples:
+            return None
+        scaled = [sample[field] / sample[2] for sample in samples
+                  if sample[2]]
+        if pixels and scaled:
+            return _median(scaled) * pixels
+        return _median([sample[field] for sample in samples])
+
+    def _estimate(self, job, pixels, imgsave, encodes):
+        """Bytes and seconds one job should take.
+
+        :param encodes: Samples of past encodes, or None when the writer
+            doesn't encode
+        :type encodes: list of tuple
+        :rtype: dict
+        """
+        writer = self.writer
+        frames = job.seq.frange[1] - job.seq.frange[0] + 1
+        frame_bytes = self._rate(imgsave, 1, pixels)
+        if not frame_bytes:
+            frame_bytes = STAGING_DEFAULT_FRAME_BYTES
+        imgsave_seconds = self._rate(imgsave, 0, pixels)
+        encode_seconds = output_bytes = 0.0
+        if encodes is not None:
+            encode_seconds = self._rate(encodes, 0, pixels)
+            output_bytes = (self._rate(encodes, 1, pixels) or 0) * frames
+        keeps_frames = writer._keeps_frames()
+        kept = output_bytes + (frame_bytes * frames if keeps_frames else 0)
+        return {
+            "stem": job.seq.stem,
+            "name": job.seq_name,
+            "frames": frames,
+            "pixels": pixels,
+            "frame_bytes": frame_bytes * frames,
+            "output_bytes": output_bytes,
+            "bytes": kept,
+            "keeps_frames": keeps_frames,
+            "staged": not keeps_frames and writer._should_stage(job),
+            "imgsave_seconds": (
+                None if imgsave_seconds is None
+                else imgsave_seconds * frames),
+            "encode_seconds": (
+                None if encode_seconds is None
+                else encode_seconds * frames),
+            "seconds": (
+                None if imgsave_seconds is None or encode_seconds is None
+                else (imgsave_seconds + encode_seconds) * frames)
+        }
+
+    def _schedule(self):
+        """Work out when each job should finish, the way it will run.
+
+        MPlay writes the images one job after another. Encodes then run
+        straight after in MPlay's thread, or on as many encoders at once
+        as :meth:`SequenceWriter.execute` would start.
+        """
+        env = self.writer.env
+        encoding = self.writer.video or self.writer.gif
+        if env.encode_daemon and encoding:
+            workers = env.max_encoders
+        elif env.pipeline and encoding:
+            workers = min(env.max_encoders, max(1, len(self.jobs)))
+        else:
+            workers = 0
+        self.mplay_seconds = self.seconds = None
+        if not self.known:
+            return
+        written = 0.0
+        encoders = [0.0] * workers
+        for job in self.jobs:
+            written += job["imgsave_seconds"]
+            if not workers:
+                written += job["encode_seconds"]
+                job["finish"] = written
+                continue
+            start = max(written, min(encoders))
+            job["finish"] = start + job["encode_seconds"]
+            encoders[encoders.index(min(encoders))] = job["finish"]
+        self.mplay_seconds = written
+        if workers and not env.encode_daemon:
+            # MPlay waits for the encodes to finish
+            self.mplay_seconds = max([written] + encoders)
+        self.seconds = max(
+            [written] + [job["finish"] for job in self.jobs])
+
+    def _check_space(self):
+        """Warn about the first job that would fill the flipbook volume.
+
+        Kept frames and outputs add up over the batch. Frames that are
+        deleted once encoded only count while their job is encoding,
+        and not at all when they're staged on another volume.
+        """
+        dirname = self.writer.env.flipbook_dir
+        while dirname and not os.path.isdir(dirname):
+            parent = os.path.dirname(dirname)
+            if parent == dirname:
+                break
+            dirname = parent
+        free = free_disk_space(dirname) if dirname else None
+        self.free_bytes = free
+        self.bytes = sum(job["bytes"] for job in self.jobs)
+        kept = 0
+        for job in self.jobs:
+            kept += job["bytes"]
+            transient = 0
+            if not (job["keeps_frames"] or job["staged"]):
+                transient = job["frame_bytes"]
+            if free is not None and kept + transient > free:
+                self.warnings.append(
+                    "Saving {0} onward would fill {1}: about {2} needed, "
+                    "{3} free".format(
+                        job["name"] or job["stem"], dirname,
+                        _format_size(kept + transient), _format_size(free)))
+                break
+
+    def _check_size(self):
+        """Warn if the batch alone is over the flipbook directory's size.
+
+        Pruning would remove the batch again as soon as it ran.
+        """
+        budget = self.writer.env.max_size_gb * 1024 ** 3
+        if budget and self.known and self.bytes > budget:
+            self.warnings.append(
+                "The batch would keep about {0}, more than the {1} the "
+                "flipbook directory is pruned down to".format(
+                    _format_size(self.bytes), _format_size(budget)))
+
+    def _check_time(self):
+        """Warn about the first job that would finish past the budget."""
+        budget = self.writer.env.max_batch_minutes * 60
+        if not budget or not self.known:
+            return
+        for job in self.jobs:
+            if job["finish"] > budget:
+                self.warnings.append(
+                    "Saving {0} onward would run past the {1} budget: "
+                    "about {2} in total".format(
+                        job["name"] or job["stem"],
+                        _format_duration(budget),
+                        _format_duration(self.seconds)))
+                break
+
+    def message(self):
+        """Summary of the plan for the artist, warnings last."""
+        lines = ["Plan for {0} sequence(s), {1} frames:".format(
+            len(self.jobs), sum(job["frames"] for job in self.jobs))]
+        for job in self.jobs:
+            parts = ["{0} frames".format(job["frames"])]
+            if self.known:
+                parts.append(_format_size(job["bytes"]))
+            if job["seconds"] is not None:
+                parts.append(_format_duration(job["seconds"]))
+            lines.append("  {0}: {1}".format(
+                job["name"] or job["stem"], ", ".join(parts)))
+        if self.known:
+            total = "Total: about {0} kept".format(_format_size(self.bytes))
+            if self.free_bytes is not None:
+                total += " of {0} free".format(
+                    _format_size(self.free_bytes))
+            total += ", {0}".format(_format_duration(self.seconds))
+            if self.mplay_seconds < self.seconds:
+                total += " (MPlay free after {0})".format(
+                    _format_duration(self.mplay_seconds))
+            lines.append(total)
+        else:
+            lines.append(
+                "No throughput history for these settings yet, so only "
+                "the frames' size can be checked against free space")
+        return "\n".join(lines + self.warnings)
+
+
+def _median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
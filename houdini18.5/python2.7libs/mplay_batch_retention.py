@@ -0,0 +1,323 @@
+"""MPlay Batch retention
+
+Prunes old sub-versions from a flipbook directory. Saves only start a
+prune in the background, so this is mostly imported by the ``prune``
+command.
+"""
+import errno
+import os
+import shutil
+import stat
+import time
+
+from mplay_batch import (
+    EncoderPool,
+    FileLock,
+    SubVersionIndex,
+    _cli_source,
+    _list_subdirs,
+    _python_executable,
+    _spawn_detached,
+    available_cpus,
+    cache_dir
+)
+
+
+# Seconds between background prunes of a flipbook directory
+PRUNE_INTERVAL = 60 * 60
+
+
+class RetentionPolicy(object):
+    """Rules for which old sub-versions of a flipbook directory to prune.
+
+    The newest sub-version of each name is always kept, so a name's
+    next sub-version number never goes backwards. So is anything written
+    to in the last :attr:`MIN_AGE` seconds, or still waiting on the
+    local :class:`mplay_batch_daemon.EncodeDaemon`.
+
+    :param keep: Sub-versions to keep of each name. 0 keeps them all
+    :type keep: int
+    :param max_age: Seconds since a sub-version was last written to
+        before it is pruned. 0 for no limit
+    :type max_age: float
+    :param max_bytes: Size to keep the flipbook directory under, by
+        pruning the least recently written sub-versions first. 0 for no
+        limit
+    :type max_bytes: int
+    """
+
+    MIN_AGE = 60 * 60
+
+    def __init__(self, keep=0, max_age=0, max_bytes=0):
+        self.keep = keep
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+
+    @classmethod
+    def from_env(cls, env):
+        """Policy set by an :class:`Environment`'s retention settings."""
+        return cls(
+            keep=env.keep_sub_versions,
+            max_age=env.max_age_days * 24 * 60 * 60,
+            max_bytes=int(env.max_size_gb * 1024 ** 3)
+        )
+
+    @property
+    def enabled(self):
+        """Whether any rule is set."""
+        return bool(self.keep or self.max_age or self.max_bytes)
+
+    def select(self, usage, protected=(), now=None):
+        """Pick the sub-versions to prune.
+
+        :param usage: Sub-versions from :func:`measure_sub_versions`
+        :type usage: list of dict
+        :param protected: Directories that must not be pruned
+        :type protected: collection of str
+        :param now: Time to measure ages from. Defaults to now
+        :type now: float
+        :return: Each sub-version to prune with the rule that pruned it,
+            the total size of the flipbook directory and the bytes pruning
+            would free
+        :rtype: tuple
+        """
+        now = time.time() if now is None else now
+        links = {}
+        for entry in usage:
+            for inode, (size, nlink, _) in entry["linked"].items():
+                links[inode] = (size, nlink)
+        total = sum(entry["bytes"] for entry in usage) + sum(
+            size for size, _ in links.values())
+        remaining = dict((inode, nlink) for inode, (_, nlink) in links.items())
+
+        def freed_by(entry):
+            freed = entry["bytes"]
+            for inode, (size, _, count) in entry["linked"].items():
+                remaining[inode] -= count
+                if not remaining[inode]:
+                    freed += size
+            return freed
+
+        by_name = {}
+        for entry in usage:
+            by_name.setdefault(entry["name"], []).append(entry)
+        candidates = []
+        for entries in by_name.values():
+            entries.sort(key=lambda entry: -int(entry["sub_version"]))
+            candidates += [
+                (i, entry) for i, entry in enumerate(entries)
+                if i and entry["dirname"] not in protected
+                and now - entry["mtime"] > self.MIN_AGE
+            ]
+
+        pruned = []
+        freed = 0
+        for i, entry in candidates:
+            if self.keep and i >= self.keep:
+                reason = "keep {0}".format(self.keep)
+            elif self.max_age and now - entry["mtime"] > self.max_age:
+                reason = "older than {0:g} days".format(
+                    self.max_age / 86400.0)
+            else:
+                continue
+            pruned.append((entry, reason))
+            freed += freed_by(entry)
+        if self.max_bytes:
+            chosen = set(id(entry) for entry, _ in pruned)
+            for _, entry in sorted(
+                    candidates, key=lambda candidate: candidate[1]["mtime"]):
+                if total - freed <= self.max_bytes:
+                    break
+                if id(entry) in chosen:
+                    continue
+                pruned.append((entry, "over {0:g} GB".format(
+                    self.max_bytes / float(1024 ** 3))))
+                freed += freed_by(entry)
+        return pruned, total, freed
+
+
+def measure_sub_versions(flipbook_dir, workers=None):
+    """Disk use of every sub-version directory in a flipbook directory.
+
+    Sub-versions are walked in parallel, since on network storage the
+    walk is mostly waiting on the server. Files with several hardlinks,
+    like reused or held frames, are listed by inode so they are only
+    counted once.
+
+    :param flipbook_dir: Flipbook directory to measure
+    :type flipbook_dir: str
+    :param workers: Directories to walk at once
+    :type workers: int
+    :return: ``dirname``, ``name``, ``sub_version``, ``bytes`` of files
+        with one link, ``linked`` files by inode as in :func:`_tree_usage`,
+        and the newest ``mtime`` of each sub-version
+    :rtype: list of dict
+    """
+    regex = SubVersionIndex._entry_regex
+    try:
+        names = _list_subdirs(flipbook_dir, regex)
+    except OSError:
+        return []
+    usage = []
+
+    def measure(name):
+        dirname = os.path.join(flipbook_dir, name).replace(os.sep, "/")
+        try:
+            size, linked, mtime = _tree_usage(dirname)
+        except OSError:
+            return  # Removed while walking
+        name_, sub_version = regex.match(name).groups()
+        usage.append({
+            "dirname": dirname,
+            "name": name_,
+            "sub_version": sub_version,
+            "bytes": size,
+            "linked": linked,
+            "mtime": mtime
+        })
+
+    pool = EncoderPool(workers or min(32, 4 * available_cpus()))
+    for name in names:
+        pool.submit(measure, name)
+    pool.join()
+    return sorted(usage, key=lambda entry: entry["dirname"])
+
+
+def _tree_usage(root):
+    """Size and newest mtime of everything under a directory.
+
+    :return: Bytes of files with a single link, the size, total link
+        count and links under ``root`` of files with more by
+        ``(st_dev, st_ino)``, and the newest mtime
+    :rtype: tuple
+    """
+    size = 0
+    linked = {}
+    mtime = os.lstat(root).st_mtime
+    stack = [root]
+    while stack:
+        dirname = stack.pop()
+        try:
+            scandir = os.scandir
+        except AttributeError:
+            entries = [
+                (os.path.join(dirname, name), None)
+                for name in os.listdir(dirname)
+            ]
+        else:
+            entries = [(entry.path, entry) for entry in scandir(dirname)]
+        for path, entry in entries:
+            try:
+                info = entry.stat(follow_symlinks=False) if entry else (
+                    os.lstat(path))
+            except OSError:
+                continue
+            mtime = max(mtime, info.st_mtime)
+            if stat.S_ISDIR(info.st_mode):
+                stack.append(path)
+            elif info.st_nlink > 1:
+                # Held frames link to each other within one sub-version
+                inode = (info.st_dev, info.st_ino)
+                count = linked[inode][2] if inode in linked else 0
+                linked[inode] = (info.st_size, info.st_nlink, count + 1)
+            else:
+                size += info.st_size
+    return size, linked, mtime
+
+
+def prune_flipbook_dir(flipbook_dir, policy, dry_run=False, workers=None):
+    """Remove the sub-versions a :class:`RetentionPolicy` selects.
+
+    Each sub-version is moved into a trash directory before it is
+    deleted, so nothing ever sees one half removed. Only one prune runs
+    on a flipbook directory at a time.
+
+    :param flipbook_dir: Flipbook directory to prune
+    :type flipbook_dir: str
+    :param policy: Rules for what to prune
+    :type policy: :class:`RetentionPolicy`
+    :param dry_run: Only report what would be pruned
+    :type dry_run: bool
+    :param workers: Directories to measure at once
+    :type workers: int
+    :return: The ``pruned`` sub-versions with their ``bytes``,
+        ``reason`` and whether they were ``removed``, the ``total`` size
+        before pruning, the bytes pruning ``freed``, and whether it was
+        ``skipped`` because another prune was running
+    :rtype: dict
+    """
+    from mplay_batch_catalog import FlipbookCatalog
+    from mplay_batch_daemon import EncodeDaemon
+
+    report = {"pruned": [], "total": 0, "freed": 0, "skipped": False}
+    meta_dir = os.path.join(flipbook_dir, SubVersionIndex.META_DIR)
+    try:
+        os.makedirs(os.path.join(meta_dir, "trash"))
+    except OSError as error:
+        if error.errno != errno.EEXIST:
+            raise
+    lock = FileLock(os.path.join(meta_dir, "prune.lock"))
+    if not lock.acquire(blocking=False):
+        report["skipped"] = True
+        return report
+    try:
+        protected = set()
+        for state in ("queue", "running"):
+            for data in EncodeDaemon().status()[state]:
+                protected.add(data["task"].get("seq_dirname"))
+        usage = measure_sub_versions(flipbook_dir, workers)
+        pruned, report["total"], report["freed"] = policy.select(
+            usage, protected)
+        catalog = FlipbookCatalog()
+        for entry, reason in pruned:
+            result = {
+                "dirname": entry["dirname"],
+                "bytes": entry["bytes"] + sum(
+                    size for size, _, _ in entry["linked"].values()),
+                "reason": reason,
+                "removed": False
+            }
+            report["pruned"].append(result)
+            if dry_run:
+                continue
+            trash = os.path.join(meta_dir, "trash", "{0}_{1:.0f}".format(
+                os.path.basename(entry["dirname"]), time.time()))
+            try:
+                os.rename(entry["dirname"], trash)
+            except OSError:
+                continue
+            shutil.rmtree(trash, ignore_errors=True)
+            catalog.remove(entry["dirname"])
+            result["removed"] = True
+    finally:
+        lock.release()
+    return report
+
+
+def prune_in_background(env):
+    """Start a detached prune of the flipbook directory, if it's due.
+
+    Runs at most once every :data:`PRUNE_INTERVAL` seconds per flipbook
+    directory, and only when :class:`Environment` sets a retention rule.
+
+    :param env: Settings with the flipbook directory and the rules
+    :type env: :class:`Environment`
+    """
+    if not RetentionPolicy.from_env(env).enabled:
+        return
+    stamp = os.path.join(
+        env.flipbook_dir, SubVersionIndex.META_DIR, "prune.stamp")
+    try:
+        if time.time() - os.path.getmtime(stamp) < PRUNE_INTERVAL:
+            return
+    except OSError:
+        pass
+    try:
+        with open(stamp, "a"):
+            os.utime(stamp, None)
+    except (IOError, OSError):
+        return  # Can't write the flipbook directory, so can't prune it
+    _spawn_detached(
+        [_python_executable(), _cli_source(), "prune", env.flipbook_dir],
+        os.path.join(cache_dir(), "prune.log")
+    )
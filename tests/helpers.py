@@ -0,0 +1,85 @@
+"""Shared setup for the mplay_batch tests.
+
+Tests run outside Houdini, so ``hou`` is None unless a test installs
+:class:`fake_hou.FakeHou` itself. Run them with either of::
+
+    python -m pytest tests
+    python -m unittest discover tests
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+sys.path.insert(0, os.path.join(ROOT, "houdini18.5", "python2.7libs"))
+
+import mplay_batch  # noqa: E402
+from fake_hou import FakeHou  # noqa: E402
+
+
+class TempDirTestCase(unittest.TestCase):
+    """Runs each test in a scratch directory, without MPLAY_BATCH_* set.
+
+    The cache and flipbook directories both point inside :attr:`tmp`.
+    """
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix="mplay_batch_test_")
+        self.addCleanup(shutil.rmtree, self.tmp, True)
+        environ = dict(os.environ)
+        self.addCleanup(self._restore_environ, environ)
+        for name in list(os.environ):
+            if name.startswith("MPLAY_BATCH_"):
+                del os.environ[name]
+        os.environ["MPLAY_BATCH_CACHE_DIR"] = os.path.join(self.tmp, "cache")
+        os.environ["MPLAY_BATCH_FLIPBOOK_DIR"] = os.path.join(
+            self.tmp, "flip")
+
+    @staticmethod
+    def _restore_environ(environ):
+        os.environ.clear()
+        os.environ.update(environ)
+
+    def patch(self, owner, name, value):
+        """Replace an attribute for the rest of the test."""
+        self.addCleanup(setattr, owner, name, getattr(owner, name))
+        setattr(owner, name, value)
+
+    def fake_hou(self, **kwargs):
+        """Stand in for MPlay for the rest of the test.
+
+        :return: The fake, which records every hscript command it runs
+        :rtype: :class:`fake_hou.FakeHou`
+        """
+        hou = FakeHou(**kwargs)
+        self.patch(mplay_batch, "hou", hou)
+        return hou
+
+    def write(self, path, data=b"\0"):
+        """Write a file under :attr:`tmp`, creating its directory.
+
+        :return: Absolute path of the file
+        :rtype: str
+        """
+        path = os.path.join(self.tmp, path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "wb") as file_:
+            file_.write(data)
+        return path
+
+    def write_frames(self, dirname, prefix, suffix, frames, data=None):
+        """Write one file per frame, each holding ``data`` or its number.
+
+        :return: Index of the frames written
+        :rtype: :class:`mplay_batch.FrameIndex`
+        """
+        for frame in frames:
+            self.write(
+                os.path.join(dirname, "{0}{1}{2}".format(prefix, frame, suffix)),
+                data if data is not None else str(frame).encode("ascii"))
+        return mplay_batch.FrameIndex(
+            os.path.join(self.tmp, dirname), prefix, suffix, frames)
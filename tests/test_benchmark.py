@@ -0,0 +1,58 @@
+"""Headless benchmark harness and its fake ``hou`` (user-010)."""
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+from helpers import ROOT, TempDirTestCase, mplay_batch
+
+
+class FakeHouTest(TempDirTestCase):
+
+    def test_answers_mplay_queries(self):
+        self.fake_hou(frange=(3, 12), seqls=["a", "b"], fps=30.0)
+        self.assertEqual(mplay_batch.Environment.mplay_frange(), (3, 12))
+        session = mplay_batch.MPlaySession()
+        self.assertEqual(session.seqls, ["a", "b"])
+        self.assertEqual(session.fps, 30.0)
+
+    def test_imgsave_writes_every_frame(self):
+        template = self.write("template.jpg", b"jpeg")
+        hou = self.fake_hou(frange=(1, 3), template=template)
+        os.makedirs(os.path.join(self.tmp, "seq"))
+        hou.hscript(r"imgsave -a {0}/seq/s.\$\F.jpg".format(self.tmp))
+        index = mplay_batch.FrameIndex.scan(
+            os.path.join(self.tmp, "seq"), "s.", ".jpg")
+        self.assertEqual(list(index.frames), [1, 2, 3])
+        with open(index.path(2), "rb") as file_:
+            self.assertEqual(file_.read(), b"jpeg")
+
+    def test_unknown_commands_fail_loudly(self):
+        hou = self.fake_hou()
+        with self.assertRaises(ValueError):
+            hou.hscript("viewzoom 2")
+
+
+class BenchmarkTest(TempDirTestCase):
+
+    def test_reports_json(self):
+        output = os.path.join(self.tmp, "bench.json")
+        subprocess.check_output([
+            sys.executable, os.path.join(ROOT, "benchmarks",
+                                         "bench_mplay_batch.py"),
+            "--frames", "3", "--dir-sizes", "0", "--repeat", "1",
+            "--frame-bytes", "8", "--no-execute", "--startup-limit", "10",
+            "--output", output
+        ])
+        with open(output) as file_:
+            report = json.load(file_)
+        self.assertEqual(report["meta"]["repeat"], 1)
+        names = set(result["name"] for result in report["results"])
+        for name in ["startup.first_imgsave", "Environment",
+                     "Sequence.frange_from_files"]:
+            self.assertIn(name, names)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+"""Indexed flipbook catalog (user-021)."""
+import os
+import unittest
+
+from helpers import TempDirTestCase, mplay_batch
+import mplay_batch_catalog
+
+
+class FlipbookCatalogTest(TempDirTestCase):
+
+    def setUp(self):
+        super(FlipbookCatalogTest, self).setUp()
+        self.thumbnails = []
+
+        def make_thumbnail(catalog, source, key, seek=0.0):
+            self.thumbnails.append((os.path.basename(source), seek))
+            return self.write(
+                "thumbs/{0}.jpg".format(len(self.thumbnails))), (64, 48)
+
+        self.patch(mplay_batch_catalog.FlipbookCatalog, "_make_thumbnail",
+                   make_thumbnail)
+        self.catalog = mplay_batch_catalog.FlipbookCatalog()
+
+    def add(self, hip, sub_version, index=0, name=None, created=None,
+            frames=(1, 2, 3), outputs=(".mp4",)):
+        dirname = "flip/{0}_{1}".format(hip, sub_version)
+        stem = "{0}_{1}_{2}".format(hip, sub_version, index)
+        self.write_frames(dirname, stem + ".", ".jpg", frames)
+        for suffix in outputs:
+            self.write(os.path.join(dirname, stem + suffix), b"out")
+        self.catalog.add({
+            "dirname": os.path.join(self.tmp, dirname),
+            "stem": stem,
+            "hip": hip,
+            "sub_version": sub_version,
+            "name": name,
+            "frange": [1, 100],
+            "fps": 24,
+            "created": created
+        })
+        return os.path.join(self.tmp, dirname)
+
+    def test_records_what_is_on_disk(self):
+        self.add("shot", "000", name="beauty", frames=[4, 5, 6, 7],
+                 outputs=[".mp4", "_50pct.mp4", ".gif"])
+        row, = self.catalog.search()
+        self.assertEqual(
+            (row["first_frame"], row["last_frame"], row["frames"]), (4, 7, 4))
+        self.assertEqual(
+            row["outputs"],
+            ["shot_000_0.gif", "shot_000_0.mp4", "shot_000_0_50pct.mp4"])
+        self.assertEqual(row["bytes"], 4 + 3 * 3)
+        self.assertEqual((row["width"], row["height"]), (64, 48))
+        self.assertEqual(self.thumbnails, [("shot_000_0.6.jpg", 0.0)])
+
+    def test_thumbnail_from_the_video_without_frames(self):
+        dirname = self.add("shot", "000", frames=[])
+        self.catalog.add({
+            "dirname": dirname, "stem": "shot_000_0", "frange": [1, 48],
+            "fps": 24
+        })
+        self.assertEqual(self.thumbnails[-1], ("shot_000_0.mp4", 1.0))
+        self.assertEqual(len(self.catalog.search()), 1)
+
+    def test_search_matches_every_word_newest_first(self):
+        self.add("shot", "000", name="beauty", created=1)
+        self.add("shot", "001", name="beauty", created=2)
+        self.add("shot", "001", index=1, name="depth", created=3)
+        self.add("asset", "000", name="beauty", created=4)
+        self.assertEqual(
+            [row["stem"] for row in self.catalog.search("beauty shot")],
+            ["shot_001_0", "shot_000_0"])
+        self.assertEqual(
+            [row["stem"] for row in self.catalog.search(limit=2)],
+            ["asset_000_0", "shot_001_1"])
+        self.assertEqual(self.catalog.search("missing"), [])
+
+    def test_remove_forgets_a_sub_version_and_its_thumbnails(self):
+        self.add("shot", "000")
+        dirname = self.add("shot", "001")
+        self.add("shot", "001", index=1)
+        self.catalog.remove(dirname)
+        self.assertEqual(
+            [row["stem"] for row in self.catalog.search()], ["shot_000_0"])
+        self.assertEqual(
+            sorted(os.listdir(os.path.join(self.tmp, "thumbs"))), ["1.jpg"])
+
+    def test_resolutions(self):
+        self.add("shot", "000", name="beauty", created=1)
+        self.add("other", "000", created=2)
+        by_stem, by_name = self.catalog.resolutions(
+            "shot", stems=["other_000_0", "missing"])
+        self.assertEqual(by_stem, {"shot_000_0": 3072, "other_000_0": 3072})
+        self.assertEqual(by_name, {"beauty": 3072})
+
+    def test_scan_adds_earlier_saves(self):
+        self.write_frames("flip/shot_000", "shot_000_0.", ".jpg", [1, 2])
+        self.write("flip/shot_000/shot_000_1.mp4", b"out")
+        self.write_frames("flip/shot_001", "shot_001_0.", ".jpg", [1, 2])
+        env = mplay_batch.Environment()
+        env.session = mplay_batch.MPlaySession(fps=24)
+        self.assertEqual(self.catalog.scan(env.flipbook_dir, env), 3)
+        self.assertEqual(
+            sorted(row["stem"] for row in self.catalog.search("shot")),
+            ["shot_000_0", "shot_000_1", "shot_001_0"])
+
+
+class FormatRowTest(unittest.TestCase):
+
+    def test_format(self):
+        line = mplay_batch_catalog._format_catalog_row({
+            "created": 0, "stem": "shot_000_0", "first_frame": 1,
+            "last_frame": 24, "width": 1920, "height": 1080, "bytes": 0,
+            "name": "beauty"
+        })
+        self.assertIn("shot_000_0  1-24  1920x1080", line)
+        self.assertTrue(line.endswith("(beauty)"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+"""Encoding long videos in parallel chunks (user-020)."""
+import os
+import subprocess
+import unittest
+
+from helpers import TempDirTestCase, mplay_batch
+
+
+class ChunkRangesTest(unittest.TestCase):
+
+    def test_rounds_up_to_whole_gops(self):
+        self.assertEqual(
+            mplay_batch.chunk_ranges((1, 600), 100),
+            [(1, 250), (251, 250), (501, 100)])
+        self.assertEqual(
+            mplay_batch.chunk_ranges((1001, 1500), 500),
+            [(1001, 500)])
+
+
+class ChunkTaskTest(TempDirTestCase):
+
+    def setUp(self):
+        super(ChunkTaskTest, self).setUp()
+        self.patch(mplay_batch.Environment, "check_ffmpeg",
+                   lambda self, video=True: None)
+        self.env = mplay_batch.Environment()
+        self.env.session = mplay_batch.MPlaySession(
+            frange=(1, 1), seqls=[], fps=24)
+        self.env.chunk_frames = 250
+
+    def task(self, frames, threads=16, gif=False):
+        self.write_frames("flip/shot_000", "shot_000_0.", ".jpg", frames)
+        seq, = mplay_batch.find_sequences(self.env.flipbook_dir, self.env)
+        writer = mplay_batch.SequenceWriter(self.env, video=True, gif=gif)
+        writer.encoder_threads = threads
+        return writer.encode_task(mplay_batch.SequenceWriterJob(seq))
+
+    def test_splits_long_videos(self):
+        task = self.task(range(1, 601))
+        self.assertEqual(len(task.chunks), 3)
+        self.assertEqual(task.chunk_workers, 3)
+        self.assertEqual(task.stages, ["video", "join"])
+        for cmd, first, length in zip(
+                task.chunks, [1, 251, 501], [250, 250, 100]):
+            self.assertEqual(cmd[cmd.index("-start_number") + 1], str(first))
+            self.assertEqual(cmd[cmd.index("-frames:v") + 1], str(length))
+            self.assertEqual(cmd[cmd.index("-g") + 1], "250")
+        join, = task.commands
+        self.assertIn("copy", join)
+        self.assertTrue(join[-1].endswith("/shot_000_0.mp4"))
+        list_path = join[join.index("-i") + 1]
+        with open(list_path) as file_:
+            self.assertEqual(len(file_.read().splitlines()), 4)
+
+    def test_gif_made_separately_from_the_chunks(self):
+        task = self.task(range(1, 601), gif=True)
+        self.addCleanup(os.remove, task.palette)
+        join, palettegen, paletteuse = task.commands
+        self.assertEqual(palettegen[-1], task.palette)
+        self.assertTrue(paletteuse[-1].endswith("/shot_000_0.gif"))
+        self.assertNotIn(".mp4", " ".join(palettegen + paletteuse))
+        self.assertEqual(
+            task.stages, ["video", "join", "palettegen", "paletteuse"])
+
+    def test_short_videos_are_whole(self):
+        self.assertIsNone(self.task(range(1, 251)).chunks)
+
+    def test_videos_with_missing_frames_are_whole(self):
+        self.assertIsNone(self.task([1] + list(range(3, 601))).chunks)
+
+    def test_whole_without_threads_for_two_chunks(self):
+        self.assertIsNone(
+            self.task(range(1, 601), threads=mplay_batch.THREADS_PER_ENCODER)
+            .chunks)
+
+
+class RunChunksTest(TempDirTestCase):
+
+    def test_first_failure_skips_chunks_not_yet_started(self):
+        ran = []
+
+        def run_ffmpeg(cmd, on_progress=None):
+            ran.append(cmd[0])
+            if cmd[0] == "b":
+                raise subprocess.CalledProcessError(1, cmd)
+
+        self.patch(mplay_batch, "run_ffmpeg", run_ffmpeg)
+        index = mplay_batch.FrameIndex(self.tmp, "s.", ".jpg", [1, 2])
+        task = mplay_batch.EncodeTask(
+            "s", [["join"]], index, chunks=[["a"], ["b"], ["c"]])
+        with self.assertRaises(mplay_batch.FFmpegFailedError):
+            task.run()
+        self.assertEqual(ran, ["a", "b"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+"""Headless encodes shared across machines (user-019)."""
+import os
+import time
+import unittest
+
+from helpers import TempDirTestCase, mplay_batch
+import mplay_batch_cli
+
+
+class ClaimDirTest(TempDirTestCase):
+
+    def setUp(self):
+        super(ClaimDirTest, self).setUp()
+        self.path = os.path.join(self.tmp, "claims")
+        self.mine = mplay_batch_cli.ClaimDir(self.path)
+        self.theirs = mplay_batch_cli.ClaimDir(self.path)
+
+    def test_only_one_claim_at_a_time(self):
+        self.assertTrue(self.mine.claim("a"))
+        self.assertFalse(self.theirs.claim("a"))
+        self.assertTrue(self.theirs.claim("b"))
+
+    def test_finished_work_is_never_claimed_again(self):
+        self.mine.claim("a")
+        self.mine.finish("a")
+        self.assertFalse(self.theirs.claim("a"))
+        self.assertFalse(self.mine.claim("a"))
+
+    def test_released_work_can_be_claimed(self):
+        self.mine.claim("a")
+        self.mine.release("a")
+        self.assertTrue(self.theirs.claim("a"))
+
+    def test_stale_claims_are_taken_over(self):
+        self.mine.claim("a")
+        lock = os.path.join(self.path, "a.lock")
+        old = time.time() - 2 * mplay_batch_cli.ClaimDir.STALE_AFTER
+        os.utime(lock, (old, old))
+        self.assertTrue(self.theirs.claim("a"))
+        self.assertEqual(
+            sorted(os.listdir(self.path)), ["a.lock"])
+
+
+class EnvironmentTest(TempDirTestCase):
+
+    def test_given_flipbook_dir_overrides_the_variable(self):
+        path = os.path.join(self.tmp, "given")
+        env = mplay_batch_cli._environment(path, fps=25.0)
+        self.assertEqual(env.flipbook_dir, path)
+        self.assertEqual(env.fps, 25.0)
+        self.assertFalse(os.path.exists(os.path.join(self.tmp, "flip")))
+
+    def test_unset_variables_are_not_created(self):
+        os.environ.pop("JOB", None)
+        del os.environ["MPLAY_BATCH_FLIPBOOK_DIR"]
+        env = mplay_batch.Environment(
+            flipbook_dir=os.path.join(self.tmp, "$JOB", "flip"))
+        with self.assertRaises(ValueError):
+            env.flipbook_dir
+        self.assertFalse(os.path.exists(os.path.join(self.tmp, "$JOB")))
+
+    def test_strict_expansion(self):
+        os.environ["MPLAY_BATCH_TEST_DIR"] = self.tmp
+        self.assertEqual(
+            mplay_batch._expand_string(
+                "${MPLAY_BATCH_TEST_DIR}/a", strict=True),
+            self.tmp + "/a")
+        with self.assertRaises(ValueError):
+            mplay_batch._expand_string("$MPLAY_BATCH_UNSET/a", strict=True)
+        self.assertEqual(
+            mplay_batch._expand_string("$MPLAY_BATCH_UNSET/a"),
+            "$MPLAY_BATCH_UNSET/a")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+"""Detached encode daemon (user-009)."""
+import os
+import subprocess
+import unittest
+
+from helpers import TempDirTestCase, mplay_batch
+import mplay_batch_daemon
+
+
+class EncodeDaemonTest(TempDirTestCase):
+
+    def setUp(self):
+        super(EncodeDaemonTest, self).setUp()
+        self.patch(mplay_batch_daemon.EncodeDaemon, "POLL_INTERVAL", 0.01)
+        self.patch(mplay_batch, "run_ffmpeg", self.run_ffmpeg)
+        self.daemon = mplay_batch_daemon.EncodeDaemon()
+        self.ran = []
+
+    def run_ffmpeg(self, cmd, on_progress=None):
+        self.ran.append(cmd[-1])
+        if "fail" in cmd:
+            raise subprocess.CalledProcessError(1, cmd)
+
+    def task(self, name, fail=False):
+        index = self.write_frames(name, "s.", ".jpg", [1, 2])
+        cmd = ["ffmpeg", "-i", index.path(1)] + (["fail"] if fail else [])
+        return mplay_batch.EncodeTask(
+            name, [cmd + [name]], index, remove_frames=True, job=name)
+
+    def test_runs_queued_jobs(self):
+        self.daemon.submit(self.task("a"))
+        self.daemon.submit(self.task("b"))
+        self.assertEqual(len(self.daemon.status()["queue"]), 2)
+        self.assertTrue(self.daemon.serve(workers=2, idle_timeout=0))
+        self.assertEqual(sorted(self.ran), ["a", "b"])
+        status = self.daemon.status()
+        self.assertEqual(
+            sorted(data["task"]["job"] for data in status["done"]),
+            ["a", "b"])
+        self.assertEqual(status["queue"] + status["running"], [])
+        self.assertEqual(os.listdir(os.path.join(self.tmp, "a")), [])
+
+    def test_failures_are_reported_and_frames_kept(self):
+        self.daemon.submit(self.task("a", fail=True))
+        with open(os.path.join(
+                self.daemon.spool_dir, "queue", "broken.json"), "w") as file_:
+            file_.write("{")
+        self.daemon.serve(idle_timeout=0)
+        failed = self.daemon.status()["failed"]
+        self.assertEqual(len(failed), 2)
+        self.assertEqual(len(os.listdir(os.path.join(self.tmp, "a"))), 2)
+        message = self.daemon.status_message()
+        self.assertIn("failed: 2", message)
+        self.assertIn("broken.json", message)
+
+    def test_requeues_jobs_left_running(self):
+        job_id = self.daemon.submit(self.task("a"))
+        os.rename(
+            os.path.join(self.daemon.spool_dir, "queue", job_id + ".json"),
+            os.path.join(self.daemon.spool_dir, "running", job_id + ".json"))
+        self.daemon.serve(idle_timeout=0)
+        self.assertEqual(self.ran, ["a"])
+        self.assertEqual(
+            [data["id"] for data in self.daemon.status()["done"]], [job_id])
+
+    def test_not_running_between_saves(self):
+        self.assertFalse(self.daemon.is_running())
+        self.assertIn("not running", self.daemon.status_message())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+"""Named video encoding profiles (user-013)."""
+import json
+import os
+import unittest
+
+from helpers import TempDirTestCase, mplay_batch
+
+
+class EncodeProfileTest(TempDirTestCase):
+
+    def test_built_in_profiles(self):
+        profile = mplay_batch.EncodeProfile.named("preview")
+        self.assertEqual(profile.ffmpeg_args(threads=4), [
+            "-threads", "4", "-c:v", "libx264", "-preset", "ultrafast",
+            "-tune", "fastdecode", "-crf", "28", "-pix_fmt", "yuv420p"
+        ])
+        self.assertEqual(
+            mplay_batch.EncodeProfile.named("default").ffmpeg_args(),
+            ["-threads", "0", "-c:v", "libx264", "-pix_fmt", "yuv420p"])
+
+    def test_profiles_file_adds_and_overrides(self):
+        path = self.write("profiles.json", json.dumps({
+            "preview": {"codec": "libx265", "threads": 2},
+            "nvenc": {"codec": "h264_nvenc", "preset": "p1"}
+        }).encode("ascii"))
+        os.environ["MPLAY_BATCH_ENCODE_PROFILES"] = path
+        preview = mplay_batch.EncodeProfile.named("preview")
+        self.assertEqual(preview.ffmpeg_args(threads=8)[:4],
+                         ["-threads", "2", "-c:v", "libx265"])
+        self.assertIsNone(preview.crf)
+        self.assertEqual(
+            mplay_batch.EncodeProfile.named("nvenc").preset, "p1")
+        self.assertEqual(
+            mplay_batch.EncodeProfile.named("delivery").crf, 16)
+
+    def test_unknown_profile_lists_the_others(self):
+        with self.assertRaises(mplay_batch.UnsupportedEncodeProfileError) \
+                as raised:
+            mplay_batch.EncodeProfile.named("fast")
+        self.assertIn("default, delivery, preview", str(raised.exception))
+
+    def test_bad_profiles_file(self):
+        os.environ["MPLAY_BATCH_ENCODE_PROFILES"] = self.write(
+            "profiles.json", b"{")
+        with self.assertRaises(mplay_batch.UnsupportedEncodeProfileError):
+            mplay_batch.EncodeProfile.named("default")
+        os.environ["MPLAY_BATCH_ENCODE_PROFILES"] = self.write(
+            "profiles.json", b'{"odd": {"bitrate": "8M"}}')
+        with self.assertRaises(mplay_batch.UnsupportedEncodeProfileError):
+            mplay_batch.EncodeProfile.named("odd")
+
+
+class CheckFFmpegTest(TempDirTestCase):
+
+    def setUp(self):
+        super(CheckFFmpegTest, self).setUp()
+        self.patch(mplay_batch, "_FFMPEG_CAPABILITIES",
+                   mplay_batch.FFmpegCapabilities(
+                       path="ffmpeg", formats=["mp4", "gif"],
+                       encoders=["libx264", "gif"]))
+
+    def test_encoder_must_be_available(self):
+        env = mplay_batch.Environment()
+        env.check_ffmpeg()
+        path = self.write("profiles.json", b'{"hevc": {"codec": "libx265"}}')
+        os.environ["MPLAY_BATCH_ENCODE_PROFILES"] = path
+        env.encode_profile = "hevc"
+        with self.assertRaises(mplay_batch.UnsupportedEncodeProfileError):
+            env.check_ffmpeg()
+        # GIFs don't use the profile
+        env.check_ffmpeg(video=False)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+"""Bounded, CPU-aware pool of encoder threads (user-002)."""
+import os
+import threading
+import unittest
+
+from helpers import TempDirTestCase, mplay_batch
+
+
+class EncoderPoolTest(unittest.TestCase):
+
+    def test_runs_tasks_at_once(self):
+        started = threading.Event()
+        seen = []
+
+        def first():
+            # Only finishes if the second task runs alongside it
+            seen.append(started.wait(5))
+
+        pool = mplay_batch.EncoderPool(2)
+        pool.submit(first)
+        pool.submit(started.set)
+        pool.join()
+        self.assertEqual(seen, [True])
+
+    def test_errors_raised_from_join_after_every_task(self):
+        ran = []
+
+        def fail(name):
+            ran.append(name)
+            raise ValueError(name)
+
+        pool = mplay_batch.EncoderPool(1)
+        pool.submit(fail, "a")
+        pool.submit(ran.append, "b")
+        pool.submit(fail, "c")
+        with self.assertRaises(ValueError) as raised:
+            pool.join()
+        self.assertEqual(str(raised.exception), "a")
+        self.assertEqual(ran, ["a", "b", "c"])
+
+    def test_on_wait_called_while_waiting(self):
+        release = threading.Event()
+        waits = []
+
+        def on_wait():
+            waits.append(True)
+            release.set()
+
+        pool = mplay_batch.EncoderPool(0)
+        self.assertEqual(pool.size, 1)
+        pool.submit(release.wait, 5)
+        pool.join(on_wait=on_wait, interval=0.01)
+        self.assertTrue(waits)
+
+
+class MaxEncodersTest(TempDirTestCase):
+
+    def test_shares_cpus_between_encoders(self):
+        self.patch(mplay_batch, "available_cpus", lambda: 16)
+        self.assertEqual(
+            mplay_batch.Environment().max_encoders,
+            16 // mplay_batch.THREADS_PER_ENCODER)
+        self.patch(mplay_batch, "available_cpus", lambda: 1)
+        self.assertEqual(mplay_batch.Environment().max_encoders, 1)
+
+    def test_setting_overrides(self):
+        os.environ["MPLAY_BATCH_MAX_ENCODERS"] = "3"
+        self.assertEqual(mplay_batch.Environment().max_encoders, 3)
+        os.environ["MPLAY_BATCH_MAX_ENCODERS"] = "-1"
+        with self.assertRaises(mplay_batch.EnvironmentVariableValueError):
+            mplay_batch.Environment()
+
+
+if __name__ == "__main__":
+    unittest.main()
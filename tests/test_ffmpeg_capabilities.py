@@ -0,0 +1,91 @@
+"""Caching what the installed ffmpeg can do (user-004)."""
+import json
+import os
+import stat
+import unittest
+
+from helpers import TempDirTestCase, mplay_batch
+
+FORMATS = """File formats:
+ D. = Demuxing supported
+ .E = Muxing supported
+ --
+ D  concat          Virtual concatenation script
+  E gif             CompuServe Graphics Interchange Format (GIF)
+ DE image2          image2 sequence
+"""
+
+ENCODERS = """Encoders:
+ V..... = Video
+ A..... = Audio
+ ------
+ V....D gif                  GIF (Graphics Interchange Format)
+ V....D libx264              libx264 H.264 / AVC / MPEG-4 AVC (codec h264)
+ A....D aac                  AAC (Advanced Audio Coding)
+"""
+
+
+class CapabilitiesTest(TempDirTestCase):
+
+    def setUp(self):
+        super(CapabilitiesTest, self).setUp()
+        self.ffmpeg = self.write("bin/ffmpeg", b"#!/bin/sh\n")
+        os.chmod(self.ffmpeg, os.stat(self.ffmpeg).st_mode | stat.S_IXUSR)
+        os.environ["PATH"] = os.path.dirname(self.ffmpeg)
+        self.runs = []
+        self.patch(mplay_batch.FFmpegCapabilities, "_run", self.run_ffmpeg)
+
+    def run_ffmpeg(self, flag):
+        self.runs.append(flag)
+        return {
+            "-version": "ffmpeg version 4.4.1 Copyright (c)\n",
+            "-formats": FORMATS,
+            "-encoders": ENCODERS
+        }[flag]
+
+    def test_parses_what_ffmpeg_reports(self):
+        caps = mplay_batch.FFmpegCapabilities.load()
+        self.assertEqual(caps.path, self.ffmpeg)
+        self.assertEqual(caps.version, "4.4.1")
+        self.assertEqual(caps.formats, ["concat", "gif", "image2"])
+        self.assertEqual(caps.encoders, ["gif", "libx264", "aac"])
+
+    def test_probes_once_until_ffmpeg_changes(self):
+        mplay_batch.FFmpegCapabilities.load()
+        self.assertEqual(len(self.runs), 3)
+        caps = mplay_batch.FFmpegCapabilities.load()
+        self.assertEqual(len(self.runs), 3)
+        self.assertEqual(caps.encoders, ["gif", "libx264", "aac"])
+        self.write("bin/ffmpeg", b"#!/bin/sh\n# rebuilt\n")
+        mplay_batch.FFmpegCapabilities.load()
+        self.assertEqual(len(self.runs), 6)
+        mplay_batch.FFmpegCapabilities.load(refresh=True)
+        self.assertEqual(len(self.runs), 9)
+
+    def test_cached_per_path(self):
+        mplay_batch.FFmpegCapabilities.load()
+        os.environ["PATH"] += os.pathsep + self.tmp
+        mplay_batch.FFmpegCapabilities.load()
+        self.assertEqual(len(self.runs), 6)
+        path = os.path.join(
+            mplay_batch.cache_dir(), mplay_batch.FFmpegCapabilities.CACHE_FILE)
+        with open(path) as file_:
+            self.assertEqual(len(json.load(file_)), 2)
+
+    def test_unreadable_cache_probes_again(self):
+        self.write(os.path.join(
+            "cache", mplay_batch.FFmpegCapabilities.CACHE_FILE), b"{")
+        caps = mplay_batch.FFmpegCapabilities.load()
+        self.assertEqual(caps.version, "4.4.1")
+        self.assertEqual(len(self.runs), 3)
+
+    def test_missing_ffmpeg_is_not_cached(self):
+        os.environ["PATH"] = self.tmp
+        caps = mplay_batch.FFmpegCapabilities.load()
+        self.assertIsNone(caps.path)
+        self.assertFalse(caps.is_current())
+        self.assertEqual(self.runs, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
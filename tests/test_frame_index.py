@@ -0,0 +1,84 @@
+"""Single-listing frame index for sequences on disk (user-007)."""
+import os
+import unittest
+
+from helpers import TempDirTestCase, mplay_batch
+
+
+class FrameIndexTest(TempDirTestCase):
+
+    def test_scan_matches_only_the_sequence(self):
+        self.write_frames("seq", "s.", ".jpg", [1, 2, 9, 10, 100])
+        for name in ["s.3.png", "s.x.jpg", "s.4.jpg.bak", "t.5.jpg",
+                     "s.-6.jpg", "s..jpg"]:
+            self.write(os.path.join("seq", name))
+        index = mplay_batch.FrameIndex.scan(
+            os.path.join(self.tmp, "seq"), "s.", ".jpg")
+        self.assertEqual(list(index.frames), [1, 2, 9, 10, 100])
+
+    def test_paths_in_frame_order_not_name_order(self):
+        index = self.write_frames("seq", "s.", ".jpg", [10, 9, 1])
+        self.assertEqual(
+            [os.path.basename(path) for path in index.paths()],
+            ["s.1.jpg", "s.9.jpg", "s.10.jpg"])
+        self.assertEqual(
+            mplay_batch.FrameIndex.scan(index.dirname, "s.", ".jpg").frames,
+            index.frames)
+
+    def test_range_and_gaps(self):
+        index = mplay_batch.FrameIndex(
+            self.tmp, "s.", ".jpg", [7, 3, 4, 5, 9, 10])
+        self.assertEqual(len(index), 6)
+        self.assertEqual(index.frange, (3, 10))
+        self.assertEqual(index.gaps(), [(6, 6), (8, 8)])
+        index = mplay_batch.FrameIndex(self.tmp, "s.", ".jpg", [1, 5])
+        self.assertEqual(index.gaps(), [(2, 4)])
+
+    def test_empty(self):
+        index = mplay_batch.FrameIndex.scan(
+            os.path.join(self.tmp, "missing"), "s.", ".jpg")
+        self.assertEqual(len(index), 0)
+        self.assertIsNone(index.frange)
+        self.assertIsNone(index.first)
+        self.assertEqual(index.gaps(), [])
+        self.assertEqual(list(index.paths()), [])
+
+    def test_round_trips_through_dict(self):
+        index = mplay_batch.FrameIndex(self.tmp, "s.", ".exr", [3, 1, 2])
+        copy = mplay_batch.FrameIndex.from_dict(index.to_dict())
+        self.assertEqual(copy.to_dict(), index.to_dict())
+        self.assertEqual(copy.to_dict()["frames"], [1, 2, 3])
+
+
+class FindSequencesTest(TempDirTestCase):
+
+    def setUp(self):
+        super(FindSequencesTest, self).setUp()
+        self.env = mplay_batch.Environment()
+        self.env.session = mplay_batch.MPlaySession(
+            frange=(1, 1), seqls=[], fps=24)
+
+    def test_finds_each_sequence_once(self):
+        self.write_frames("flip/shot_000", "shot_000_0.", ".jpg", [1, 2])
+        self.write_frames("flip/shot_000", "shot_000_0.", ".tga", [1, 2])
+        self.write_frames("flip/shot_000", "shot_000_1.", ".tga", [5, 6, 7])
+        self.write_frames("flip/shot_000", "shot_000_2.", ".jpg", [1])
+        self.write_frames("flip/shot_001", "shot_001_0.", ".jpg", [1, 2])
+        seqs = mplay_batch.find_sequences(self.env.flipbook_dir, self.env)
+        self.assertEqual(
+            [(seq.stem, seq.frames_ext) for seq in seqs],
+            [("shot_000_0", "jpg"), ("shot_000_1", "tga"),
+             ("shot_001_0", "jpg")])
+        self.assertEqual(seqs[1].frange_from_files(), (5, 7))
+        self.assertEqual(len(seqs[1].files()), 3)
+
+    def test_one_sub_version(self):
+        self.write_frames("flip/shot_000", "shot_000_0.", ".jpg", [1, 2])
+        self.write_frames("flip/shot_001", "shot_001_0.", ".jpg", [1, 2])
+        seqs = mplay_batch.find_sequences(
+            os.path.join(self.env.flipbook_dir, "shot_001"), self.env)
+        self.assertEqual([seq.stem for seq in seqs], ["shot_001_0"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+"""Fitting GIFs to a size and time budget (user-024)."""
+import re
+import struct
+import unittest
+
+from helpers import TempDirTestCase, mplay_batch
+
+WIDTH = 1000
+
+
+class GifBudgetTest(unittest.TestCase):
+
+    def test_candidates_trade_frames_for_size(self):
+        candidates = mplay_batch.GifBudget().candidates(WIDTH)
+        self.assertEqual(candidates[:3], [(1, 1000), (1, 960), (1, 720)])
+        self.assertEqual(candidates[-1], (4, 320))
+        self.assertNotIn(1280, [width for _, width in candidates])
+        pixels = [width ** 2 / float(step) for step, width in candidates]
+        self.assertEqual(pixels, sorted(pixels, reverse=True))
+
+    def test_sample_windows(self):
+        budget = mplay_batch.GifBudget()
+        short = mplay_batch.FrameIndex("", "s.", ".jpg", range(1, 11))
+        self.assertEqual(budget._sample(short, 2), list(range(1, 11)))
+        long_ = mplay_batch.FrameIndex("", "s.", ".jpg", range(1, 241))
+        sample = budget._sample(long_, 1)
+        self.assertEqual(len(sample), 24)
+        self.assertEqual(sample[:2] + sample[-2:], [1, 2, 239, 240])
+
+    def test_format_cmds(self):
+        plan = {"step": 2, "width": 640, "stats_mode": "diff"}
+        cmd, = mplay_batch.GifBudget.format_cmds(
+            ["-i", "in"], "out.gif", 24, plan)
+        self.assertIn(
+            "fps=24/2,scale=640:-1:flags=lanczos,split[g0][g1];"
+            "[g0]palettegen=stats_mode=diff[p];[g1][p]paletteuse", cmd)
+        gen, use = mplay_batch.GifBudget.format_cmds(
+            ["-i", "in"], "out.gif", 24, plan, palette="p.png")
+        self.assertEqual(gen[-1], "p.png")
+        self.assertEqual(use[-1], "out.gif")
+
+
+class PlanTest(TempDirTestCase):
+    """Plans against test encodes whose size follows the pixels kept."""
+
+    def setUp(self):
+        super(PlanTest, self).setUp()
+        self.patch(mplay_batch.subprocess, "check_call", self.encode)
+        self.patch(mplay_batch, "_timer", lambda: 0.0)
+        self.index = mplay_batch.FrameIndex(
+            self.tmp, "s.", ".jpg", range(1, 241))
+        self.encodes = []
+
+    def encode(self, cmd, **kwargs):
+        graph = cmd[cmd.index("-lavfi") + 1]
+        step = int(re.search(r"fps=[\d.]+/(\d+)", graph).group(1))
+        width = re.search(r"scale=(\d+)", graph)
+        width = int(width.group(1)) if width else WIDTH
+        with open(cmd[cmd.index("-i") + 1]) as file_:
+            frames = file_.read().count("\nfile ")
+        size = frames // step * width ** 2 // 100
+        if "stats_mode=diff" in graph:
+            size = size * 9 // 10
+        self.encodes.append((step, width))
+        with open(cmd[-1], "wb") as file_:
+            file_.write(b"GIF89a" + struct.pack("<HH", width, width))
+            file_.write(b"\0" * (size - 10))
+
+    def plan(self, max_bytes):
+        return mplay_batch.GifBudget(max_bytes=max_bytes).plan(
+            self.index, 24, self.tmp)
+
+    def test_fits_at_full_quality(self):
+        plan = self.plan(10 ** 8)
+        self.assertEqual(
+            (plan["step"], plan["width"], plan["stats_mode"]),
+            (1, WIDTH, "full"))
+        self.assertEqual(plan["bytes"], 2400000)
+        self.assertTrue(plan["fits"])
+        self.assertEqual(plan["trials"], 1)
+
+    def test_scales_down_and_drops_frames_to_fit(self):
+        plan = self.plan(500000)
+        self.assertTrue(plan["fits"])
+        self.assertLessEqual(plan["bytes"], 500000)
+        self.assertEqual(plan["stats_mode"], "diff")
+        self.assertLess(plan["width"] ** 2 / plan["step"], WIDTH ** 2)
+        self.assertLessEqual(plan["trials"], mplay_batch.GifBudget.MAX_TRIALS)
+        self.assertEqual(len(self.encodes), plan["trials"])
+
+    def test_smallest_when_nothing_fits(self):
+        plan = self.plan(1)
+        self.assertFalse(plan["fits"])
+        self.assertEqual((plan["step"], plan["width"]), (4, 320))
+        self.assertEqual(self.encodes[-1], (4, 320))
+
+
+if __name__ == "__main__":
+    unittest.main()
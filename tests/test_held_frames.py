@@ -0,0 +1,69 @@
+"""Storing and encoding runs of identical frames once (user-017)."""
+import os
+import unittest
+
+from helpers import TempDirTestCase, mplay_batch
+
+
+class HeldRunsTest(TempDirTestCase):
+
+    def test_splits_consecutive_identical_frames(self):
+        index = mplay_batch.FrameIndex(self.tmp, "s.", ".jpg", range(1, 7))
+        hashes = {1: "a", 2: "a", 3: "a", 4: "b", 5: "a", 6: "a"}
+        self.assertEqual(
+            mplay_batch.held_runs(index, hashes),
+            [[1, 3], [4, 1], [5, 2]])
+
+    def test_unhashed_frames_and_gaps_are_never_held(self):
+        index = mplay_batch.FrameIndex(self.tmp, "s.", ".jpg", [1, 2, 4, 5])
+        hashes = {1: "a", 2: "a", 4: "a"}
+        self.assertEqual(
+            mplay_batch.held_runs(index, hashes),
+            [[1, 2], [4, 1], [5, 1]])
+
+
+class ConcatListTest(TempDirTestCase):
+
+    def concat_list(self, runs, fps=25):
+        index = mplay_batch.FrameIndex(self.tmp, "s.", ".jpg")
+        path = os.path.join(self.tmp, "list.ffconcat")
+        mplay_batch.write_concat_list(path, index, runs, fps)
+        with open(path) as file_:
+            lines = file_.read().splitlines()
+        self.assertEqual(lines[0], "ffconcat version 1.0")
+        return [
+            (os.path.basename(file_line.split("'")[1]),
+             float(duration.split()[1]))
+            for file_line, duration in zip(lines[1::2], lines[2::2])
+        ]
+
+    def test_lists_each_run_once_for_its_duration(self):
+        self.assertEqual(
+            self.concat_list([[1, 3], [4, 1], [5, 1]]),
+            [("s.1.jpg", 0.12), ("s.4.jpg", 0.04), ("s.5.jpg", 0.04)])
+
+    def test_last_run_ends_on_its_final_frame(self):
+        entries = self.concat_list([[1, 1], [2, 4]])
+        self.assertEqual(
+            entries,
+            [("s.1.jpg", 0.04), ("s.2.jpg", 0.12), ("s.5.jpg", 0.04)])
+        # The concat demuxer ignores the last duration, so the listed
+        # frames add up to the sequence length
+        self.assertAlmostEqual(sum(d for _, d in entries[:-1]) + 0.04, 0.2)
+
+    def test_quotes_paths(self):
+        index = mplay_batch.FrameIndex(self.tmp, "it's.", ".jpg")
+        path = os.path.join(self.tmp, "list.ffconcat")
+        mplay_batch.write_concat_list(path, index, [[1, 1]], 24)
+        with open(path) as file_:
+            self.assertIn("it'\\''s.1.jpg'", file_.read())
+
+
+class DefaultTest(TempDirTestCase):
+
+    def test_off_by_default(self):
+        self.assertFalse(mplay_batch.Environment().held_frames)
+
+
+if __name__ == "__main__":
+    unittest.main()
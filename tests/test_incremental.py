@@ -0,0 +1,87 @@
+"""Reusing unchanged sequences from the previous sub-version (user-016)."""
+import os
+import unittest
+
+from helpers import TempDirTestCase, mplay_batch
+
+
+class FingerprintTest(TempDirTestCase):
+
+    def fingerprint(self, index, settings=None):
+        return mplay_batch.fingerprint_frames(index, settings or {"fps": 24})
+
+    def test_same_frames_and_settings_match(self):
+        first = self.write_frames("a", "s.", ".jpg", [1, 2, 3])
+        second = self.write_frames("b", "t.", ".jpg", [1, 2, 3])
+        self.assertEqual(self.fingerprint(first), self.fingerprint(second))
+
+    def test_changes_with_content_numbering_and_settings(self):
+        index = self.write_frames("a", "s.", ".jpg", [1, 2, 3])
+        fingerprint = self.fingerprint(index)
+        self.assertNotEqual(
+            fingerprint, self.fingerprint(index, {"fps": 25}))
+        shifted = self.write_frames("b", "s.", ".jpg", [2, 3, 4])
+        self.assertNotEqual(fingerprint, self.fingerprint(shifted))
+        self.write("a/s.2.jpg", b"changed")
+        self.assertNotEqual(fingerprint, self.fingerprint(index))
+
+    def test_no_frames(self):
+        index = mplay_batch.FrameIndex(self.tmp, "s.", ".jpg")
+        self.assertIsNone(self.fingerprint(index))
+
+
+class OutputManifestTest(TempDirTestCase):
+
+    def setUp(self):
+        super(OutputManifestTest, self).setUp()
+        self.dirname = os.path.join(self.tmp, "flip", "shot_000")
+        self.write("flip/shot_000/shot_000_0.mp4", b"video")
+        self.manifest = mplay_batch.OutputManifest(self.dirname)
+
+    def test_finds_latest_entry_with_all_files(self):
+        self.manifest.add(
+            {"fingerprint": "f", "stem": "shot_000_9", "names": [".mp4"]})
+        self.manifest.add(
+            {"fingerprint": "f", "stem": "shot_000_0", "names": [".mp4"]})
+        manifest = mplay_batch.OutputManifest(self.dirname)
+        self.assertEqual(manifest.find("f")["stem"], "shot_000_0")
+        self.assertIsNone(manifest.find("other"))
+
+    def test_ignores_entries_with_missing_files(self):
+        self.manifest.add({
+            "fingerprint": "f", "stem": "shot_000_0",
+            "names": [".mp4", ".gif"]
+        })
+        self.assertIsNone(self.manifest.find("f"))
+
+    def test_links_files_under_a_new_stem(self):
+        self.manifest.add(
+            {"fingerprint": "f", "stem": "shot_000_0", "names": [".mp4"]})
+        dest = os.path.join(self.tmp, "flip", "shot_001")
+        os.makedirs(dest)
+        size = self.manifest.link(
+            self.manifest.find("f"), dest, "shot_001_0")
+        self.assertEqual(size, 5)
+        with open(os.path.join(dest, "shot_001_0.mp4"), "rb") as file_:
+            self.assertEqual(file_.read(), b"video")
+
+    def test_previous_sub_version(self):
+        env = mplay_batch.Environment()
+        index = mplay_batch.SubVersionIndex(env.flipbook_dir)
+        for _ in range(3):
+            index.allocate("comp", env.pad_sub_version)
+        seq_dir = mplay_batch.SequenceDir.from_path(
+            os.path.join(env.flipbook_dir, "comp_002"), env)
+        previous = mplay_batch.OutputManifest.previous(seq_dir)
+        self.assertEqual(
+            os.path.basename(previous.dirname), "comp_001")
+        first = mplay_batch.SequenceDir.from_path(
+            os.path.join(env.flipbook_dir, "comp_000"), env)
+        self.assertIsNone(mplay_batch.OutputManifest.previous(first))
+
+    def test_off_by_default(self):
+        self.assertFalse(mplay_batch.Environment().incremental)
+
+
+if __name__ == "__main__":
+    unittest.main()
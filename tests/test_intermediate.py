@@ -0,0 +1,63 @@
+"""Intermediate frame formats and their conversion (user-015)."""
+import os
+import unittest
+
+from helpers import TempDirTestCase, mplay_batch
+
+
+class ConvertFramesTest(TempDirTestCase):
+
+    def test_refuses_to_convert_onto_itself(self):
+        index = self.write_frames("seq", "a.", ".jpg", [1, 2])
+        with self.assertRaises(ValueError):
+            mplay_batch.convert_frames(index, index.dirname, "jpg")
+        with open(index.path(1), "rb") as file_:
+            self.assertEqual(file_.read(), b"1")
+
+
+class EncodeTaskTest(TempDirTestCase):
+
+    def setUp(self):
+        super(EncodeTaskTest, self).setUp()
+        self.patch(mplay_batch.Environment, "check_ffmpeg",
+                   lambda self, video=True: None)
+        os.environ["MPLAY_BATCH_INTERMEDIATE_FORMAT"] = "tga"
+        os.environ["MPLAY_BATCH_HELD_FRAMES"] = "0"
+        self.env = mplay_batch.Environment(
+            flipbook_dir=os.path.join(self.tmp, "flip"))
+        self.env.session = mplay_batch.MPlaySession(
+            frange=(1, 1), seqls=[], fps=24)
+
+    def writer(self, keep_video_source=True):
+        return mplay_batch.SequenceWriter(
+            self.env, video=True, keep_video_source=keep_video_source)
+
+    def found_job(self):
+        self.write_frames("flip/shot_000", "shot_000_0.", ".jpg", range(1, 5))
+        seqs = mplay_batch.find_sequences(
+            os.path.join(self.tmp, "flip"), self.env)
+        self.assertEqual(len(seqs), 1)
+        return mplay_batch.SequenceWriterJob(seqs[0])
+
+    def test_found_frames_are_kept_and_not_converted(self):
+        task = self.writer().encode_task(self.found_job())
+        self.assertFalse(task.remove_frames)
+        self.assertIsNone(task.convert)
+
+    def test_written_intermediate_is_converted_and_removed(self):
+        job = self.found_job()
+        job.intermediate = True
+        job.seq.frames_ext = "tga"
+        task = self.writer().encode_task(job)
+        self.assertTrue(task.remove_frames)
+        self.assertEqual(task.convert["ext"], "jpg")
+
+    def test_found_frames_removed_only_when_not_kept(self):
+        task = self.writer(keep_video_source=False).encode_task(
+            self.found_job())
+        self.assertTrue(task.remove_frames)
+        self.assertIsNone(task.convert)
+
+
+if __name__ == "__main__":
+    unittest.main()
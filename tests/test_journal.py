@@ -0,0 +1,96 @@
+"""Checkpointed batches that can be resumed (user-023)."""
+import os
+import unittest
+
+from helpers import TempDirTestCase, mplay_batch
+
+SETTINGS = {
+    "video": False,
+    "gif": False,
+    "keep_video_source": True,
+    "fps": 24.0,
+    "ext": "jpg",
+    "pad_seq_index": 0
+}
+
+
+class JournalTestCase(TempDirTestCase):
+    """Starts a batch of two jobs in ``flip/shot_000``."""
+
+    def setUp(self):
+        super(JournalTestCase, self).setUp()
+        self.dirname = os.path.join(self.tmp, "flip", "shot_000")
+        os.makedirs(self.dirname)
+        self.journal = mplay_batch.BatchJournal(self.dirname)
+        self.journal.start(SETTINGS, [
+            {"stem": "shot_000_0", "index": 0, "seq_name": "a",
+             "frange": [1, 4]},
+            {"stem": "shot_000_1", "index": 1, "seq_name": "b",
+             "frange": [1, 4]},
+        ])
+
+
+class BatchJournalTest(JournalTestCase):
+
+    def test_loads_stages_and_skips_a_cut_short_line(self):
+        self.journal.checkpoint("shot_000_0", "imgsave", frames_ext="tga")
+        with open(self.journal.path, "a") as file_:
+            file_.write('{"event": "stage", "stem": "shot_0')
+        batch, done = self.journal.load()
+        self.assertEqual(batch["settings"], SETTINGS)
+        self.assertEqual(list(done), ["shot_000_0"])
+        self.assertEqual(done["shot_000_0"]["imgsave"]["frames_ext"], "tga")
+
+    def test_unfinished_until_every_job_is_cleaned_up(self):
+        self.assertEqual(
+            mplay_batch.BatchJournal.unfinished(), [self.dirname])
+        self.journal.checkpoint("shot_000_0", "cleanup")
+        self.assertFalse(self.journal.finished())
+        self.journal.checkpoint("shot_000_1", "cleanup")
+        self.assertTrue(self.journal.finished())
+        self.assertEqual(mplay_batch.BatchJournal.unfinished(), [])
+
+
+class FromJournalTest(JournalTestCase):
+
+    def setUp(self):
+        super(FromJournalTest, self).setUp()
+        self.stage_dir = os.path.join(self.tmp, "stage")
+        self.journal.checkpoint(
+            "shot_000_0", "imgsave", frames_ext="tga",
+            stage_dir=self.stage_dir)
+
+    def resume(self):
+        writer = mplay_batch.SequenceWriter.from_journal(self.dirname)
+        return writer, writer.queue[0]
+
+    def test_restores_where_imgsave_left_the_frames(self):
+        os.makedirs(self.stage_dir)
+        writer, job = self.resume()
+        self.assertEqual(writer.location.dirname, self.dirname)
+        self.assertEqual(job.seq.frames_ext, "tga")
+        self.assertEqual(job.seq.stage_dir, self.stage_dir)
+        self.assertEqual(writer.queue[1].done, {})
+
+    def test_restorable_only_with_frames_on_disk(self):
+        writer, job = self.resume()
+        self.assertIsNone(job.seq.stage_dir)  # Gone since
+        self.assertFalse(writer.restorable(job))
+        self.assertFalse(writer.restorable(writer.queue[1]))
+        self.write_frames(
+            "flip/shot_000", "shot_000_0.", ".tga", range(1, 5))
+        self.assertTrue(writer.restorable(job))
+
+    def test_restorable_leaves_the_job_alone(self):
+        writer, job = self.resume()
+        job.seq.frames_ext = "png"
+        writer.restorable(job)
+        self.assertEqual(job.seq.frames_ext, "png")
+
+    def test_no_batch(self):
+        with self.assertRaises(ValueError):
+            mplay_batch.SequenceWriter.from_journal(self.tmp)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+"""Encoding in the background while MPlay writes the next sequence (user-001)."""
+import threading
+import unittest
+
+from helpers import TempDirTestCase, mplay_batch
+
+
+class PipelineTest(TempDirTestCase):
+
+    def setUp(self):
+        super(PipelineTest, self).setUp()
+        self.patch(mplay_batch.Environment, "check_ffmpeg",
+                   lambda self, video=True: None)
+        self.hou = self.fake_hou(
+            frange=(1, 3), seqls=["a", "b", "c"], frame_bytes=1)
+        self.written = []
+        self.encoded = []
+        self.second_written = threading.Event()
+        write_images = mplay_batch.SequenceWriter._write_images
+
+        def write(writer, job):
+            write_images(writer, job)
+            self.written.append(job.seq_name)
+            if job.seq_name == "b":
+                self.second_written.set()
+
+        def encode(writer, job):
+            if job.seq_name == "a":
+                # Only true if MPlay carried on writing meanwhile
+                job.overlapped = self.second_written.wait(1)
+            self.encoded.append(
+                (job.seq_name, threading.current_thread().name))
+
+        self.patch(mplay_batch.SequenceWriter, "_write_images", write)
+        self.patch(mplay_batch.SequenceWriter, "_encode_safely", encode)
+
+    def execute(self, pipeline):
+        env = mplay_batch.Environment()
+        env.pipeline = pipeline
+        writer = mplay_batch.SequenceWriter(env, video=True).save_all_seqs()
+        writer.execute()
+        return writer
+
+    def test_writes_next_sequence_while_encoding(self):
+        writer = self.execute(True)
+        self.assertTrue(writer.queue[0].overlapped)
+        self.assertEqual(self.written, ["a", "b", "c"])
+        self.assertEqual(
+            sorted(name for name, _ in self.encoded), ["a", "b", "c"])
+        main = threading.current_thread().name
+        self.assertNotIn(main, [thread for _, thread in self.encoded])
+        # Every imgsave still runs on MPlay's thread, in order
+        self.assertEqual(
+            [cmd.split()[2] for cmd in self.hou.calls
+             if cmd.startswith("imgsave")],
+            ["a", "b", "c"])
+
+    def test_encodes_each_sequence_before_the_next_without_it(self):
+        writer = self.execute(False)
+        self.assertFalse(writer.queue[0].overlapped)
+        self.assertEqual([name for name, _ in self.encoded], ["a", "b", "c"])
+
+
+if __name__ == "__main__":
+    unittest.main()
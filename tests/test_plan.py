@@ -0,0 +1,112 @@
+"""Planning a save's disk usage and time before it runs (user-025)."""
+import json
+import unittest
+
+from helpers import TempDirTestCase, mplay_batch
+import mplay_batch_plan
+
+
+def record(job, stage, frames, seconds, bytes_=0, profile=None):
+    return {"job": job, "stage": stage, "frames": frames,
+            "seconds": seconds, "bytes": bytes_, "ok": True,
+            "profile": profile}
+
+
+# 0.01s and 1000 bytes a frame to write, 0.02s and 100 bytes to encode
+HISTORY = [
+    record("old_000_0", "imgsave", 50, 0.5, 50000),
+    record("old_000_0", "video", 50, 1.0, 5000, "default"),
+    # Slower, and made with another profile
+    record("old_000_1", "imgsave", 50, 0.5, 50000),
+    record("old_000_1", "video", 50, 10.0, 50000, "delivery"),
+    # Wrote a GIF as well, so doesn't count for video only
+    record("old_000_2", "imgsave", 50, 0.5, 50000),
+    record("old_000_2", "video+gif", 50, 10.0, 50000, "default"),
+]
+
+
+class BatchPlanTest(TempDirTestCase):
+
+    def setUp(self):
+        super(BatchPlanTest, self).setUp()
+        self.patch(mplay_batch.Environment, "check_ffmpeg",
+                   lambda self, video=True: None)
+        self.fake_hou(frange=(1, 100), seqls=["a", "b"])
+        self.patch(mplay_batch_plan, "free_disk_space", lambda path: None)
+        self.env = mplay_batch.Environment()
+        self.env.catalog = False
+        self.env.pipeline = False
+
+    def plan(self, history=HISTORY, video=True, gif=False, keep=False):
+        writer = mplay_batch.SequenceWriter(
+            self.env, video=video, gif=gif, keep_video_source=keep,
+            dry_run=True).save_all_seqs()
+        return mplay_batch_plan.BatchPlan(writer, history)
+
+    def test_estimates_each_job_from_matching_history(self):
+        plan = self.plan()
+        self.assertTrue(plan.known)
+        job = plan.jobs[0]
+        self.assertEqual(job["name"], "a")
+        self.assertAlmostEqual(job["imgsave_seconds"], 1.0)
+        self.assertAlmostEqual(job["encode_seconds"], 2.0)
+        self.assertEqual(job["bytes"], 10000)
+        self.assertAlmostEqual(plan.seconds, 6.0)
+        self.assertEqual(plan.mplay_seconds, plan.seconds)
+        self.assertEqual(self.plan(keep=True).jobs[0]["bytes"], 110000)
+
+    def test_schedules_encodes_the_way_they_run(self):
+        self.env.pipeline = True
+        self.env.max_encoders = 2
+        plan = self.plan()
+        self.assertEqual([job["finish"] for job in plan.jobs], [3.0, 4.0])
+        self.assertEqual(plan.mplay_seconds, 4.0)
+        self.env.encode_daemon = True
+        plan = self.plan()
+        self.assertEqual((plan.mplay_seconds, plan.seconds), (2.0, 4.0))
+
+    def test_unknown_without_matching_history(self):
+        plan = self.plan(history=HISTORY[:2], gif=True)
+        self.assertFalse(plan.known)
+        self.assertIsNone(plan.seconds)
+        self.assertIn("No throughput history", plan.message())
+
+    def test_warns_past_the_time_budget(self):
+        self.env.max_batch_minutes = 4 / 60.0
+        plan = self.plan()
+        warning, = plan.warnings
+        self.assertTrue(warning.startswith("Saving b onward"))
+        self.assertEqual(plan.message().splitlines()[-1], warning)
+
+    def test_warns_before_filling_the_volume(self):
+        # Frames that are deleted once encoded still need room meanwhile
+        self.patch(mplay_batch_plan, "free_disk_space", lambda path: 150000)
+        self.assertEqual(self.plan().warnings, [])
+        warning, = self.plan(keep=True).warnings
+        self.assertTrue(warning.startswith("Saving b onward would fill"))
+
+    def test_warns_when_the_batch_is_over_the_size_limit(self):
+        self.env.max_size_gb = 15000 / 1024.0 ** 3
+        warning, = self.plan().warnings
+        self.assertIn("pruned down to", warning)
+
+
+class ReadHistoryTest(TempDirTestCase):
+
+    def test_reads_the_end_and_skips_bad_lines(self):
+        lines = [json.dumps(record("a", "imgsave", n, 1.0))
+                 for n in range(1, 6)]
+        path = self.write("history.jsonl", "\n".join(
+            lines[:3] + ["{"] + lines[3:]).encode("ascii"))
+        self.patch(mplay_batch_plan.BatchPlan, "HISTORY_BYTES",
+                   len("\n".join(lines[2:])) + 1)
+        self.assertEqual(
+            [r["frames"] for r in mplay_batch_plan.BatchPlan.read_history(
+                path)],
+            [4, 5])
+        self.assertEqual(mplay_batch_plan.BatchPlan.read_history(
+            self.tmp + "/missing"), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,114 @@
+"""Live encode progress from ffmpeg's progress stream (user-012)."""
+import os
+import stat
+import subprocess
+import sys
+import threading
+import unittest
+
+from helpers import TempDirTestCase, mplay_batch
+
+# Stands in for ffmpeg: reports progress on stdout, floods stderr, and
+# exits with the code it's given
+FAKE_FFMPEG = """
+import sys
+assert sys.argv[1:4] == ["-progress", "pipe:1", "-nostats"]
+sys.stderr.write("x" * 256 * 1024)
+sys.stdout.write(
+    "frame=1\\nfps=0.0\\nout_time_ms=0\\nprogress=continue\\n"
+    "frame=4\\nfps=30.5\\nprogress=end\\n")
+sys.exit(int(sys.argv[4]))
+"""
+
+
+@unittest.skipIf(sys.platform == "win32", "needs a script as an executable")
+class RunFFmpegTest(TempDirTestCase):
+
+    def setUp(self):
+        super(RunFFmpegTest, self).setUp()
+        self.script = self.write("ffmpeg", "#!{0}\n{1}".format(
+            sys.executable, FAKE_FFMPEG).encode("utf-8"))
+        os.chmod(self.script, os.stat(self.script).st_mode | stat.S_IXUSR)
+
+    def test_reports_each_progress_block(self):
+        updates = []
+        mplay_batch.run_ffmpeg(
+            [self.script, "0"], on_progress=updates.append)
+        self.assertEqual(updates, [
+            {"frame": "1", "fps": "0.0", "out_time_ms": "0",
+             "progress": "continue"},
+            {"frame": "4", "fps": "30.5", "progress": "end"}
+        ])
+
+    def test_failure_carries_stderr(self):
+        with self.assertRaises(subprocess.CalledProcessError) as raised:
+            mplay_batch.run_ffmpeg([self.script, "3"])
+        self.assertEqual(raised.exception.returncode, 3)
+        self.assertEqual(len(raised.exception.output), 256 * 1024)
+
+
+class EncodeTaskProgressTest(TempDirTestCase):
+
+    def test_counts_frames_over_every_pass(self):
+        def run_ffmpeg(cmd, on_progress=None):
+            on_progress({"frame": "2", "fps": "10"})
+
+        self.patch(mplay_batch, "run_ffmpeg", run_ffmpeg)
+        index = mplay_batch.FrameIndex(self.tmp, "s.", ".jpg", range(1, 5))
+        task = mplay_batch.EncodeTask(
+            "s", [["ffmpeg", "a.mp4"], ["ffmpeg", "b.gif"]], index, job="s")
+        updates = []
+        task.run(on_progress=lambda *args: updates.append(args))
+        self.assertEqual(updates, [
+            ("s", 2, 8, 10.0), ("s", 4, 8, 0.0),
+            ("s", 6, 8, 10.0), ("s", 8, 8, 0.0)
+        ])
+
+
+class BatchProgressTest(unittest.TestCase):
+
+    def setUp(self):
+        self.shown = []
+        self.progress = mplay_batch.BatchProgress(
+            interval=60, show=self.shown.append)
+        self.progress.expect("a", 100)
+        self.progress.expect("b", 100)
+
+    def test_silent_until_an_encode_starts(self):
+        self.assertEqual(self.progress.message(), "")
+        self.progress.report(force=True)
+        self.assertEqual(self.shown, [])
+
+    def test_summarises_running_jobs_and_the_batch(self):
+        self.progress.update("a", 100, 100, 50.0)
+        self.progress.update("b", 25, 100, 25.0)
+        message = self.progress.message()
+        self.assertTrue(message.startswith("MPlay Batch: b 25/100 (25 fps"))
+        self.assertIn("ETA 3s", message)
+        self.assertIn("Batch 125/200 frames", message)
+        self.assertNotIn("a 100/100", message)
+
+    def test_reports_at_most_once_per_interval(self):
+        self.progress.update("a", 10, 100, 5.0)
+        self.progress.update("a", 20, 100, 5.0)
+        self.assertEqual(len(self.shown), 1)
+        self.progress.report(force=True)
+        self.assertEqual(len(self.shown), 2)
+
+    def test_only_reports_from_its_own_thread(self):
+        thread = threading.Thread(
+            target=self.progress.update, args=("a", 10, 100, 5.0))
+        thread.start()
+        thread.join()
+        self.assertEqual(self.shown, [])
+        self.assertIn("a 10/100", self.progress.message())
+
+    def test_eta(self):
+        self.assertEqual(mplay_batch._format_eta(0, 0), "0s")
+        self.assertEqual(mplay_batch._format_eta(10, 0), "?")
+        self.assertEqual(mplay_batch._format_eta(900, 10), "1m30s")
+        self.assertEqual(mplay_batch._format_eta(90000, 10), "2h30m")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+"""Proxy videos written from the same decode (user-014)."""
+import os
+import unittest
+
+from helpers import TempDirTestCase, mplay_batch
+
+
+class ProxyTest(TempDirTestCase):
+
+    def test_scales_and_widths(self):
+        half = mplay_batch.Proxy.parse("0.5")
+        self.assertEqual(half.suffix, "_50pct")
+        self.assertEqual(half.scale_filter(), "scale=trunc(iw*0.5/2)*2:-2")
+        self.assertEqual(half.setting, "0.5")
+        hd = mplay_batch.Proxy.parse("1280")
+        self.assertEqual(hd.suffix, "_1280w")
+        self.assertEqual(
+            hd.scale_filter(), "scale=trunc(min(1280\\,iw)/2)*2:-2")
+        self.assertEqual(hd.setting, "1280")
+
+    def test_bad_sizes(self):
+        for value in ["0", "-2", "half"]:
+            with self.assertRaises(ValueError):
+                mplay_batch.Proxy.parse(value)
+        os.environ["MPLAY_BATCH_PROXIES"] = "0.5,big"
+        with self.assertRaises(mplay_batch.EnvironmentVariableTypeError):
+            mplay_batch.Environment()
+
+    def test_setting(self):
+        os.environ["MPLAY_BATCH_PROXIES"] = "0.25, 1920,"
+        self.assertEqual(
+            [proxy.suffix for proxy in mplay_batch.Environment().proxies],
+            ["_25pct", "_1920w"])
+        del os.environ["MPLAY_BATCH_PROXIES"]
+        self.assertEqual(mplay_batch.Environment().proxies, [])
+
+
+class ProxyCommandTest(TempDirTestCase):
+
+    def test_one_decode_writes_every_size(self):
+        env = mplay_batch.Environment()
+        env.session = mplay_batch.MPlaySession(
+            frange=(1, 1), seqls=[], fps=24)
+        self.write_frames("flip/shot_000", "shot_000_0.", ".jpg", [1, 2])
+        seq, = mplay_batch.find_sequences(env.flipbook_dir, env)
+        proxies = [
+            mplay_batch.Proxy(scale=0.5), mplay_batch.Proxy(max_width=640)]
+        cmd, = mplay_batch.SequenceWriter.format_ffmpeg_cmd_combined(
+            seq, env, gif=False, proxies=proxies)
+        self.assertEqual(cmd.count("-i"), 1)
+        graph = cmd[cmd.index("-filter_complex") + 1]
+        self.assertTrue(graph.startswith("[0:v]split=3[v][r0][r1];"))
+        self.assertIn("[r1]" + proxies[1].scale_filter() + "[r1out]", graph)
+        self.assertEqual(cmd.count("-map"), 3)
+        self.assertIn(seq.proxy_path(proxies[0]), cmd)
+        self.assertTrue(
+            seq.proxy_path(proxies[1]).endswith("shot_000_0_640w.mp4"))
+        self.assertEqual(cmd[-1], seq.proxy_path(proxies[1]))
+
+
+if __name__ == "__main__":
+    unittest.main()
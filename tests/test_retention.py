@@ -0,0 +1,187 @@
+"""Pruning old sub-versions (user-022)."""
+import os
+import time
+import unittest
+
+from helpers import TempDirTestCase, mplay_batch
+import mplay_batch_daemon
+import mplay_batch_retention
+
+NOW = 1000000000.0
+DAY = 24 * 60 * 60
+
+
+def sub_version(name, number, bytes_=0, linked=None, age=DAY):
+    return {
+        "dirname": "/flip/{0}_{1:03d}".format(name, number),
+        "name": name,
+        "sub_version": "{0:03d}".format(number),
+        "bytes": bytes_,
+        "linked": linked or {},
+        "mtime": NOW - age
+    }
+
+
+def pruned_dirnames(pruned):
+    return sorted(entry["dirname"] for entry, _ in pruned)
+
+
+class SelectTest(unittest.TestCase):
+
+    def select(self, policy, usage, protected=()):
+        return policy.select(usage, protected, now=NOW)
+
+    def test_keep_spares_newest_of_each_name(self):
+        usage = [sub_version("a", i, 10) for i in range(4)]
+        usage.append(sub_version("b", 0, 10))
+        pruned, total, freed = self.select(
+            mplay_batch_retention.RetentionPolicy(keep=2), usage)
+        self.assertEqual(
+            pruned_dirnames(pruned), ["/flip/a_000", "/flip/a_001"])
+        self.assertEqual((total, freed), (50, 20))
+
+    def test_never_prunes_recent_protected_or_newest(self):
+        usage = [
+            sub_version("a", 0, 10, age=60),
+            sub_version("a", 1, 10),
+            sub_version("a", 2, 10),
+        ]
+        pruned, _, _ = self.select(
+            mplay_batch_retention.RetentionPolicy(max_age=1), usage,
+            protected=["/flip/a_001"])
+        self.assertEqual(pruned, [])
+
+    def test_max_age(self):
+        usage = [
+            sub_version("a", 0, 10, age=10 * DAY),
+            sub_version("a", 1, 10, age=2 * DAY),
+            sub_version("a", 2, 10, age=10 * DAY),
+        ]
+        pruned, _, _ = self.select(
+            mplay_batch_retention.RetentionPolicy(max_age=5 * DAY), usage)
+        self.assertEqual(pruned_dirnames(pruned), ["/flip/a_000"])
+
+    def test_max_bytes_prunes_least_recent_first(self):
+        usage = [
+            sub_version("a", 0, 100, age=3 * DAY),
+            sub_version("a", 1, 100, age=2 * DAY),
+            sub_version("a", 2, 100, age=DAY),
+        ]
+        pruned, total, freed = self.select(
+            mplay_batch_retention.RetentionPolicy(max_bytes=200), usage)
+        self.assertEqual(pruned_dirnames(pruned), ["/flip/a_000"])
+        self.assertEqual((total, freed), (300, 100))
+
+    def test_links_within_one_sub_version_are_freed_with_it(self):
+        # Held frames: three links to one inode, all in a_000
+        usage = [
+            sub_version("a", 0, 0, {(1, 1): (100, 3, 3)}, age=3 * DAY),
+            sub_version("a", 1, 100, age=2 * DAY),
+            sub_version("a", 2, 100, age=DAY),
+        ]
+        pruned, total, freed = self.select(
+            mplay_batch_retention.RetentionPolicy(max_bytes=200), usage)
+        self.assertEqual(pruned_dirnames(pruned), ["/flip/a_000"])
+        self.assertEqual((total, freed), (300, 100))
+
+    def test_links_across_sub_versions_freed_with_the_last(self):
+        # A reused file, linked into a_000 and a_001
+        shared = (100, 2, 1)
+        usage = [
+            sub_version("a", 0, 0, {(1, 1): shared}, age=3 * DAY),
+            sub_version("a", 1, 0, {(1, 1): shared}, age=2 * DAY),
+            sub_version("a", 2, 100, age=DAY),
+        ]
+        pruned, total, freed = self.select(
+            mplay_batch_retention.RetentionPolicy(max_bytes=100), usage)
+        self.assertEqual(
+            pruned_dirnames(pruned), ["/flip/a_000", "/flip/a_001"])
+        self.assertEqual((total, freed), (200, 100))
+
+    def test_links_outside_the_flipbook_dir_are_never_freed(self):
+        usage = [
+            sub_version("a", 0, 0, {(1, 1): (100, 2, 1)}, age=3 * DAY),
+            sub_version("a", 1, 0),
+        ]
+        pruned, _, freed = self.select(
+            mplay_batch_retention.RetentionPolicy(max_bytes=1), usage)
+        self.assertEqual(pruned_dirnames(pruned), ["/flip/a_000"])
+        self.assertEqual(freed, 0)
+
+
+@unittest.skipUnless(hasattr(os, "link"), "needs hardlinks")
+class MeasureTest(TempDirTestCase):
+
+    def test_counts_links_per_sub_version(self):
+        first = self.write("flip/a_000/a_000_0.1.jpg", b"x" * 10)
+        for frame in (2, 3):
+            os.link(first, os.path.join(
+                self.tmp, "flip/a_000/a_000_0.{0}.jpg".format(frame)))
+        os.link(first, os.path.join(self.tmp, "flip/a_000/../a_000.mp4"))
+        self.write("flip/a_000/a_000_0.4.jpg", b"y" * 5)
+        self.write("flip/a_001/a_001_0.mp4", b"z" * 7)
+
+        usage = mplay_batch_retention.measure_sub_versions(
+            os.path.join(self.tmp, "flip"), workers=2)
+        self.assertEqual([entry["name"] for entry in usage], ["a", "a"])
+        self.assertEqual(usage[0]["bytes"], 5)
+        self.assertEqual(list(usage[0]["linked"].values()), [(10, 4, 3)])
+        self.assertEqual((usage[1]["bytes"], usage[1]["linked"]), (7, {}))
+
+
+class PruneTest(TempDirTestCase):
+
+    def setUp(self):
+        super(PruneTest, self).setUp()
+        self.flip = os.path.join(self.tmp, "flip")
+        old = time.time() - 2 * DAY
+        for number in range(3):
+            path = self.write("flip/a_00{0}/a_00{0}_0.mp4".format(number))
+            os.utime(path, (old, old))
+            os.utime(os.path.dirname(path), (old, old))
+        self.policy = mplay_batch_retention.RetentionPolicy(keep=1)
+
+    def remaining(self):
+        return sorted(
+            name for name in os.listdir(self.flip) if not name.startswith("."))
+
+    def test_dry_run_only_reports(self):
+        report = mplay_batch_retention.prune_flipbook_dir(
+            self.flip, self.policy, dry_run=True)
+        self.assertEqual(
+            [(os.path.basename(result["dirname"]), result["removed"])
+             for result in report["pruned"]],
+            [("a_001", False), ("a_000", False)])
+        self.assertEqual((report["total"], report["freed"]), (3, 2))
+        self.assertEqual(self.remaining(), ["a_000", "a_001", "a_002"])
+
+    def test_removes_all_but_queued_encodes(self):
+        index = mplay_batch.FrameIndex(self.tmp, "s.", ".jpg")
+        mplay_batch_daemon.EncodeDaemon().submit(mplay_batch.EncodeTask(
+            "a", [], index, seq_dirname=self.flip + "/a_001"))
+        report = mplay_batch_retention.prune_flipbook_dir(
+            self.flip, self.policy)
+        self.assertEqual(
+            [result["removed"] for result in report["pruned"]], [True])
+        self.assertEqual(self.remaining(), ["a_001", "a_002"])
+        self.assertEqual(os.listdir(os.path.join(
+            self.flip, mplay_batch.SubVersionIndex.META_DIR, "trash")), [])
+
+    def test_background_prune_runs_at_most_once_an_interval(self):
+        started = []
+        self.patch(mplay_batch_retention, "_spawn_detached",
+                   lambda cmd, log_path: started.append(cmd))
+        env = mplay_batch.Environment()
+        mplay_batch_retention.prune_in_background(env)
+        self.assertEqual(started, [])
+        env.keep_sub_versions = 1
+        os.makedirs(os.path.join(
+            self.flip, mplay_batch.SubVersionIndex.META_DIR))
+        mplay_batch_retention.prune_in_background(env)
+        mplay_batch_retention.prune_in_background(env)
+        self.assertEqual(len(started), 1)
+        self.assertEqual(started[0][-2:], ["prune", env.flipbook_dir])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,45 @@
+"""Querying MPlay once per save instead of once per sequence (user-005)."""
+import unittest
+
+from helpers import TempDirTestCase, mplay_batch
+
+
+class MPlaySessionTest(TempDirTestCase):
+
+    def setUp(self):
+        super(MPlaySessionTest, self).setUp()
+        self.hou = self.fake_hou(frange=(5, 9), seqls=["a", "b", "c"])
+        self.fps_calls = []
+        self.hou.fps = lambda: self.fps_calls.append(True) or 25.0
+
+    def test_queries_each_value_once(self):
+        env = mplay_batch.Environment()
+        writer = mplay_batch.SequenceWriter(env, dry_run=True).save_all_seqs()
+        self.assertEqual(
+            [job.seq.frange for job in writer.queue], [(5, 9)] * 3)
+        self.assertEqual(env.fps, 25.0)
+        self.assertEqual(env.fps, 25.0)
+        self.assertEqual(self.hou.calls, ["seqls", "frange"])
+        self.assertEqual(len(self.fps_calls), 1)
+
+    def test_refresh_queries_again(self):
+        session = mplay_batch.MPlaySession()
+        self.assertEqual(session.seqls, ["a", "b", "c"])
+        self.hou.seqls.append("d")
+        self.assertEqual(session.seqls, ["a", "b", "c"])
+        session.refresh()
+        self.assertEqual(session.seqls, ["a", "b", "c", "d"])
+        self.assertEqual(self.hou.calls, ["seqls", "seqls"])
+
+    def test_given_values_never_query_mplay(self):
+        session = mplay_batch.MPlaySession(
+            frange=(1, 2), seqls=["x"], fps=30.0)
+        self.assertEqual(
+            (session.frange, session.seqls, session.fps),
+            ((1, 2), ["x"], 30.0))
+        self.assertEqual(self.hou.calls, [])
+        self.assertEqual(self.fps_calls, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
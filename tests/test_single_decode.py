@@ -0,0 +1,67 @@
+"""Writing the video and GIF from one decode of the frames (user-003)."""
+import os
+import unittest
+
+from helpers import TempDirTestCase, mplay_batch
+
+
+class CombinedTaskTest(TempDirTestCase):
+
+    def setUp(self):
+        super(CombinedTaskTest, self).setUp()
+        self.patch(mplay_batch.Environment, "check_ffmpeg",
+                   lambda self, video=True: None)
+        self.env = mplay_batch.Environment()
+        self.env.session = mplay_batch.MPlaySession(
+            frange=(1, 1), seqls=[], fps=24)
+        self.write_frames("flip/shot_000", "shot_000_0.", ".jpg", range(1, 5))
+        seq, = mplay_batch.find_sequences(self.env.flipbook_dir, self.env)
+        self.job = mplay_batch.SequenceWriterJob(seq)
+
+    def task(self, video=True, gif=True):
+        writer = mplay_batch.SequenceWriter(self.env, video=video, gif=gif)
+        task = writer.encode_task(self.job)
+        if task and task.palette:
+            self.addCleanup(os.remove, task.palette)
+        return task
+
+    def test_one_command_writes_every_output(self):
+        task = self.task()
+        cmd, = task.commands
+        self.assertEqual(cmd.count("-i"), 1)
+        self.assertEqual(task.stages, ["video+gif"])
+        self.assertEqual(cmd.count("-map"), 2)
+        self.assertEqual(cmd[-1], self.job.seq.gif_path)
+        self.assertIn(self.job.seq.video_path, cmd)
+        graph = cmd[cmd.index("-filter_complex") + 1]
+        self.assertTrue(graph.startswith("[0:v]split=2[v][g];"))
+
+    def test_long_gif_palette_written_alongside_video(self):
+        self.patch(mplay_batch, "GIF_SINGLE_PASS_MAX_FRAMES", 2)
+        task = self.task()
+        first, second = task.commands
+        self.assertEqual(first.count("-i"), 1)
+        self.assertEqual(first[-1], task.palette)
+        self.assertIn(self.job.seq.video_path, first)
+        # Only the palette is read alongside the frames again
+        self.assertEqual(second.count("-i"), 2)
+        self.assertIn(task.palette, second)
+        self.assertEqual(second[-1], self.job.seq.gif_path)
+        self.assertEqual(task.stages, ["video+palettegen", "paletteuse"])
+
+    def test_single_output_has_no_split(self):
+        cmd, = self.task(gif=False).commands
+        graph = cmd[cmd.index("-filter_complex") + 1]
+        self.assertNotIn("split", graph)
+        self.assertEqual(cmd[-1], self.job.seq.video_path)
+
+    def test_nothing_to_encode(self):
+        self.assertIsNone(self.task(video=False, gif=False))
+        self.assertEqual(
+            mplay_batch.SequenceWriter.format_ffmpeg_cmd_combined(
+                self.job.seq, self.env, video=False, gif=False),
+            [])
+
+
+if __name__ == "__main__":
+    unittest.main()
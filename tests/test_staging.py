@@ -0,0 +1,71 @@
+"""Staging throwaway frames on a fast local volume (user-008)."""
+import os
+import unittest
+
+from helpers import TempDirTestCase, mplay_batch
+
+
+class StagingTest(TempDirTestCase):
+
+    def setUp(self):
+        super(StagingTest, self).setUp()
+        self.patch(mplay_batch.Environment, "check_ffmpeg",
+                   lambda self, video=True: None)
+        self.fake_hou(frange=(1, 3), seqls=["a", "b", "c"], frame_bytes=64)
+        self.stage = os.path.join(self.tmp, "stage")
+        os.makedirs(self.stage)
+        self.env = mplay_batch.Environment(staging_dir=self.stage)
+        self.env.pipeline = False
+        self.encoded = []
+
+    def encode(self, job):
+        index = job.seq.frame_index
+        self.encoded.append((
+            os.path.dirname(index.dirname) == self.stage,
+            len(mplay_batch.FrameIndex.scan(
+                index.dirname, index.prefix, index.suffix))
+        ))
+
+    def execute(self, keep_video_source=False, encode=None):
+        encode = encode or self.encode
+        self.patch(mplay_batch.SequenceWriter, "encode",
+                   lambda writer, job: encode(job))
+        self.writer = mplay_batch.SequenceWriter(
+            self.env, video=True, keep_video_source=keep_video_source)
+        self.writer.save_all_seqs().execute()
+
+    def test_stages_once_a_frame_size_is_known(self):
+        self.execute()
+        # The first job is written where it belongs, to size frames from
+        self.assertEqual(self.encoded, [(False, 3), (True, 3), (True, 3)])
+        self.assertEqual(os.listdir(self.stage), [])
+
+    def test_kept_frames_are_not_staged(self):
+        self.execute(keep_video_source=True)
+        self.assertEqual(self.encoded, [(False, 3)] * 3)
+
+    def test_not_staged_without_room(self):
+        self.patch(mplay_batch, "free_disk_space",
+                   lambda path: mplay_batch.STAGING_RESERVE_BYTES)
+        self.execute()
+        self.assertEqual(self.encoded, [(False, 3)] * 3)
+
+    def test_failed_encode_keeps_frames_in_the_sub_version(self):
+        def fail(job):
+            raise mplay_batch.FFmpegFailedError(job.seq.glob_pattern, "")
+
+        with self.assertRaises(mplay_batch.FFmpegBatchFailedError):
+            self.execute(encode=fail)
+        self.assertEqual(os.listdir(self.stage), [])
+        for job in self.writer.queue:
+            self.assertIsNone(job.seq.stage_dir)
+            self.assertEqual(len(job.seq.scan_frames()), 3)
+
+    def test_disabled(self):
+        self.env.staging_dir = ""
+        self.execute()
+        self.assertEqual(self.encoded, [(False, 3)] * 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
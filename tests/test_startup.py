@@ -0,0 +1,55 @@
+"""Menu click startup (user-018)."""
+import os
+import subprocess
+import sys
+import unittest
+
+from helpers import ROOT, TempDirTestCase, mplay_batch
+
+
+class LazySettingsTest(TempDirTestCase):
+
+    def test_flipbook_dir_created_when_used(self):
+        env = mplay_batch.Environment()
+        flip = os.path.join(self.tmp, "flip")
+        self.assertFalse(os.path.exists(flip))
+        self.assertEqual(env.flipbook_dir, flip)
+        self.assertTrue(os.path.isdir(flip))
+
+    def test_encode_profile_checked_when_used(self):
+        os.environ["MPLAY_BATCH_ENCODE_PROFILE"] = "nope"
+        env = mplay_batch.Environment()
+        with self.assertRaises(mplay_batch.UnsupportedEncodeProfileError):
+            env.encode_profile
+        env.encode_profile = "preview"
+        self.assertEqual(env.encode_profile.name, "preview")
+
+    def test_staging_dir_checked_when_used(self):
+        os.environ["MPLAY_BATCH_STAGING_DIR"] = os.path.join(
+            self.tmp, "missing")
+        env = mplay_batch.Environment()
+        with self.assertRaises(ValueError):
+            env.staging_dir
+        env.staging_dir = ""
+        self.assertEqual(env.staging_dir, "")
+
+
+class ImportTest(unittest.TestCase):
+
+    def test_menu_import_leaves_other_modules_unloaded(self):
+        script = (
+            "import sys\n"
+            "sys.path.insert(0, sys.argv[1])\n"
+            "import mplay_batch\n"
+            "print(sorted(name for name in sys.modules\n"
+            "             if name.startswith('mplay_batch_')))\n"
+        )
+        out = subprocess.check_output([
+            sys.executable, "-c", script,
+            os.path.join(ROOT, "houdini18.5", "python2.7libs")
+        ])
+        self.assertEqual(out.decode("ascii").strip(), "[]")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+"""Per-stage timings and opt-in profiling (user-011)."""
+import json
+import os
+import unittest
+
+from helpers import TempDirTestCase, mplay_batch
+
+
+def read_lines(path):
+    with open(path) as file_:
+        return [json.loads(line) for line in file_]
+
+
+class StageRecorderTest(TempDirTestCase):
+
+    def setUp(self):
+        super(StageRecorderTest, self).setUp()
+        self.path = os.path.join(self.tmp, "stats.jsonl")
+        self.history = os.path.join(self.tmp, "history.jsonl")
+        self.recorder = mplay_batch.StageRecorder(
+            self.path, "shot_000_0", history_path=self.history)
+
+    def test_records_each_stage(self):
+        ticks = iter([1.0, 3.0])
+        self.patch(mplay_batch, "_timer", lambda: next(ticks))
+        with self.recorder.stage("imgsave", history=True) as record:
+            record["frames"] = 10
+            record["bytes"] = 2048
+        record, = self.recorder.records
+        self.assertEqual(record["job"], "shot_000_0")
+        self.assertTrue(record["ok"])
+        self.assertEqual(record["seconds"], 2.0)
+        self.assertEqual(record["fps"], 5.0)
+        self.assertEqual(read_lines(self.path), [record])
+        self.assertEqual(read_lines(self.history), [record])
+
+    def test_failed_stage_recorded_but_not_in_history(self):
+        with self.assertRaises(ValueError):
+            with self.recorder.stage("video", frames=10, history=True):
+                raise ValueError("ffmpeg")
+        record, = read_lines(self.path)
+        self.assertFalse(record["ok"])
+        self.assertFalse(os.path.exists(self.history))
+
+    def test_unwritable_stats_never_fail_the_stage(self):
+        recorder = mplay_batch.StageRecorder(
+            os.path.join(self.tmp, "missing", "stats.jsonl"), "job")
+        with recorder.stage("cleanup"):
+            pass
+        self.assertTrue(recorder.records[0]["ok"])
+
+
+class WriterStatsTest(TempDirTestCase):
+
+    def setUp(self):
+        super(WriterStatsTest, self).setUp()
+        self.fake_hou(frange=(1, 4), seqls=["a", "b"], frame_bytes=16)
+        self.env = mplay_batch.Environment()
+        self.env.catalog = False
+
+    def test_writes_stages_next_to_the_flipbook(self):
+        writer = mplay_batch.SequenceWriter(self.env).save_all_seqs()
+        writer.execute()
+        records = read_lines(writer.queue[0].seq.stats_path)
+        self.assertEqual(
+            [(r["job"], r["stage"], r["frames"], r["bytes"]) for r in records],
+            [("bench_000_0", "imgsave", 4, 64),
+             ("bench_000_1", "imgsave", 4, 64)])
+
+    def test_off(self):
+        self.env.stats = False
+        writer = mplay_batch.SequenceWriter(self.env).save_all_seqs()
+        writer.execute()
+        self.assertFalse(os.path.exists(writer.queue[0].seq.stats_path))
+        self.assertEqual(len(writer.queue[0].stats.records), 1)
+
+
+class ProfileTest(TempDirTestCase):
+
+    def test_dumps_a_profile_when_asked(self):
+        os.environ["MPLAY_BATCH_PROFILE"] = "1"
+        mplay_batch.main({"toolname": "encode_status"})
+        dumps = os.listdir(os.path.join(mplay_batch.cache_dir(), "profiles"))
+        self.assertEqual(len(dumps), 1)
+        self.assertTrue(dumps[0].startswith("mplay_batch_encode_status_"))
+
+    def test_setting_must_be_a_number(self):
+        os.environ["MPLAY_BATCH_PROFILE"] = "yes"
+        with self.assertRaises(mplay_batch.EnvironmentVariableTypeError):
+            mplay_batch.main({"toolname": "encode_status"})
+
+
+if __name__ == "__main__":
+    unittest.main()
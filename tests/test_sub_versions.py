@@ -0,0 +1,85 @@
+"""Indexed, locked sub-version allocation (user-006)."""
+import os
+import subprocess
+import sys
+import unittest
+
+from helpers import ROOT, TempDirTestCase, mplay_batch
+
+
+class SubVersionIndexTest(TempDirTestCase):
+
+    def setUp(self):
+        super(SubVersionIndexTest, self).setUp()
+        self.flip = os.path.join(self.tmp, "flip")
+        os.makedirs(self.flip)
+        self.index = mplay_batch.SubVersionIndex(self.flip)
+
+    def test_allocates_padded_directories_per_name(self):
+        self.assertEqual(self.index.allocate("comp", 3), "000")
+        self.assertEqual(self.index.allocate("comp", 3), "001")
+        self.assertEqual(self.index.allocate("fx", 3), "000")
+        self.assertTrue(os.path.isdir(os.path.join(self.flip, "comp_001")))
+
+    def test_peek_creates_nothing(self):
+        self.index.allocate("comp")
+        self.assertEqual(self.index.peek("comp", 2), "01")
+        self.assertEqual(self.index.peek("fx"), "0")
+        self.assertEqual(
+            sorted(os.listdir(self.flip)),
+            [mplay_batch.SubVersionIndex.META_DIR, "comp_0"])
+
+    def test_follows_directories_made_without_it(self):
+        self.index.allocate("comp")
+        os.mkdir(os.path.join(self.flip, "comp_4"))
+        self.assertEqual(self.index.allocate("comp"), "5")
+        self.assertEqual(self.index.previous("comp", 5), 4)
+
+    def test_skips_taken_directories_it_missed(self):
+        self.index.allocate("comp")
+        # Made within the same mtime tick, so the index looks current
+        mtime = os.stat(self.flip).st_mtime
+        os.mkdir(os.path.join(self.flip, "comp_1"))
+        os.utime(self.flip, (mtime, mtime))
+        self.assertEqual(self.index.allocate("comp"), "2")
+
+    def test_previous(self):
+        for _ in range(3):
+            self.index.allocate("comp")
+        self.assertEqual(self.index.previous("comp", 2), 1)
+        self.assertEqual(self.index.previous("comp", 7), 2)
+        self.assertIsNone(self.index.previous("comp", 0))
+        self.assertIsNone(self.index.previous("fx", 2))
+
+    def test_scan_keeps_latest_two(self):
+        for name in ["comp_1", "comp_7", "comp_3", "fx_2", "notes"]:
+            os.mkdir(os.path.join(self.flip, name))
+        self.assertEqual(
+            self.index.scan(), ({"comp": 7, "fx": 2}, {"comp": 3}))
+
+    def test_separate_processes_never_share_a_sub_version(self):
+        script = (
+            "import sys\n"
+            "sys.path.insert(0, sys.argv[1])\n"
+            "import mplay_batch\n"
+            "index = mplay_batch.SubVersionIndex(sys.argv[2])\n"
+            "for _ in range(10):\n"
+            "    print(index.allocate('comp'))\n"
+        )
+        procs = [
+            subprocess.Popen([
+                sys.executable, "-c", script,
+                os.path.join(ROOT, "houdini18.5", "python2.7libs"), self.flip
+            ], stdout=subprocess.PIPE)
+            for _ in range(4)
+        ]
+        allocated = []
+        for proc in procs:
+            allocated += proc.communicate()[0].decode("ascii").split()
+            self.assertEqual(proc.returncode, 0)
+        self.assertEqual(
+            sorted(allocated, key=int), [str(n) for n in range(40)])
+
+
+if __name__ == "__main__":
+    unittest.main()